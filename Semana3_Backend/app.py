@@ -9,6 +9,11 @@ from flask_jwt_extended import JWTManager
 from config import get_config
 from models.base import db
 from services.crypto_service import init_crypto_service
+from services.audit_queue import audit_queue
+from services.audit_archive import audit_archive
+from services.user_cache import user_summary_cache
+from services.bcrypt_executor import bcrypt_executor, login_admission
+from services.rsa_key_pool import rsa_key_pool
 
 # Import routes
 from routes.auth_routes import auth_bp
@@ -50,6 +55,15 @@ def create_app(config_name=None):
          methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
     jwt = JWTManager(app)
     
+    # Cola de auditoría con escritura por lotes
+    audit_queue.init_app(app)
+    audit_archive.init_app(app)
+    user_summary_cache.init_app(app)
+    
+    # Pool de bcrypt y límites de intentos de login
+    bcrypt_executor.init_app(app)
+    login_admission.init_app(app)
+    
     # Inicializar servicio criptográfico
     with app.app_context():
         aes_key = app.config.get('AES_MASTER_KEY')
@@ -58,7 +72,22 @@ def create_app(config_name=None):
             print("⚠️  WARNING: Generando clave AES temporal. Configura AES_MASTER_KEY en producción.")
             aes_key = base64.b64encode(os.urandom(32)).decode()
         
-        init_crypto_service(aes_key)
+        # Factor de trabajo bcrypt: el mismo en todos los procesos
+        # (se calibra una vez con python medsafe.py calibrate-bcrypt)
+        bcrypt_rounds = max(
+            app.config.get('BCRYPT_LOG_ROUNDS', 12),
+            app.config.get('BCRYPT_MIN_ROUNDS', 10)
+        )
+        
+        init_crypto_service(
+            aes_key,
+            max_workers=app.config.get('CRYPTO_MAX_WORKERS', 4),
+            bcrypt_rounds=bcrypt_rounds,
+            key_cache_size=app.config.get('RSA_KEY_CACHE_SIZE', 128)
+        )
+        
+        # Reserva de pares RSA pre-generados en segundo plano
+        rsa_key_pool.init_app(app)
     
     # Registrar blueprints (rutas)
     app.register_blueprint(auth_bp, url_prefix='/api/v1/auth')
@@ -133,11 +162,12 @@ def create_app(config_name=None):
     return app
 
 
-# Crear aplicación
-app = create_app()
-
-
 if __name__ == '__main__':
+    # La aplicación se crea solo aquí (o en wsgi.py): los procesos del pool
+    # bcrypt re-importan este módulo como __mp_main__ y no deben levantar
+    # otra aplicación con sus hilos
+    app = create_app()
+    
     # Crear tablas si no existen
     with app.app_context():
         db.create_all()
@@ -8,6 +8,8 @@ from dotenv import load_dotenv
 # Cargar variables de entorno desde .env
 load_dotenv()
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+
 
 class Config:
     """Configuración base de la aplicación"""
@@ -35,6 +37,20 @@ class Config:
     
     # Cryptography
     AES_MASTER_KEY = os.getenv('AES_MASTER_KEY', '')
+    CRYPTO_MAX_WORKERS = int(os.getenv('CRYPTO_MAX_WORKERS', 4))  # Hilos para descifrado por lotes
+    RSA_KEY_CACHE_SIZE = int(os.getenv('RSA_KEY_CACHE_SIZE', 128))  # Claves RSA deserializadas en caché
+    # Formato de cifrado de historias nuevas: 1 = AES-CBC + SHA-256, 2 = AES-GCM por campo,
+    # 3 = AES-GCM de un paquete con todos los campos (comprimido desde RECORD_COMPRESS_MIN_BYTES),
+    # 4 y 5 = como 2 y 3 con el id de la historia en los datos asociados
+    RECORD_ENCRYPTION_VERSION = int(os.getenv('RECORD_ENCRYPTION_VERSION', 5))
+    RECORD_COMPRESS_MIN_BYTES = int(os.getenv('RECORD_COMPRESS_MIN_BYTES', 256))
+    # Pares RSA pre-generados por tamaño, formato "bits:cantidad,..."
+    RSA_POOL_SIZES = {
+        int(size): int(count)
+        for size, count in (
+            item.split(':') for item in os.getenv('RSA_POOL_SIZES', '2048:4,4096:2').split(',') if item
+        )
+    }
     
     # CORS
     CORS_ORIGINS = ['http://localhost:3000', 'http://localhost:5173']  # React dev servers
@@ -46,9 +62,41 @@ class Config:
     # Pagination
     DEFAULT_PAGE_SIZE = 10
     MAX_PAGE_SIZE = 100
+    BULK_MAX_RECORDS = int(os.getenv('BULK_MAX_RECORDS', 500))  # Historias por POST /medical-records/bulk
+    STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 200))  # Filas por lote en exportaciones NDJSON
+    IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 1000))  # Filas por bloque al importar pacientes
+    IMPORT_REJECTS_DIR = os.getenv('IMPORT_REJECTS_DIR', os.path.join(basedir, 'instance', 'imports'))
+    BACKUP_CHUNK_SIZE = int(os.getenv('BACKUP_CHUNK_SIZE', 1000))  # Filas por bloque en medsafe.py backup
+    BACKUP_DIR = os.getenv('BACKUP_DIR', os.path.join(basedir, 'instance', 'backups'))
     
     # Bcrypt
-    BCRYPT_LOG_ROUNDS = 12  # Factor de trabajo para bcrypt
+    BCRYPT_LOG_ROUNDS = int(os.getenv('BCRYPT_LOG_ROUNDS', 12))  # Factor de trabajo para bcrypt
+    # Latencia de verificación objetivo de python medsafe.py calibrate-bcrypt
+    BCRYPT_TARGET_MS = float(os.getenv('BCRYPT_TARGET_MS', 250))
+    BCRYPT_MIN_ROUNDS = int(os.getenv('BCRYPT_MIN_ROUNDS', 10))  # Piso del costo (también al arrancar)
+    BCRYPT_MAX_ROUNDS = int(os.getenv('BCRYPT_MAX_ROUNDS', 16))
+    BCRYPT_REHASH_ON_LOGIN = os.getenv('BCRYPT_REHASH_ON_LOGIN', 'True') == 'True'
+    BCRYPT_POOL_WORKERS = int(os.getenv('BCRYPT_POOL_WORKERS', 0))  # 0 = la mitad de las CPUs
+    BCRYPT_POOL_MAX_PENDING = int(os.getenv('BCRYPT_POOL_MAX_PENDING', 0))  # 0 = 4 por worker
+    BCRYPT_POOL_TIMEOUT = float(os.getenv('BCRYPT_POOL_TIMEOUT', 10.0))  # segundos
+    
+    # Límite de intentos de login (ventana deslizante)
+    LOGIN_WINDOW_SECONDS = int(os.getenv('LOGIN_WINDOW_SECONDS', 60))
+    LOGIN_MAX_ATTEMPTS_PER_USER = int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_USER', 5))
+    LOGIN_MAX_ATTEMPTS_PER_IP = int(os.getenv('LOGIN_MAX_ATTEMPTS_PER_IP', 20))
+    
+    # Auditoría (escritura diferida por lotes)
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 100))  # Volcar al llegar a N eventos
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 2.0))  # o cada N segundos
+    AUDIT_SPOOL_DIR = os.getenv('AUDIT_SPOOL_DIR', os.path.join(basedir, 'instance', 'audit_spool'))
+    AUDIT_SPOOL_FSYNC = os.getenv('AUDIT_SPOOL_FSYNC', 'False') == 'True'  # fsync por evento
+    AUDIT_ARCHIVE_DIR = os.getenv('AUDIT_ARCHIVE_DIR', os.path.join(basedir, 'instance', 'audit_archive'))
+    AUDIT_HOT_MONTHS = int(os.getenv('AUDIT_HOT_MONTHS', 3))  # Meses que quedan en audit_logs al archivar
+    AUDIT_ARCHIVE_CACHE_SEGMENTS = int(os.getenv('AUDIT_ARCHIVE_CACHE_SEGMENTS', 4))  # Segmentos en memoria
+    AUDIT_CHECKPOINT_INTERVAL = int(os.getenv('AUDIT_CHECKPOINT_INTERVAL', 1000))  # Filas por checkpoint firmado
+    AUDIT_SIGNING_USER = os.getenv('AUDIT_SIGNING_USER', 'admin')  # Usuario cuya ClaveRSA firma los checkpoints
+    USER_SUMMARY_TTL = int(os.getenv('USER_SUMMARY_TTL', 60))  # Segundos en caché del autor de cada log
+    USER_SUMMARY_CACHE_SIZE = int(os.getenv('USER_SUMMARY_CACHE_SIZE', 1024))
 
 
 class DevelopmentConfig(Config):
@@ -79,6 +127,7 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(seconds=300)
+    RSA_POOL_SIZES = {}  # Sin hilo de pre-generación en tests
 
 
 # Diccionario de configuraciones
@@ -59,6 +59,23 @@ CREATE INDEX idx_pacientes_cedula ON pacientes(cedula);
 CREATE INDEX idx_pacientes_doctor_id ON pacientes(doctor_id);
 CREATE INDEX idx_pacientes_nombre ON pacientes(nombre);
 CREATE INDEX idx_pacientes_apellido ON pacientes(apellido);
+-- Autocompletado por prefijo (LIKE 'abc%') con cualquier collation
+CREATE INDEX idx_pacientes_cedula_prefix ON pacientes(cedula varchar_pattern_ops);
+CREATE INDEX idx_pacientes_nombre_prefix ON pacientes(lower(nombre) text_pattern_ops);
+CREATE INDEX idx_pacientes_apellido_prefix ON pacientes(lower(apellido) text_pattern_ops);
+
+-- ============================================
+-- Tabla: paciente_tokens (índice ciego de alergias/antecedentes)
+-- ============================================
+CREATE TABLE IF NOT EXISTS paciente_tokens (
+    id SERIAL PRIMARY KEY,
+    paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
+    campo VARCHAR(20) NOT NULL,  -- 'alergias' o 'antecedentes'
+    token VARCHAR(64) NOT NULL,  -- HMAC-SHA256 de la palabra normalizada
+    CONSTRAINT uq_paciente_token UNIQUE (paciente_id, campo, token)
+);
+
+CREATE INDEX idx_paciente_tokens_campo_token ON paciente_tokens(campo, token);
 
 -- ============================================
 -- Tabla: historias_clinicas
@@ -68,19 +85,21 @@ CREATE TABLE IF NOT EXISTS historias_clinicas (
     paciente_id INTEGER NOT NULL REFERENCES pacientes(id) ON DELETE CASCADE,
     doctor_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE RESTRICT,
     fecha_consulta DATE NOT NULL,
-    sintomas_encrypted BYTEA NOT NULL,
-    diagnostico_encrypted BYTEA NOT NULL,
+    sintomas_encrypted BYTEA,  -- Campos individuales: formatos 1 y 2
+    diagnostico_encrypted BYTEA,
     tratamiento_encrypted BYTEA,
     notas_encrypted BYTEA,
-    iv_aes BYTEA NOT NULL,
+    datos_encrypted BYTEA,  -- Formatos 3 y 5: paquete AES-GCM con todos los campos
+    iv_aes BYTEA,  -- Solo formato 1 (AES-CBC); en AES-GCM el nonce va en cada valor
     hash_integridad VARCHAR(64) NOT NULL,
+    version_cifrado SMALLINT NOT NULL DEFAULT 1,  -- 1 = AES-CBC + SHA-256, 2 = AES-GCM, 3 = paquete AES-GCM, 4/5 = 2/3 con id en los datos asociados
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 -- Índices para historias_clinicas
-CREATE INDEX idx_historias_paciente_id ON historias_clinicas(paciente_id);
-CREATE INDEX idx_historias_doctor_id ON historias_clinicas(doctor_id);
+CREATE INDEX idx_historias_paciente_fecha ON historias_clinicas(paciente_id, fecha_consulta);
+CREATE INDEX idx_historias_doctor_fecha ON historias_clinicas(doctor_id, fecha_consulta);
 CREATE INDEX idx_historias_fecha_consulta ON historias_clinicas(fecha_consulta);
 
 -- ============================================
@@ -104,14 +123,16 @@ CREATE INDEX idx_recetas_historia_id ON recetas(historia_clinica_id);
 -- ============================================
 CREATE TABLE IF NOT EXISTS audit_logs (
     id SERIAL PRIMARY KEY,
-    usuario_id INTEGER REFERENCES usuarios(id) ON DELETE SET NULL,
+    usuario_id INTEGER REFERENCES usuarios(id) ON DELETE RESTRICT,  -- Forma parte del hash de la cadena
     accion VARCHAR(50) NOT NULL,
     tabla_afectada VARCHAR(50),
     registro_id INTEGER,
     datos_anteriores JSONB,
     datos_nuevos JSONB,
     ip_address VARCHAR(50),
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    hash_anterior VARCHAR(64),  -- hash_actual de la fila anterior (cadena)
+    hash_actual VARCHAR(64)     -- SHA-256 de hash_anterior + contenido
 );
 
 -- Índices para audit_logs
@@ -119,6 +140,37 @@ CREATE INDEX idx_audit_usuario_id ON audit_logs(usuario_id);
 CREATE INDEX idx_audit_accion ON audit_logs(accion);
 CREATE INDEX idx_audit_tabla ON audit_logs(tabla_afectada);
 CREATE INDEX idx_audit_timestamp ON audit_logs(timestamp);
+CREATE INDEX idx_audit_timestamp_id ON audit_logs(timestamp, id);  -- Paginación por cursor
+
+-- ============================================
+-- Tabla: audit_stats (conteos por hora/día, mantenidos al insertar logs)
+-- ============================================
+CREATE TABLE IF NOT EXISTS audit_stats (
+    id SERIAL PRIMARY KEY,
+    granularidad VARCHAR(5) NOT NULL,  -- 'hour' o 'day'
+    bucket TIMESTAMP NOT NULL,
+    accion VARCHAR(50) NOT NULL,
+    tabla_afectada VARCHAR(50) NOT NULL DEFAULT '',
+    total INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT uq_audit_stats_bucket UNIQUE (granularidad, bucket, accion, tabla_afectada)
+);
+
+CREATE INDEX idx_audit_stats_bucket ON audit_stats(bucket);
+
+-- ============================================
+-- Tabla: audit_checkpoints (hash de la cadena firmado cada N logs)
+-- ============================================
+CREATE TABLE IF NOT EXISTS audit_checkpoints (
+    id SERIAL PRIMARY KEY,
+    ultimo_log_id INTEGER NOT NULL,
+    hash_cadena VARCHAR(64) NOT NULL,
+    filas INTEGER NOT NULL,
+    firma TEXT NOT NULL,  -- RSA-PSS en base64
+    usuario_id INTEGER NOT NULL REFERENCES usuarios(id) ON DELETE RESTRICT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_audit_checkpoints_ultimo_log_id ON audit_checkpoints(ultimo_log_id);
 
 -- ============================================
 -- Tabla: claves_rsa
@@ -0,0 +1,357 @@
+"""
+Comandos de mantenimiento de ESPE MedSafe
+
+Uso:
+    python medsafe.py migrate-records [--batch-size 500] [--to-version 5] [--force-mismatched]
+    python medsafe.py rebuild-audit-stats
+    python medsafe.py archive-audit [--keep-months 3]
+    python medsafe.py upgrade-db
+    python medsafe.py audit-checkpoint
+    python medsafe.py verify-audit [--checkpoint-id N] [--full]
+    python medsafe.py reindex-patients [--batch-size 500]
+    python medsafe.py import-patients ARCHIVO [--format csv|jsonl] [--chunk-size 1000]
+                                     [--rejects RUTA] [--doctor-id N]
+    python medsafe.py calibrate-bcrypt [--target-ms 250]
+    python medsafe.py backup [--output RUTA] [--chunk-size 1000]
+    python medsafe.py restore ARCHIVO
+"""
+import argparse
+import os
+import sys
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from app import create_app, db
+from models.medical_record import HistoriaClinica
+from services.audit_archive import audit_archive
+from services.audit_chain import AuditChain
+from services.audit_stats import AuditStatsService
+from services.patient_search import PatientSearchService
+from services.backup_service import BackupService, ARCHIVE_PROGRESS
+from services.crypto_service import CryptoService
+from services.patient_import import PatientImportService, IMPORT_FORMATS, detect_format
+from services.medical_record_service import (
+    MedicalRecordService, ENCRYPTED_FIELDS, ENCRYPTION_VERSIONS, CIFRADO_PAQUETE_ID
+)
+from utils.helpers import generate_file_name
+
+
+def ensure_record_columns():
+    """Agregar columnas de formato y permitir NULL en las columnas por campo"""
+    inspector = db.inspect(db.engine)
+    columns = {column['name'] for column in inspector.get_columns('historias_clinicas')}
+
+    with db.engine.begin() as conn:
+        if 'version_cifrado' not in columns:
+            print("🔧 Agregando columna historias_clinicas.version_cifrado...")
+            conn.execute(text(
+                'ALTER TABLE historias_clinicas '
+                'ADD COLUMN version_cifrado SMALLINT NOT NULL DEFAULT 1'
+            ))
+        if 'datos_encrypted' not in columns:
+            print("🔧 Agregando columna historias_clinicas.datos_encrypted...")
+            blob_type = 'BYTEA' if db.engine.dialect.name == 'postgresql' else 'BLOB'
+            conn.execute(text(f'ALTER TABLE historias_clinicas ADD COLUMN datos_encrypted {blob_type}'))
+        if db.engine.dialect.name == 'postgresql':
+            for column in ('iv_aes', 'sintomas_encrypted', 'diagnostico_encrypted'):
+                conn.execute(text(f'ALTER TABLE historias_clinicas ALTER COLUMN {column} DROP NOT NULL'))
+
+
+def ensure_audit_columns():
+    """
+    Agregar las columnas de la cadena de hashes a audit_logs y cambiar la FK
+    de usuario_id a ON DELETE RESTRICT (PostgreSQL): usuario_id forma parte
+    del hash, un SET NULL rompería la cadena
+    """
+    inspector = db.inspect(db.engine)
+    columns = {column['name'] for column in inspector.get_columns('audit_logs')}
+
+    with db.engine.begin() as conn:
+        for column in ('hash_anterior', 'hash_actual'):
+            if column not in columns:
+                print(f"🔧 Agregando columna audit_logs.{column}...")
+                conn.execute(text(f'ALTER TABLE audit_logs ADD COLUMN {column} VARCHAR(64)'))
+
+        if db.engine.dialect.name == 'postgresql':
+            for fk in inspector.get_foreign_keys('audit_logs'):
+                ondelete = (fk.get('options') or {}).get('ondelete', '')
+                if fk['constrained_columns'] == ['usuario_id'] and ondelete.upper() != 'RESTRICT':
+                    print("🔧 Cambiando audit_logs.usuario_id a ON DELETE RESTRICT...")
+                    conn.execute(text(
+                        f'ALTER TABLE audit_logs DROP CONSTRAINT {fk["name"]}, '
+                        f'ADD CONSTRAINT {fk["name"]} FOREIGN KEY (usuario_id) '
+                        'REFERENCES usuarios(id) ON DELETE RESTRICT'
+                    ))
+
+
+def ensure_indexes():
+    """
+    Crear los índices con nombre explícito (idx_*) que falten
+
+    Son los declarados en los modelos con el mismo nombre que en
+    database_setup.sql, así que no se duplican en bases creadas con el script.
+    """
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name and index.name.startswith('idx_'):
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def migrate_records(batch_size=500, target_version=CIFRADO_PAQUETE_ID, force_mismatched=False):
+    """
+    Re-cifrar al formato target_version las historias guardadas en otro
+
+    Cada lote se descifra con decrypt_records (que lee todos los formatos),
+    se verifica su integridad y se vuelve a cifrar en una sola transacción.
+    Los registros con hash inválido se reportan y conservan su formato
+    actual (re-cifrarlos les daría un tag válido y borraría la evidencia de
+    la manipulación), salvo con force_mismatched. Los que no se pueden
+    descifrar también se dejan en su formato actual.
+
+    Returns:
+        (migrados, ids con hash inválido, ids no descifrables)
+    """
+    ensure_record_columns()
+
+    migrated = 0
+    mismatches = []
+    failed = []
+    last_id = 0
+
+    while True:
+        records = (
+            HistoriaClinica.query
+            .filter(HistoriaClinica.version_cifrado != target_version, HistoriaClinica.id > last_id)
+            .order_by(HistoriaClinica.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not records:
+            break
+
+        for record, record_data in zip(records, MedicalRecordService.decrypt_records(records)):
+            if any(getattr(record, f'{field}_encrypted') and record_data[field] is None
+                   for field in ENCRYPTED_FIELDS):
+                failed.append(record.id)
+                continue
+            if not MedicalRecordService.verify_integrity(record, record_data):
+                mismatches.append(record.id)
+                if not force_mismatched:
+                    continue
+
+            columns = MedicalRecordService.encrypt_fields(
+                record.paciente_id, record.doctor_id, record.fecha_consulta,
+                {field: record_data[field] for field in ENCRYPTED_FIELDS},
+                version=target_version,
+                record_id=record.id
+            )
+            for column, value in columns.items():
+                setattr(record, column, value)
+            migrated += 1
+
+        db.session.commit()
+        last_id = records[-1].id
+        print(f"   {migrated} historias migradas...")
+
+    return migrated, mismatches, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='medsafe', description='Mantenimiento de ESPE MedSafe')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    migrate = commands.add_parser('migrate-records', help='Re-cifrar historias al formato indicado')
+    migrate.add_argument('--batch-size', type=int, default=500)
+    migrate.add_argument('--to-version', type=int, default=CIFRADO_PAQUETE_ID,
+                         choices=ENCRYPTION_VERSIONS)
+    migrate.add_argument('--force-mismatched', action='store_true',
+                         help='Re-cifrar también las historias con hash de integridad inválido')
+
+    commands.add_parser('rebuild-audit-stats', help='Recalcular audit_stats desde audit_logs y el archivo')
+
+    archive = commands.add_parser('archive-audit', help='Mover meses cerrados de audit_logs a segmentos')
+    archive.add_argument('--keep-months', type=int, default=None,
+                         help='Meses recientes que quedan en la tabla (default: AUDIT_HOT_MONTHS)')
+
+    commands.add_parser('upgrade-db', help='Crear tablas y columnas nuevas en una base existente')
+
+    commands.add_parser('audit-checkpoint', help='Firmar el hash actual de la cadena de auditoría')
+
+    verify = commands.add_parser('verify-audit', help='Verificar la cadena de auditoría')
+    verify.add_argument('--checkpoint-id', type=int, default=None,
+                        help='Punto de control de partida (default: el último)')
+    verify.add_argument('--full', action='store_true', help='Verificar desde la primera fila')
+
+    reindex = commands.add_parser('reindex-patients', help='Recalcular el índice ciego de pacientes')
+    reindex.add_argument('--batch-size', type=int, default=500)
+
+    importer = commands.add_parser('import-patients', help='Importar pacientes desde CSV o JSONL')
+    importer.add_argument('file')
+    importer.add_argument('--format', choices=IMPORT_FORMATS, help='Por defecto según la extensión')
+    importer.add_argument('--chunk-size', type=int, help='Por defecto IMPORT_CHUNK_SIZE')
+    importer.add_argument('--rejects', help='Por defecto ARCHIVO.rechazos.jsonl')
+    importer.add_argument('--doctor-id', type=int, help='Doctor asignado a las filas sin doctor_id')
+
+    calibrate = commands.add_parser('calibrate-bcrypt', help='Sugerir BCRYPT_LOG_ROUNDS para esta CPU')
+    calibrate.add_argument('--target-ms', type=float, help='Latencia de verificación (default: BCRYPT_TARGET_MS)')
+
+    backup = commands.add_parser('backup', help='Copia completa cifrada de la base de datos')
+    backup.add_argument('--output', help='Archivo de destino (default: BACKUP_DIR/medsafe_<fecha>.msbk)')
+    backup.add_argument('--chunk-size', type=int, help='Filas por bloque (default: BACKUP_CHUNK_SIZE)')
+
+    restore = commands.add_parser('restore', help='Restaurar una copia en una base de datos vacía')
+    restore.add_argument('file')
+
+    args = parser.parse_args(argv)
+    app = create_app()
+
+    with app.app_context():
+        if args.command == 'migrate-records':
+            print(f"🔐 Migrando historias clínicas al formato {args.to_version}...")
+            try:
+                migrated, mismatches, failed = migrate_records(args.batch_size, args.to_version, args.force_mismatched)
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error migrando historias clínicas: {str(e)}")
+                return 1
+            print(f"✅ {migrated} historias migradas")
+            if mismatches and args.force_mismatched:
+                print(f"⚠️  Hash de integridad inválido antes de migrar (re-cifradas): {mismatches}")
+            elif mismatches:
+                print(f"⚠️  Hash de integridad inválido (conservan su formato): {mismatches}")
+            if failed:
+                print(f"⚠️  No se pudieron descifrar (conservan su formato): {failed}")
+
+        elif args.command == 'rebuild-audit-stats':
+            print("📊 Recalculando estadísticas de auditoría...")
+            db.create_all()  # Crea audit_stats si no existe
+            try:
+                total = AuditStatsService.rebuild()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error recalculando estadísticas: {str(e)}")
+                return 1
+            print(f"✅ {total} logs contados")
+
+        elif args.command == 'archive-audit':
+            print("📦 Archivando logs de auditoría...")
+            try:
+                # Firmar la cola de la cadena antes de sacarla de la tabla
+                AuditChain.checkpoint()
+                entries = audit_archive.archive(args.keep_months)
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error archivando auditoría: {str(e)}")
+                return 1
+            print(f"✅ {sum(entry['rows'] for entry in entries)} logs archivados en {len(entries)} segmentos")
+
+        elif args.command == 'upgrade-db':
+            print("🔧 Actualizando esquema...")
+            try:
+                db.create_all()
+                ensure_record_columns()
+                ensure_audit_columns()
+                ensure_indexes()
+            except Exception as e:
+                print(f"❌ Error actualizando esquema: {str(e)}")
+                return 1
+            print("✅ Esquema actualizado")
+
+        elif args.command == 'audit-checkpoint':
+            try:
+                checkpoint = AuditChain.checkpoint()
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error creando punto de control: {str(e)}")
+                return 1
+            if checkpoint:
+                print(f"✅ Punto de control #{checkpoint.id}: {checkpoint.filas} filas hasta el log {checkpoint.ultimo_log_id}")
+            else:
+                print("ℹ️  Sin filas nuevas que firmar")
+
+        elif args.command == 'verify-audit':
+            print("🔍 Verificando cadena de auditoría...")
+            try:
+                result = AuditChain.verify(args.checkpoint_id, args.full)
+            except ValueError as e:
+                print(f"❌ {str(e)}")
+                return 1
+            if not result['valid']:
+                print(f"❌ Cadena inválida en el log {result['error']['log_id']}: {result['error']['motivo']}")
+                return 2
+            print(f"✅ {result['filas_verificadas']} filas y {result['checkpoints_verificados']} "
+                  f"puntos de control verificados")
+
+        elif args.command == 'reindex-patients':
+            print("🔎 Recalculando índice ciego de pacientes...")
+            db.create_all()  # Crea paciente_tokens si no existe
+            try:
+                total = PatientSearchService.rebuild(args.batch_size)
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error indexando pacientes: {str(e)}")
+                return 1
+            print(f"✅ {total} pacientes indexados")
+
+        elif args.command == 'import-patients':
+            rejects_path = args.rejects or f'{args.file}.rechazos.jsonl'
+            print(f"📥 Importando pacientes desde {args.file}...")
+            db.create_all()  # Crea paciente_tokens si no existe
+
+            def progress(stats):
+                print(f"   {stats['leidas']} leídas, {stats['importadas']} importadas, "
+                      f"{stats['rechazadas']} rechazadas")
+
+            try:
+                with open(args.file, 'rb') as stream, open(rejects_path, 'w', encoding='utf-8') as rejects:
+                    stats = PatientImportService.import_file(
+                        stream, args.format or detect_format(args.file), rejects,
+                        doctor_id=args.doctor_id, chunk_size=args.chunk_size, progress=progress
+                    )
+            except Exception as e:
+                db.session.rollback()
+                print(f"❌ Error importando pacientes: {str(e)}")
+                return 1
+            print(f"✅ {stats['importadas']} pacientes importados de {stats['leidas']} filas")
+            if stats['rechazadas']:
+                print(f"⚠️  {stats['rechazadas']} filas rechazadas (detalle en {rejects_path})")
+
+        elif args.command == 'calibrate-bcrypt':
+            target_ms = args.target_ms or app.config['BCRYPT_TARGET_MS']
+            rounds = CryptoService.calibrate_bcrypt_rounds(
+                target_ms,
+                min_rounds=app.config['BCRYPT_MIN_ROUNDS'],
+                max_rounds=app.config['BCRYPT_MAX_ROUNDS']
+            )
+            print(f"🔧 Costo bcrypt para ~{target_ms:g} ms por verificación: {rounds}")
+            print(f"   Configure BCRYPT_LOG_ROUNDS={rounds} en todos los servidores")
+
+        elif args.command in ('backup', 'restore'):
+            def progress(table, rows):
+                print(f"   {table}: {rows} {'archivos' if table == ARCHIVE_PROGRESS else 'filas'}")
+
+            try:
+                if args.command == 'backup':
+                    path = args.output
+                    if not path:
+                        os.makedirs(app.config['BACKUP_DIR'], exist_ok=True)
+                        path = os.path.join(app.config['BACKUP_DIR'], generate_file_name('medsafe', 'msbk'))
+                    print(f"💾 Copiando base de datos a {path}...")
+                    counts = BackupService.backup(
+                        path, args.chunk_size or app.config['BACKUP_CHUNK_SIZE'], progress
+                    )
+                else:
+                    print(f"💾 Restaurando copia {args.file}...")
+                    db.create_all()
+                    counts = BackupService.restore(args.file, progress)
+            except Exception as e:
+                print(f"❌ Error en {args.command}: {str(e)}")
+                return 1
+            print(f"✅ {sum(counts.values())} filas en {len(counts)} tablas")
+            if args.command == 'restore':
+                print("ℹ️  Ejecute rebuild-audit-stats para recalcular las estadísticas de auditoría")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,16 +2,19 @@
 Modelos de base de datos - ESPE MedSafe
 """
 from .user import Usuario
-from .patient import Paciente
+from .patient import Paciente, PacienteToken
 from .medical_record import HistoriaClinica, Receta
-from .audit_log import AuditLog
+from .audit_log import AuditLog, AuditStat, AuditCheckpoint
 from .rsa_key import ClaveRSA
 
 __all__ = [
     'Usuario',
     'Paciente',
+    'PacienteToken',
     'HistoriaClinica',
     'Receta',
     'AuditLog',
+    'AuditStat',
+    'AuditCheckpoint',
     'ClaveRSA'
 ]
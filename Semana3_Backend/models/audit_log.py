@@ -8,9 +8,14 @@ class AuditLog(db.Model):
     """Modelo de log de auditoría"""
     
     __tablename__ = 'audit_logs'
+    __table_args__ = (
+        # Paginación por cursor (timestamp, id) de más reciente a más antiguo
+        db.Index('idx_audit_timestamp_id', 'timestamp', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='SET NULL'), 
+    # RESTRICT: usuario_id forma parte del hash de la cadena
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='RESTRICT'), 
                           index=True)
     accion = db.Column(db.String(50), nullable=False, index=True)
     tabla_afectada = db.Column(db.String(50), index=True)
@@ -21,24 +26,100 @@ class AuditLog(db.Model):
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp(), 
                          nullable=False, index=True)
     
+    # Cadena de hashes SHA-256: cada fila incluye el hash de la anterior (por id)
+    hash_anterior = db.Column(db.String(64))
+    hash_actual = db.Column(db.String(64))
+    
     def __repr__(self):
         return f'<AuditLog #{self.id} - {self.accion} by User {self.usuario_id}>'
     
-    def to_dict(self):
-        """Convertir a diccionario"""
-        return {
-            'id': self.id,
-            'usuario_id': self.usuario_id,
-            'usuario': {
+    def to_dict(self, user_summaries=None):
+        """
+        Convertir a diccionario
+        
+        Args:
+            user_summaries: dict usuario_id -> resumen (UserSummaryCache.get_many);
+                            si se omite se carga la relación usuario
+        """
+        if user_summaries is not None:
+            usuario = user_summaries.get(self.usuario_id)
+        else:
+            usuario = {
                 'id': self.usuario.id,
                 'username': self.usuario.username,
                 'nombre_completo': f"{self.usuario.nombre} {self.usuario.apellido}"
-            } if self.usuario else None,
+            } if self.usuario else None
+        
+        return {
+            'id': self.id,
+            'usuario_id': self.usuario_id,
+            'usuario': usuario,
             'accion': self.accion,
             'tabla_afectada': self.tabla_afectada,
             'registro_id': self.registro_id,
             'datos_anteriores': self.datos_anteriores,
             'datos_nuevos': self.datos_nuevos,
             'ip_address': self.ip_address,
-            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+            'hash_actual': self.hash_actual
+        }
+
+
+class AuditStat(db.Model):
+    """
+    Conteo de eventos de auditoría por intervalo (hora o día), acción y tabla
+    Se mantiene de forma incremental al insertar cada lote de AuditLog.
+    """
+    
+    __tablename__ = 'audit_stats'
+    __table_args__ = (
+        db.UniqueConstraint('granularidad', 'bucket', 'accion', 'tabla_afectada',
+                            name='uq_audit_stats_bucket'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    granularidad = db.Column(db.String(5), nullable=False)  # 'hour' o 'day'
+    bucket = db.Column(db.DateTime, nullable=False, index=True)  # Inicio del intervalo
+    accion = db.Column(db.String(50), nullable=False)
+    tabla_afectada = db.Column(db.String(50), nullable=False, default='')  # '' = sin tabla
+    total = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<AuditStat {self.granularidad} {self.bucket} {self.accion}: {self.total}>'
+
+
+class AuditCheckpoint(db.Model):
+    """
+    Punto de control firmado de la cadena de auditoría
+    Fija el hash de la cadena en ultimo_log_id con una firma RSA-PSS, de modo
+    que la verificación solo recorre las filas posteriores.
+    """
+    
+    __tablename__ = 'audit_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    ultimo_log_id = db.Column(db.Integer, nullable=False, index=True)
+    hash_cadena = db.Column(db.String(64), nullable=False)  # hash_actual de ultimo_log_id
+    filas = db.Column(db.Integer, nullable=False)  # Filas desde el checkpoint anterior
+    firma = db.Column(db.Text, nullable=False)  # RSA-PSS en base64
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='RESTRICT'),
+                           nullable=False)  # Dueño de la ClaveRSA firmante
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp(), nullable=False)
+    
+    def __repr__(self):
+        return f'<AuditCheckpoint #{self.id} - log {self.ultimo_log_id}>'
+    
+    def payload(self):
+        """Texto firmado"""
+        return f'{self.ultimo_log_id}|{self.hash_cadena}|{self.filas}'
+    
+    def to_dict(self):
+        """Convertir a diccionario"""
+        return {
+            'id': self.id,
+            'ultimo_log_id': self.ultimo_log_id,
+            'hash_cadena': self.hash_cadena,
+            'filas': self.filas,
+            'usuario_id': self.usuario_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
         }
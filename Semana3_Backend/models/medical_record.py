@@ -8,24 +8,40 @@ class HistoriaClinica(db.Model, TimestampMixin):
     """Modelo de historia clínica"""
     
     __tablename__ = 'historias_clinicas'
+    __table_args__ = (
+        # "Últimas consultas de un paciente" y "consultas de un doctor en un
+        # rango": filtro por igualdad y rango/orden por fecha en un solo índice
+        # (también cubren las búsquedas solo por paciente_id o doctor_id)
+        db.Index('idx_historias_paciente_fecha', 'paciente_id', 'fecha_consulta'),
+        db.Index('idx_historias_doctor_fecha', 'doctor_id', 'fecha_consulta'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id', ondelete='CASCADE'), 
-                           nullable=False, index=True)
+                           nullable=False)
     doctor_id = db.Column(db.Integer, db.ForeignKey('usuarios.id', ondelete='RESTRICT'), 
-                         nullable=False, index=True)
+                         nullable=False)
     fecha_consulta = db.Column(db.Date, nullable=False, index=True)
     
-    # Campos cifrados con AES-256
-    sintomas_encrypted = db.Column(db.LargeBinary, nullable=False)
-    diagnostico_encrypted = db.Column(db.LargeBinary, nullable=False)
+    # Campos cifrados con AES-256 (formatos 1, 2 y 4; NULL en los formatos 3 y 5)
+    sintomas_encrypted = db.Column(db.LargeBinary)
+    diagnostico_encrypted = db.Column(db.LargeBinary)
     tratamiento_encrypted = db.Column(db.LargeBinary)
     notas_encrypted = db.Column(db.LargeBinary)
     
-    # Vector de inicialización (IV) para AES
-    iv_aes = db.Column(db.LargeBinary, nullable=False)
+    # Formatos 3 y 5: todos los campos clínicos empaquetados en un solo valor AES-GCM
+    datos_encrypted = db.Column(db.LargeBinary)
     
-    # Hash de integridad SHA-256
+    # Vector de inicialización (IV) compartido por los campos AES-CBC
+    # (NULL en AES-GCM: cada campo lleva su propio nonce)
+    iv_aes = db.Column(db.LargeBinary)
+    
+    # Formato de cifrado: 1 = AES-256-CBC + hash SHA-256, 2 = AES-256-GCM por campo,
+    # 3 = AES-256-GCM de un paquete con todos los campos; 4 y 5 = 2 y 3 con el id
+    # de la historia en los datos asociados
+    version_cifrado = db.Column(db.SmallInteger, nullable=False, default=1, server_default='1')
+    
+    # Hash de integridad SHA-256 (en AES-GCM: huella de los tags de autenticación)
     hash_integridad = db.Column(db.String(64), nullable=False)
     
     # Relaciones
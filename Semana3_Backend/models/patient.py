@@ -8,6 +8,9 @@ class Paciente(db.Model, TimestampMixin):
     """Modelo de paciente"""
     
     __tablename__ = 'pacientes'
+    __table_args__ = (
+        db.Index('idx_pacientes_doctor_id', 'doctor_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cedula = db.Column(db.String(10), unique=True, nullable=False, index=True)
@@ -32,6 +35,7 @@ class Paciente(db.Model, TimestampMixin):
     # Relaciones
     historias_clinicas = db.relationship('HistoriaClinica', backref='paciente', 
                                         lazy=True, cascade='all, delete-orphan')
+    tokens = db.relationship('PacienteToken', lazy=True, cascade='all, delete-orphan')
     
     def __repr__(self):
         return f'<Paciente {self.nombre} {self.apellido} - {self.cedula}>'
@@ -73,3 +77,37 @@ class Paciente(db.Model, TimestampMixin):
     def nombre_completo(self):
         """Nombre completo del paciente"""
         return f"{self.nombre} {self.apellido}"
+
+
+# Búsqueda por prefijo (LIKE 'abc%') sin distinguir mayúsculas. En PostgreSQL
+# los operadores *_pattern_ops permiten usar el índice con cualquier collation.
+PREFIX_INDEXES = (
+    db.Index('idx_pacientes_cedula_prefix', Paciente.cedula,
+             postgresql_ops={'cedula': 'varchar_pattern_ops'}),
+    db.Index('idx_pacientes_nombre_prefix', db.func.lower(Paciente.nombre).label('nombre_lower'),
+             postgresql_ops={'nombre_lower': 'text_pattern_ops'}),
+    db.Index('idx_pacientes_apellido_prefix', db.func.lower(Paciente.apellido).label('apellido_lower'),
+             postgresql_ops={'apellido_lower': 'text_pattern_ops'}),
+)
+
+
+class PacienteToken(db.Model):
+    """
+    Índice ciego de los campos cifrados de un paciente
+    Una fila por palabra normalizada: HMAC de (campo, palabra) con una
+    subclave de la clave maestra, para buscar sin descifrar.
+    """
+    
+    __tablename__ = 'paciente_tokens'
+    __table_args__ = (
+        db.UniqueConstraint('paciente_id', 'campo', 'token', name='uq_paciente_token'),
+        db.Index('idx_paciente_tokens_campo_token', 'campo', 'token'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    paciente_id = db.Column(db.Integer, db.ForeignKey('pacientes.id', ondelete='CASCADE'), nullable=False)
+    campo = db.Column(db.String(20), nullable=False)  # 'alergias' o 'antecedentes'
+    token = db.Column(db.String(64), nullable=False)  # HMAC-SHA256 hexadecimal
+    
+    def __repr__(self):
+        return f'<PacienteToken {self.campo} - paciente {self.paciente_id}>'
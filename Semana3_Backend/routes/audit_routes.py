@@ -5,11 +5,140 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt
 from datetime import datetime
 from models.base import db
-from models.audit_log import AuditLog
+from models.audit_log import AuditLog, AuditCheckpoint
+from services.audit_archive import audit_archive
+from services.audit_chain import AuditChain
+from services.audit_stats import AuditStatsService
+from services.user_cache import user_summary_cache
+from utils.helpers import (
+    get_page_size, encode_cursor, decode_cursor, paginate_keyset_desc, estimate_count, TOTAL_MODES,
+    wants_stream, get_stream_batch_size, ndjson_response
+)
 
 audit_bp = Blueprint('audit', __name__)
 
 
+def serialize_logs(logs):
+    """Serializar logs resolviendo sus usuarios con una sola consulta (o ninguna)"""
+    summaries = user_summary_cache.get_many(log.usuario_id for log in logs)
+    return [log.to_dict(summaries) for log in logs]
+
+
+def parse_log_cursor(args):
+    """Cursor ?cursor= de un listado de logs -> (timestamp, id) o None"""
+    cursor = args.get('cursor')
+    if not cursor:
+        return None
+    timestamp, log_id = decode_cursor(cursor, 2)
+    return datetime.fromisoformat(timestamp), int(log_id)
+
+
+def build_log_query(filters):
+    """Query de audit_logs (tabla activa) con los filtros de un listado"""
+    query = AuditLog.query
+    
+    if filters.get('accion'):
+        query = query.filter_by(accion=filters['accion'])
+    
+    if filters.get('usuario_id'):
+        query = query.filter_by(usuario_id=filters['usuario_id'])
+    
+    if filters.get('tabla_afectada'):
+        query = query.filter_by(tabla_afectada=filters['tabla_afectada'])
+    
+    if filters.get('desde'):
+        query = query.filter(AuditLog.timestamp >= filters['desde'])
+    
+    if filters.get('hasta'):
+        query = query.filter(AuditLog.timestamp <= filters['hasta'])
+    
+    return query
+
+
+def count_logs(query, mode, filters):
+    """
+    Total de logs (tabla activa + archivo) según ?total=estimate|exact|none
+
+    estimate usa la tabla audit_stats (o el planificador de PostgreSQL y el
+    índice del archivo si se filtra por usuario) y no recorre audit_logs;
+    exact ejecuta COUNT(*) y cuenta las filas archivadas que coinciden.
+    """
+    if mode not in TOTAL_MODES:
+        raise ValueError(f'total debe ser uno de: {", ".join(TOTAL_MODES)}')
+    if mode == 'none':
+        return None
+    if mode == 'exact':
+        return query.order_by(None).count() + audit_archive.count(filters)
+    if filters.get('usuario_id'):
+        estimate = estimate_count(query)
+        if estimate is None:
+            return None
+        return estimate + audit_archive.count_user(filters['usuario_id'])
+    return AuditStatsService.estimate(
+        accion=filters.get('accion'), tabla=filters.get('tabla_afectada'),
+        desde=filters.get('desde'), hasta=filters.get('hasta')
+    )
+
+
+def page_logs(query, filters, before, limit):
+    """
+    Página de logs anteriores a before (timestamp, id), de más reciente a
+    más antiguo. Combina la tabla activa con los segmentos archivados que
+    cubren el rango.
+    """
+    columns = (AuditLog.timestamp, AuditLog.id)
+    page = paginate_keyset_desc(query, columns, before=before, limit=limit)
+    
+    archived = audit_archive.query(filters, before=before, limit=limit + 1)
+    if archived:
+        seen = {log.id for log in page['items']}
+        items = page['items'] + [log for log in archived if log.id not in seen]
+        items.sort(key=lambda log: (log.timestamp, log.id), reverse=True)
+        has_next = page['pagination']['has_next'] or len(items) > limit
+        page['items'] = items[:limit]
+        page['pagination']['has_next'] = has_next
+        page['pagination']['next_cursor'] = encode_cursor(
+            page['items'][-1].timestamp, page['items'][-1].id
+        ) if has_next else None
+    return page
+
+
+def paginate_logs(filters, args):
+    """Página de logs por cursor (timestamp, id), con total opcional"""
+    total_mode = args.get('total', 'estimate')
+    query = build_log_query(filters)
+    total = count_logs(query, total_mode, filters)
+    
+    page = page_logs(query, filters, parse_log_cursor(args), get_page_size(args, default=20))
+    page['pagination']['cursor'] = args.get('cursor')
+    page['pagination']['total'] = total
+    page['pagination']['total_mode'] = total_mode
+    return page
+
+
+def stream_logs(filters, args):
+    """
+    Exportar en NDJSON todos los logs (desde ?cursor=) recorriendo páginas
+    por cursor de STREAM_BATCH_SIZE: la memoria no depende del total
+    """
+    query = build_log_query(filters)
+    before = parse_log_cursor(args)
+    batch_size = get_stream_batch_size()
+    
+    def batches():
+        cursor = before
+        while True:
+            page = page_logs(query, filters, cursor, batch_size)
+            if page['items']:
+                yield serialize_logs(page['items'])
+            if not page['pagination']['has_next']:
+                return
+            last = page['items'][-1]
+            cursor = (last.timestamp, last.id)
+    
+    return ndjson_response(batches())
+
+
 def require_admin():
     """Verificar que el usuario sea administrador"""
     claims = get_jwt()
@@ -24,7 +153,11 @@ def require_admin():
 @audit_bp.route('', methods=['GET'])
 @jwt_required()
 def get_audit_logs():
-    """Obtener logs de auditoría - Solo admin"""
+    """
+    Obtener logs de auditoría - Solo admin
+    Paginación por cursor: ?limit=&cursor=<next_cursor>&total=estimate|exact|none
+    Con ?stream=1 o Accept: application/x-ndjson exporta todos en NDJSON
+    """
     error_response = require_admin()
     if error_response:
         return error_response
@@ -36,48 +169,35 @@ def get_audit_logs():
         tabla = request.args.get('tabla')
         fecha_desde = request.args.get('fecha_desde')
         fecha_hasta = request.args.get('fecha_hasta')
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        
-        # Construir query
-        query = AuditLog.query
-        
-        if accion:
-            query = query.filter_by(accion=accion)
-        
-        if usuario_id:
-            query = query.filter_by(usuario_id=usuario_id)
-        
-        if tabla:
-            query = query.filter_by(tabla_afectada=tabla)
-        
-        if fecha_desde:
-            fecha = datetime.strptime(fecha_desde, '%Y-%m-%d')
-            query = query.filter(AuditLog.timestamp >= fecha)
+        desde = datetime.strptime(fecha_desde, '%Y-%m-%d') if fecha_desde else None
+        hasta = datetime.strptime(fecha_hasta, '%Y-%m-%d') if fecha_hasta else None
         
-        if fecha_hasta:
-            fecha = datetime.strptime(fecha_hasta, '%Y-%m-%d')
-            query = query.filter(AuditLog.timestamp <= fecha)
+        filters = {
+            'accion': accion,
+            'usuario_id': usuario_id,
+            'tabla_afectada': tabla,
+            'desde': desde,
+            'hasta': hasta
+        }
+        if wants_stream(request):
+            return stream_logs(filters, request.args)
         
-        # Ordenar por más reciente
-        query = query.order_by(AuditLog.timestamp.desc())
-        
-        # Paginar
-        pagination = query.paginate(page=page, per_page=limit, error_out=False)
+        # Paginar de más reciente a más antiguo (tabla activa + archivo)
+        page = paginate_logs(filters, request.args)
         
         return jsonify({
             'success': True,
             'data': {
-                'logs': [log.to_dict() for log in pagination.items],
-                'pagination': {
-                    'page': page,
-                    'limit': limit,
-                    'total': pagination.total,
-                    'pages': pagination.pages
-                }
+                'logs': serialize_logs(page['items']),
+                'pagination': page['pagination']
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -89,35 +209,31 @@ def get_audit_logs():
 @audit_bp.route('/user/<int:user_id>', methods=['GET'])
 @jwt_required()
 def get_user_audit_logs(user_id):
-    """Obtener logs de un usuario específico - Solo admin"""
+    """
+    Obtener logs de un usuario específico - Solo admin
+    Paginación por cursor: ?limit=&cursor=<next_cursor>&total=estimate|exact|none
+    """
     error_response = require_admin()
     if error_response:
         return error_response
     
     try:
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 20))
-        
-        query = AuditLog.query.filter_by(usuario_id=user_id).order_by(
-            AuditLog.timestamp.desc()
-        )
-        
-        pagination = query.paginate(page=page, per_page=limit, error_out=False)
+        page = paginate_logs({'usuario_id': user_id}, request.args)
         
         return jsonify({
             'success': True,
             'data': {
                 'usuario_id': user_id,
-                'logs': [log.to_dict() for log in pagination.items],
-                'pagination': {
-                    'page': page,
-                    'limit': limit,
-                    'total': pagination.total,
-                    'pages': pagination.pages
-                }
+                'logs': serialize_logs(page['items']),
+                'pagination': page['pagination']
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -135,38 +251,147 @@ def get_audit_stats():
         return error_response
     
     try:
-        # Contar por acción
-        acciones = db.session.query(
-            AuditLog.accion,
-            db.func.count(AuditLog.id).label('count')
-        ).group_by(AuditLog.accion).all()
-        
-        # Contar por tabla
-        tablas = db.session.query(
-            AuditLog.tabla_afectada,
-            db.func.count(AuditLog.id).label('count')
-        ).group_by(AuditLog.tabla_afectada).all()
+        return jsonify({
+            'success': True,
+            'data': AuditStatsService.summary()
+        }), 200
         
-        # Total de logs
-        total = AuditLog.query.count()
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
+@audit_bp.route('/stats/series', methods=['GET'])
+@jwt_required()
+def get_audit_stats_series():
+    """
+    Serie temporal de eventos de auditoría - Solo admin
+    Parámetros: ?granularity=hour|day&desde=&hasta= (ISO 8601)&accion=&tabla=
+    """
+    error_response = require_admin()
+    if error_response:
+        return error_response
+    
+    try:
+        granularity = request.args.get('granularity', 'hour')
+        desde = request.args.get('desde')
+        hasta = request.args.get('hasta')
         
-        # Logs de hoy
-        today = datetime.now().date()
-        logs_hoy = AuditLog.query.filter(
-            db.func.date(AuditLog.timestamp) == today
-        ).count()
+        series = AuditStatsService.series(
+            granularity=granularity,
+            desde=datetime.fromisoformat(desde) if desde else None,
+            hasta=datetime.fromisoformat(hasta) if hasta else None,
+            accion=request.args.get('accion'),
+            tabla=request.args.get('tabla')
+        )
         
         return jsonify({
             'success': True,
             'data': {
-                'total_logs': total,
-                'logs_hoy': logs_hoy,
-                'por_accion': {accion: count for accion, count in acciones},
-                'por_tabla': {tabla: count for tabla, count in tablas}
+                'granularity': granularity,
+                'series': series
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
+@audit_bp.route('/verify', methods=['GET'])
+@jwt_required()
+def verify_audit_chain():
+    """
+    Verificar la cadena de hashes de auditoría - Solo admin
+    Parámetros: ?checkpoint_id= (default: el último)&full=true
+    """
+    error_response = require_admin()
+    if error_response:
+        return error_response
+    
+    try:
+        checkpoint_id = request.args.get('checkpoint_id', type=int)
+        full = request.args.get('full', 'false').lower() == 'true'
+        
+        return jsonify({
+            'success': True,
+            'data': AuditChain.verify(checkpoint_id, full)
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 404
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
+@audit_bp.route('/checkpoints', methods=['GET'])
+@jwt_required()
+def get_audit_checkpoints():
+    """Listar puntos de control firmados (más recientes primero) - Solo admin"""
+    error_response = require_admin()
+    if error_response:
+        return error_response
+    
+    try:
+        limit = get_page_size(request.args)
+        checkpoints = AuditCheckpoint.query.order_by(AuditCheckpoint.id.desc()).limit(limit).all()
+        
+        return jsonify({
+            'success': True,
+            'data': [checkpoint.to_dict() for checkpoint in checkpoints]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
+@audit_bp.route('/checkpoints', methods=['POST'])
+@jwt_required()
+def create_audit_checkpoint():
+    """Firmar ahora el hash actual de la cadena - Solo admin"""
+    error_response = require_admin()
+    if error_response:
+        return error_response
+    
+    try:
+        checkpoint = AuditChain.checkpoint()
+        if not checkpoint:
+            return jsonify({
+                'success': True,
+                'message': 'Sin filas nuevas que firmar',
+                'data': None
+            }), 200
+        
+        return jsonify({
+            'success': True,
+            'message': 'Punto de control creado',
+            'data': checkpoint.to_dict()
+        }), 201
+        
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'error': 'Error en el servidor',
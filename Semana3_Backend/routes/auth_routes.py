@@ -4,6 +4,7 @@ Rutas de Autenticación
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from services.auth_service import AuthService
+from services.bcrypt_executor import bcrypt_executor, LoginRejected
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -22,7 +23,11 @@ def login():
             }), 400
         
         # Autenticar
-        token, usuario = AuthService.login(data['username'], data['password'])
+        token, usuario = AuthService.login(
+            data['username'],
+            data['password'],
+            ip_address=request.remote_addr
+        )
         
         if not token:
             return jsonify({
@@ -39,6 +44,13 @@ def login():
             'message': 'Login exitoso'
         }), 200
         
+    except LoginRejected as e:
+        response = jsonify({
+            'success': False,
+            'error': str(e)
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
     except ValueError as e:
         return jsonify({
             'success': False,
@@ -79,6 +91,22 @@ def get_current_user():
         }), 500
 
 
+@auth_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def login_metrics():
+    """Métricas del pool de bcrypt (cola y latencia) - Solo admin"""
+    if get_jwt().get('rol') != 'admin':
+        return jsonify({
+            'success': False,
+            'error': 'Acceso denegado. Se requiere rol de administrador.'
+        }), 403
+    
+    return jsonify({
+        'success': True,
+        'data': bcrypt_executor.metrics()
+    }), 200
+
+
 @auth_bp.route('/logout', methods=['POST'])
 @jwt_required()
 def logout():
@@ -56,9 +56,9 @@ def aes_decrypt():
 @crypto_bp.route('/rsa/generate', methods=['POST'])
 @jwt_required()
 def rsa_generate():
-    """Demo: Generar par de llaves RSA"""
+    """Demo: Generar par de llaves RSA (tomado de la reserva pre-generada)"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         key_size = data.get('key_size', 2048)
         
         if key_size not in [1024, 2048, 4096]:
@@ -1,11 +1,23 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models.medical_record import HistoriaClinica
 from models.patient import Paciente
 from models.user import Usuario
+from models.rsa_key import ClaveRSA
 from models.base import db
+from services.auth_service import AuthService
 from services.crypto_service import get_crypto_service
+from services.key_service import KeyService
+from services.medical_record_service import (
+    MedicalRecordService, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS, ETAG_COLUMNS
+)
+from utils.helpers import (
+    get_page_size, paginate_keyset, paginate_keyset_desc, decode_cursor, parse_projection, parse_date_range,
+    wants_stream, get_stream_batch_size, iter_batches, ndjson_response,
+    with_etag, not_modified, collection_etag
+)
 from datetime import datetime
+import base64
 import json
 
 medical_record_bp = Blueprint('medical_record_bp', __name__, url_prefix='/api/v1/medical-records')
@@ -14,74 +26,55 @@ medical_record_bp = Blueprint('medical_record_bp', __name__, url_prefix='/api/v1
 @medical_record_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_all_records():
-    """Obtener todas las historias clínicas"""
+    """
+    Obtener historias clínicas paginadas por cursor (?after_id=&limit=)
+    Filtros: ?desde=&hasta= (fecha_consulta, inclusive) y ?doctor_id=
+    Admite ?fields=fecha_consulta,diagnostico,... y ?decrypt=none|summary|all
+    Con ?stream=1 o Accept: application/x-ndjson exporta todas (desde
+    after_id) en NDJSON, descifrando por lotes
+    """
     try:
-        records = HistoriaClinica.query.all()
+        after_id = request.args.get('after_id', type=int)
+        limit = get_page_size(request.args)
+        desde, hasta = parse_date_range(request.args)
+        plain_fields, encrypted_fields = parse_projection(
+            request.args, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS
+        )
         
-        result = []
-        for record in records:
-            record_data = {
-                'id': record.id,
-                'paciente_id': record.paciente_id,
-                'doctor_id': record.doctor_id,
-                'fecha_consulta': record.fecha_consulta.isoformat() if record.fecha_consulta else None,
-                'created_at': record.created_at.isoformat() if record.created_at else None,
-                'hash_integridad': record.hash_integridad
-            }
-            
-            # Descifrar campos sensibles usando el mismo IV
-            if record.sintomas_encrypted and record.iv_aes:
-                try:
-                    record_data['sintomas'] = get_crypto_service().decrypt_aes(
-                        record.sintomas_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando síntomas: {e}")
-                    record_data['sintomas'] = None
-            else:
-                record_data['sintomas'] = None
-                
-            if record.diagnostico_encrypted and record.iv_aes:
-                try:
-                    record_data['diagnostico'] = get_crypto_service().decrypt_aes(
-                        record.diagnostico_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando diagnóstico: {e}")
-                    record_data['diagnostico'] = None
-            else:
-                record_data['diagnostico'] = None
-                
-            if record.tratamiento_encrypted and record.iv_aes:
-                try:
-                    record_data['tratamiento'] = get_crypto_service().decrypt_aes(
-                        record.tratamiento_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando tratamiento: {e}")
-                    record_data['tratamiento'] = None
-            else:
-                record_data['tratamiento'] = None
-                
-            if record.notas_encrypted and record.iv_aes:
-                try:
-                    record_data['notas'] = get_crypto_service().decrypt_aes(
-                        record.notas_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando notas: {e}")
-                    record_data['notas'] = None
-            else:
-                record_data['notas'] = None
-            
-            result.append(record_data)
-        
-        return jsonify(result), 200
+        # El ETag necesita ETAG_COLUMNS aunque no se pidan en ?fields=
+        load_fields = tuple(dict.fromkeys(plain_fields + ETAG_COLUMNS))
+        query = MedicalRecordService.filter_query(
+            HistoriaClinica.query.options(
+                MedicalRecordService.load_options(load_fields, encrypted_fields)
+            ),
+            desde, hasta, request.args.get('doctor_id', type=int)
+        )
+        
+        if wants_stream(request):
+            if after_id is not None:
+                query = query.filter(HistoriaClinica.id > after_id)
+            batches = iter_batches(query.order_by(HistoriaClinica.id), get_stream_batch_size())
+            return ndjson_response(
+                MedicalRecordService.decrypt_records(batch, encrypted_fields, plain_fields) for batch in batches
+            )
+        
+        page = paginate_keyset(query, HistoriaClinica.id, after_id, limit)
+        
+        etag, weak = collection_etag(request, page['items'], ETAG_COLUMNS, page['pagination'])
+        cached = not_modified(request, etag, weak)
+        if cached:
+            return cached
+        
+        result = MedicalRecordService.decrypt_records(page['items'], encrypted_fields, plain_fields)
         
+        return with_etag(jsonify({
+            'success': True,
+            'data': result,
+            'pagination': page['pagination']
+        }), etag, weak)
+        
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
     except Exception as e:
         print(f"❌ Error obteniendo todas las historias clínicas: {str(e)}")
         import traceback
@@ -89,82 +82,106 @@ def get_all_records():
         return jsonify({'error': str(e)}), 500
 
 
+@medical_record_bp.route('/mine', methods=['GET'])
+@jwt_required()
+def get_my_records():
+    """
+    Historias clínicas del doctor autenticado, de la más reciente a la más
+    antigua, paginadas por cursor (fecha_consulta, id) sobre el índice
+    idx_historias_doctor_fecha
+    Parámetros: ?cursor=&limit=, ?desde=&hasta=, ?fields= y ?decrypt=
+    """
+    try:
+        doctor_id = int(get_jwt_identity())
+        limit = get_page_size(request.args)
+        desde, hasta = parse_date_range(request.args)
+        plain_fields, encrypted_fields = parse_projection(
+            request.args, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS
+        )
+        
+        before = None
+        if request.args.get('cursor'):
+            fecha, record_id = decode_cursor(request.args['cursor'], 2)
+            before = (datetime.fromisoformat(fecha).date(), int(record_id))
+        
+        # El cursor y el ETag necesitan fecha_consulta y ETAG_COLUMNS aunque
+        # no se pidan en ?fields=
+        load_fields = tuple(dict.fromkeys(plain_fields + ('fecha_consulta',) + ETAG_COLUMNS))
+        query = MedicalRecordService.filter_query(
+            HistoriaClinica.query.options(
+                MedicalRecordService.load_options(load_fields, encrypted_fields)
+            ),
+            desde, hasta, doctor_id
+        )
+        page = paginate_keyset_desc(
+            query, (HistoriaClinica.fecha_consulta, HistoriaClinica.id), before, limit
+        )
+        
+        etag, weak = collection_etag(request, page['items'], ETAG_COLUMNS, page['pagination'], doctor_id)
+        cached = not_modified(request, etag, weak)
+        if cached:
+            return cached
+        
+        result = MedicalRecordService.decrypt_records(page['items'], encrypted_fields, plain_fields)
+        
+        return with_etag(jsonify({
+            'success': True,
+            'data': result,
+            'pagination': page['pagination']
+        }), etag, weak)
+        
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
+    except Exception as e:
+        print(f"❌ Error obteniendo historias del doctor: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
 @medical_record_bp.route('/paciente/<int:patient_id>', methods=['GET'])
 @jwt_required()
 def get_patient_records(patient_id):
-    """Obtener todos los registros médicos de un paciente"""
+    """
+    Obtener los registros médicos de un paciente (más recientes primero)
+    Filtros: ?desde=&hasta= (fecha_consulta, inclusive), ?doctor_id= y
+    ?limit= (p. ej. las últimas 10 consultas)
+    Admite ?fields= y ?decrypt=none|summary|all
+    """
     try:
-        # Verificar que el paciente existe
-        paciente = Paciente.query.get(patient_id)
-        if not paciente:
+        desde, hasta = parse_date_range(request.args)
+        plain_fields, encrypted_fields = parse_projection(
+            request.args, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS
+        )
+        
+        # Verificar que el paciente existe (solo por clave primaria)
+        if not db.session.query(Paciente.id).filter(Paciente.id == patient_id).first():
             return jsonify({'error': 'Paciente no encontrado'}), 404
         
-        records = HistoriaClinica.query.filter_by(paciente_id=patient_id).all()
+        load_fields = tuple(dict.fromkeys(plain_fields + ETAG_COLUMNS))
+        query = MedicalRecordService.filter_query(
+            HistoriaClinica.query.filter_by(paciente_id=patient_id).options(
+                MedicalRecordService.load_options(load_fields, encrypted_fields)
+            ),
+            desde, hasta, request.args.get('doctor_id', type=int)
+        )
+        query = query.order_by(HistoriaClinica.fecha_consulta.desc(), HistoriaClinica.id.desc())
+        if 'limit' in request.args:
+            query = query.limit(get_page_size(request.args))
         
-        result = []
-        for record in records:
-            record_data = {
-                'id': record.id,
-                'paciente_id': record.paciente_id,
-                'doctor_id': record.doctor_id,
-                'fecha_consulta': record.fecha_consulta.isoformat() if record.fecha_consulta else None,
-                'created_at': record.created_at.isoformat() if record.created_at else None,
-                'hash_integridad': record.hash_integridad
-            }
-            
-            # Descifrar campos sensibles usando el mismo IV
-            if record.sintomas_encrypted and record.iv_aes:
-                try:
-                    record_data['sintomas'] = get_crypto_service().decrypt_aes(
-                        record.sintomas_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando síntomas: {e}")
-                    record_data['sintomas'] = None
-            else:
-                record_data['sintomas'] = None
-                
-            if record.diagnostico_encrypted and record.iv_aes:
-                try:
-                    record_data['diagnostico'] = get_crypto_service().decrypt_aes(
-                        record.diagnostico_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando diagnóstico: {e}")
-                    record_data['diagnostico'] = None
-            else:
-                record_data['diagnostico'] = None
-                
-            if record.tratamiento_encrypted and record.iv_aes:
-                try:
-                    record_data['tratamiento'] = get_crypto_service().decrypt_aes(
-                        record.tratamiento_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando tratamiento: {e}")
-                    record_data['tratamiento'] = None
-            else:
-                record_data['tratamiento'] = None
-                
-            if record.notas_encrypted and record.iv_aes:
-                try:
-                    record_data['notas'] = get_crypto_service().decrypt_aes(
-                        record.notas_encrypted,
-                        record.iv_aes
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando notas: {e}")
-                    record_data['notas'] = None
-            else:
-                record_data['notas'] = None
-            
-            result.append(record_data)
-        
-        return jsonify(result), 200
+        records = query.all()
+        
+        etag, weak = collection_etag(request, records, ETAG_COLUMNS)
+        cached = not_modified(request, etag, weak)
+        if cached:
+            return cached
+        
+        result = MedicalRecordService.decrypt_records(records, encrypted_fields, plain_fields)
         
+        return with_etag(jsonify(result), etag, weak)
+        
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
     except Exception as e:
         print(f"❌ Error obteniendo historias clínicas: {str(e)}")
         import traceback
@@ -198,44 +215,27 @@ def create_record():
                 'error': 'Paciente no encontrado'
             }), 404
         
-        # Generar un IV único para este registro y usarlo para todos los campos
-        sintomas_encrypted, iv = get_crypto_service().encrypt_aes(data['sintomas'])
-        diagnostico_encrypted, _ = get_crypto_service().encrypt_aes(data['diagnostico'], iv)
-        
-        tratamiento_encrypted = None
-        if data.get('tratamiento'):
-            tratamiento_encrypted, _ = get_crypto_service().encrypt_aes(data['tratamiento'], iv)
-        
-        notas_encrypted = None
-        if data.get('notas'):
-            notas_encrypted, _ = get_crypto_service().encrypt_aes(data['notas'], iv)
-        
-        # Calcular hash de integridad
-        record_content = {
-            'paciente_id': data['paciente_id'],
-            'doctor_id': doctor_id,
-            'fecha_consulta': data['fecha_consulta'],
-            'sintomas': data['sintomas'],
-            'diagnostico': data['diagnostico'],
-            'tratamiento': data.get('tratamiento', ''),
-            'notas': data.get('notas', '')
-        }
-        hash_integridad = get_crypto_service().calculate_sha256(json.dumps(record_content, sort_keys=True))
-        
-        # Crear registro médico
+        # Crear registro médico (flush para obtener el id antes de cifrar)
+        paciente_id = data['paciente_id']
+        fecha_consulta = datetime.fromisoformat(data['fecha_consulta'].replace('Z', '+00:00')).date()
         record = HistoriaClinica(
-            paciente_id=data['paciente_id'],
+            paciente_id=paciente_id,
             doctor_id=doctor_id,
-            fecha_consulta=datetime.fromisoformat(data['fecha_consulta'].replace('Z', '+00:00')).date(),
-            sintomas_encrypted=sintomas_encrypted,
-            diagnostico_encrypted=diagnostico_encrypted,
-            tratamiento_encrypted=tratamiento_encrypted,
-            notas_encrypted=notas_encrypted,
-            iv_aes=iv,
-            hash_integridad=hash_integridad
+            fecha_consulta=fecha_consulta,
+            hash_integridad=''
         )
-        
         db.session.add(record)
+        db.session.flush()
+        
+        # Cifrar campos clínicos (AES-GCM autenticado con id, ids y fecha)
+        encrypted_columns = MedicalRecordService.encrypt_fields(
+            paciente_id, doctor_id, fecha_consulta,
+            {field: data.get(field) for field in ENCRYPTED_FIELDS},
+            record_id=record.id
+        )
+        for column, value in encrypted_columns.items():
+            setattr(record, column, value)
+        
         db.session.commit()
         
         # Preparar respuesta
@@ -270,89 +270,162 @@ def create_record():
         }), 500
 
 
+def validate_bulk_row(row, pacientes):
+    """
+    Validar una fila de POST /bulk
+    Retorna (paciente_id, fecha_consulta, values); lanza ValueError con el motivo
+    """
+    if not isinstance(row, dict):
+        raise ValueError('Cada historia debe ser un objeto')
+    for field in ('paciente_id', 'fecha_consulta', 'sintomas', 'diagnostico'):
+        if not row.get(field):
+            raise ValueError(f'Campo requerido: {field}')
+    for field in ENCRYPTED_FIELDS:
+        if row.get(field) is not None and not isinstance(row[field], str):
+            raise ValueError(f'{field} debe ser texto')
+    
+    paciente_id = row['paciente_id']
+    if not isinstance(paciente_id, int) or paciente_id not in pacientes:
+        raise ValueError('Paciente no encontrado')
+    try:
+        fecha_consulta = datetime.fromisoformat(str(row['fecha_consulta']).replace('Z', '+00:00')).date()
+    except ValueError:
+        raise ValueError('fecha_consulta debe ser una fecha ISO 8601')
+    
+    return paciente_id, fecha_consulta, {field: row.get(field) for field in ENCRYPTED_FIELDS}
+
+
+@medical_record_bp.route('/bulk', methods=['POST'])
+@jwt_required()
+def create_records_bulk():
+    """
+    Crear varias historias clínicas en una sola transacción
+    Cuerpo: {"records": [{paciente_id, fecha_consulta, sintomas, diagnostico,
+    tratamiento, notas}, ...], "atomic": false}
+    
+    Las filas inválidas se reportan con su índice; con atomic=true cualquier
+    error cancela todo el lote. Respuesta 201 si todas se crearon, 207 si
+    solo algunas y 400 si ninguna.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        doctor_id = int(get_jwt_identity())
+        rows = data.get('records')
+        max_records = current_app.config.get('BULK_MAX_RECORDS', 500)
+        
+        if not isinstance(rows, list) or not rows:
+            return jsonify({'success': False, 'error': 'records debe ser una lista no vacía'}), 400
+        if len(rows) > max_records:
+            return jsonify({
+                'success': False,
+                'error': f'Máximo {max_records} historias por petición'
+            }), 400
+        
+        # Pacientes existentes en una sola consulta IN
+        requested = {row.get('paciente_id') for row in rows
+                     if isinstance(row, dict) and isinstance(row.get('paciente_id'), int)}
+        pacientes = {
+            paciente_id for (paciente_id,) in
+            db.session.query(Paciente.id).filter(Paciente.id.in_(requested))
+        } if requested else set()
+        
+        valid = []
+        errors = []
+        for index, row in enumerate(rows):
+            try:
+                valid.append((index, validate_bulk_row(row, pacientes)))
+            except ValueError as ve:
+                errors.append({'index': index, 'error': str(ve)})
+        
+        if not valid or (errors and data.get('atomic')):
+            return jsonify({
+                'success': False,
+                'error': 'Ninguna historia fue creada',
+                'errors': errors
+            }), 400
+        
+        records = [
+            HistoriaClinica(
+                paciente_id=paciente_id,
+                doctor_id=doctor_id,
+                fecha_consulta=fecha_consulta,
+                hash_integridad=''
+            )
+            for _, (paciente_id, fecha_consulta, _) in valid
+        ]
+        db.session.add_all(records)
+        db.session.flush()  # Asigna los ids (en PostgreSQL, INSERT ... RETURNING por lotes)
+        
+        # Cifrado en paralelo (pool de hilos de CryptoService); el id va en
+        # los datos asociados
+        encrypted = MedicalRecordService.encrypt_many([
+            (paciente_id, doctor_id, fecha_consulta, values, record.id)
+            for (_, (paciente_id, fecha_consulta, values)), record in zip(valid, records)
+        ])
+        for record, columns in zip(records, encrypted):
+            for column, value in columns.items():
+                setattr(record, column, value)
+        db.session.flush()
+        
+        created = [
+            {
+                'index': index,
+                'id': record.id,
+                'paciente_id': record.paciente_id,
+                'fecha_consulta': record.fecha_consulta.isoformat(),
+                'hash_integridad': record.hash_integridad
+            }
+            for (index, _), record in zip(valid, records)
+        ]
+        db.session.commit()
+        
+        return jsonify({
+            'success': not errors,
+            'data': created,
+            'errors': errors,
+            'message': f'{len(created)} historias creadas, {len(errors)} con errores'
+        }), 207 if errors else 201
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error creando historias en lote: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
 @medical_record_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
 def get_record(id):
-    """Obtener un registro médico por ID"""
+    """
+    Obtener un registro médico por ID
+    Responde con ETag; con If-None-Match vigente devuelve 304 sin cargar
+    ni descifrar los campos cifrados
+    """
     try:
+        etag = MedicalRecordService.current_etag(id)
+        if etag is None:
+            return jsonify({'error': 'Registro médico no encontrado'}), 404
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        
         record = HistoriaClinica.query.get(id)
         
         if not record:
             return jsonify({'error': 'Registro médico no encontrado'}), 404
         
-        record_data = {
-            'id': record.id,
-            'paciente_id': record.paciente_id,
-            'doctor_id': record.doctor_id,
-            'fecha_consulta': record.fecha_consulta.isoformat() if record.fecha_consulta else None,
-            'created_at': record.created_at.isoformat() if record.created_at else None,
-            'hash_integridad': record.hash_integridad
-        }
-        
         # Descifrar campos sensibles
-        if record.sintomas_encrypted and record.iv_aes:
-            try:
-                record_data['sintomas'] = get_crypto_service().decrypt_aes(
-                    record.sintomas_encrypted,
-                    record.iv_aes
-                )
-            except Exception as e:
-                print(f"⚠️  Error descifrando síntomas: {e}")
-                record_data['sintomas'] = None
-        else:
-            record_data['sintomas'] = None
-            
-        if record.diagnostico_encrypted and record.iv_aes:
-            try:
-                record_data['diagnostico'] = get_crypto_service().decrypt_aes(
-                    record.diagnostico_encrypted,
-                    record.iv_aes
-                )
-            except Exception as e:
-                print(f"⚠️  Error descifrando diagnóstico: {e}")
-                record_data['diagnostico'] = None
-        else:
-            record_data['diagnostico'] = None
-            
-        if record.tratamiento_encrypted and record.iv_aes:
-            try:
-                record_data['tratamiento'] = get_crypto_service().decrypt_aes(
-                    record.tratamiento_encrypted,
-                    record.iv_aes
-                )
-            except Exception as e:
-                print(f"⚠️  Error descifrando tratamiento: {e}")
-                record_data['tratamiento'] = None
-        else:
-            record_data['tratamiento'] = None
-            
-        if record.notas_encrypted and record.iv_aes:
-            try:
-                record_data['notas'] = get_crypto_service().decrypt_aes(
-                    record.notas_encrypted,
-                    record.iv_aes
-                )
-            except Exception as e:
-                print(f"⚠️  Error descifrando notas: {e}")
-                record_data['notas'] = None
-        else:
-            record_data['notas'] = None
-        
-        # Verificar integridad
-        record_content = {
-            'paciente_id': record.paciente_id,
-            'doctor_id': record.doctor_id,
-            'fecha_consulta': record.fecha_consulta.isoformat() if record.fecha_consulta else '',
-            'sintomas': record_data.get('sintomas', ''),
-            'diagnostico': record_data.get('diagnostico', ''),
-            'tratamiento': record_data.get('tratamiento', ''),
-            'notas': record_data.get('notas', '')
-        }
+        record_data = MedicalRecordService.decrypt_records([record])[0]
         
-        calculated_hash = get_crypto_service().calculate_sha256(json.dumps(record_content, sort_keys=True))
-        record_data['integrity_verified'] = (calculated_hash == record.hash_integridad)
+        # Verificar integridad (tags GCM o hash SHA-256 en registros antiguos)
+        record_data['integrity_verified'] = MedicalRecordService.verify_integrity(record, record_data)
         
-        return jsonify(record_data), 200
+        return with_etag(jsonify(record_data), MedicalRecordService.etag(record))
         
     except Exception as e:
         print(f"❌ Error obteniendo historia clínica {id}: {str(e)}")
@@ -360,3 +433,120 @@ def get_record(id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+
+
+@medical_record_bp.route('/<int:id>/share', methods=['POST'])
+@jwt_required()
+def share_record(id):
+    """
+    Compartir una historia clínica con otro doctor
+    Devuelve la historia completa en un sobre cifrado (RSA + AES-GCM) con
+    la clave pública del destinatario; solo él puede abrirla.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        if not data.get('doctor_id'):
+            return jsonify({
+                'success': False,
+                'error': 'Campo requerido: doctor_id'
+            }), 400
+        
+        destinatario = Usuario.query.get(data['doctor_id'])
+        if not destinatario or not destinatario.activo:
+            return jsonify({
+                'success': False,
+                'error': 'Doctor destinatario no encontrado'
+            }), 404
+        
+        record = HistoriaClinica.query.get(id)
+        if not record:
+            return jsonify({
+                'success': False,
+                'error': 'Registro médico no encontrado'
+            }), 404
+        
+        record_data = MedicalRecordService.decrypt_records([record])[0]
+        record_data['recetas'] = [receta.to_dict() for receta in record.recetas]
+        
+        clave = KeyService.get_or_create_user_keys(destinatario.id)
+        envelope = get_crypto_service().encrypt_envelope(
+            json.dumps(record_data),
+            KeyService.load_public_key(clave)
+        )
+        
+        AuthService.log_audit(
+            user_id=int(get_jwt_identity()),
+            action='SHARE_RECORD',
+            description='historias_clinicas',
+            additional_data={'registro_id': record.id, 'destinatario_id': destinatario.id}
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'historia_clinica_id': record.id,
+                'destinatario_id': destinatario.id,
+                'envelope': base64.b64encode(envelope).decode('utf-8'),
+                'algorithm': 'RSA-OAEP + AES-256-GCM'
+            }
+        }), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error compartiendo historia clínica {id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
+@medical_record_bp.route('/shared/open', methods=['POST'])
+@jwt_required()
+def open_shared_record():
+    """Abrir una historia clínica compartida con la clave privada del usuario actual"""
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        if not data.get('envelope'):
+            return jsonify({
+                'success': False,
+                'error': 'Campo requerido: envelope'
+            }), 400
+        
+        clave = ClaveRSA.query.filter_by(usuario_id=int(get_jwt_identity())).first()
+        if not clave:
+            return jsonify({
+                'success': False,
+                'error': 'El usuario no tiene claves RSA'
+            }), 404
+        
+        try:
+            envelope = base64.b64decode(data['envelope'], validate=True)
+            plaintext = get_crypto_service().decrypt_envelope(
+                envelope,
+                KeyService.load_private_key(clave)
+            )
+        except ValueError as ve:
+            return jsonify({
+                'success': False,
+                'error': str(ve) or 'Sobre inválido'
+            }), 400
+        
+        return jsonify({
+            'success': True,
+            'data': json.loads(plaintext)
+        }), 200
+        
+    except Exception as e:
+        print(f"❌ Error abriendo historia clínica compartida: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
@@ -1,10 +1,30 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, request, jsonify, current_app, send_from_directory
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models.patient import Paciente
 from models.base import db
 from services.crypto_service import get_crypto_service
 from utils.validators import validate_cedula_ecuador
+from services.patient_service import (
+    PatientService, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS, ETAG_COLUMNS
+)
+from services.patient_search import PatientSearchService, SEARCH_PARAMS
+from services.patient_import import PatientImportService, IMPORT_FORMATS, detect_format
+from services import medical_record_service
+from utils.helpers import (
+    get_page_size, paginate_keyset, parse_projection, parse_date_range,
+    wants_stream, get_stream_batch_size, iter_batches, ndjson_response, NDJSON_MIMETYPE,
+    with_etag, not_modified, collection_etag
+)
 from datetime import datetime
+import os
+import re
+import json
+import uuid
+
+# Rechazos devueltos en la respuesta de /patients/import (el resto queda en el archivo)
+IMPORT_INLINE_REJECTS = 100
+
+REJECTS_NAME_RE = re.compile(r'^[0-9a-f]{32}\.jsonl$')
 
 patient_bp = Blueprint('patient_bp', __name__, url_prefix='/api/v1/patients')
 
@@ -12,56 +32,50 @@ patient_bp = Blueprint('patient_bp', __name__, url_prefix='/api/v1/patients')
 @patient_bp.route('/', methods=['GET'])
 @jwt_required()
 def get_patients():
-    """Obtener todos los pacientes"""
+    """
+    Obtener pacientes paginados por cursor (?after_id=&limit=)
+    Admite ?fields=nombre,cedula,... y ?decrypt=none|summary|all
+    Con ?stream=1 o Accept: application/x-ndjson exporta todos (desde
+    after_id) en NDJSON, descifrando por lotes
+    """
     try:
-        patients = Paciente.query.all()
-        
-        result = []
-        for paciente in patients:
-            patient_data = {
-                'id': paciente.id,
-                'cedula': paciente.cedula,
-                'nombre': paciente.nombre,
-                'apellido': paciente.apellido,
-                'fecha_nacimiento': paciente.fecha_nacimiento.isoformat() if paciente.fecha_nacimiento else None,
-                'genero': paciente.genero,
-                'grupo_sanguineo': paciente.grupo_sanguineo,
-                'telefono': paciente.telefono,
-                'email': paciente.email,
-                'direccion': paciente.direccion,
-                'created_at': paciente.created_at.isoformat() if paciente.created_at else None,
-                'updated_at': paciente.updated_at.isoformat() if paciente.updated_at else None
-            }
-            
-            # Descifrar campos sensibles
-            if paciente.alergias_encrypted and paciente.alergias_iv:
-                try:
-                    patient_data['alergias'] = get_crypto_service().decrypt_aes(
-                        paciente.alergias_encrypted, 
-                        paciente.alergias_iv
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando alergias: {e}")
-                    patient_data['alergias'] = None
-            else:
-                patient_data['alergias'] = None
-                
-            if paciente.antecedentes_encrypted and paciente.antecedentes_iv:
-                try:
-                    patient_data['antecedentes'] = get_crypto_service().decrypt_aes(
-                        paciente.antecedentes_encrypted,
-                        paciente.antecedentes_iv
-                    )
-                except Exception as e:
-                    print(f"⚠️  Error descifrando antecedentes: {e}")
-                    patient_data['antecedentes'] = None
-            else:
-                patient_data['antecedentes'] = None
-            
-            result.append(patient_data)
+        after_id = request.args.get('after_id', type=int)
+        limit = get_page_size(request.args)
+        plain_fields, encrypted_fields = parse_projection(
+            request.args, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS
+        )
         
-        return jsonify(result), 200
+        # El ETag necesita ETAG_COLUMNS aunque no se pidan en ?fields=
+        load_fields = tuple(dict.fromkeys(plain_fields + ETAG_COLUMNS))
+        query = Paciente.query.options(
+            PatientService.load_options(load_fields, encrypted_fields)
+        )
         
+        if wants_stream(request):
+            if after_id is not None:
+                query = query.filter(Paciente.id > after_id)
+            batches = iter_batches(query.order_by(Paciente.id), get_stream_batch_size())
+            return ndjson_response(
+                PatientService.decrypt_patients(batch, encrypted_fields, plain_fields) for batch in batches
+            )
+        
+        page = paginate_keyset(query, Paciente.id, after_id, limit)
+        
+        etag, weak = collection_etag(request, page['items'], ETAG_COLUMNS, page['pagination'])
+        cached = not_modified(request, etag, weak)
+        if cached:
+            return cached
+        
+        result = PatientService.decrypt_patients(page['items'], encrypted_fields, plain_fields)
+        
+        return with_etag(jsonify({
+            'success': True,
+            'data': result,
+            'pagination': page['pagination']
+        }), etag, weak)
+        
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
     except Exception as e:
         print(f"❌ Error obteniendo pacientes: {str(e)}")
         import traceback
@@ -69,6 +83,109 @@ def get_patients():
         return jsonify({'error': str(e)}), 500
 
 
+@patient_bp.route('/mine', methods=['GET'])
+@jwt_required()
+def get_my_patients():
+    """
+    Pacientes del doctor autenticado (asignados o atendidos), paginados por
+    cursor (?after_id=&limit=)
+    Admite ?fields= y ?decrypt=none|summary|all
+    """
+    try:
+        doctor_id = int(get_jwt_identity())
+        after_id = request.args.get('after_id', type=int)
+        limit = get_page_size(request.args)
+        plain_fields, encrypted_fields = parse_projection(
+            request.args, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS
+        )
+        
+        load_fields = tuple(dict.fromkeys(plain_fields + ETAG_COLUMNS))
+        query = PatientService.owned_by(
+            Paciente.query.options(PatientService.load_options(load_fields, encrypted_fields)),
+            doctor_id
+        )
+        page = paginate_keyset(query, Paciente.id, after_id, limit)
+        
+        etag, weak = collection_etag(request, page['items'], ETAG_COLUMNS, page['pagination'], doctor_id)
+        cached = not_modified(request, etag, weak)
+        if cached:
+            return cached
+        
+        result = PatientService.decrypt_patients(page['items'], encrypted_fields, plain_fields)
+        
+        return with_etag(jsonify({
+            'success': True,
+            'data': result,
+            'pagination': page['pagination']
+        }), etag, weak)
+        
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
+    except Exception as e:
+        print(f"❌ Error obteniendo pacientes del doctor: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+@patient_bp.route('/search', methods=['GET'])
+@jwt_required()
+def search_patients():
+    """
+    Buscar pacientes
+    - ?q=: autocompletado por prefijo de cédula, nombre o apellido; devuelve
+      una proyección corta sin descifrar (?limit=)
+    - ?alergia=&antecedente=: campos cifrados (todas las palabras deben
+      coincidir), con ?after_id=&limit=, ?fields= y ?decrypt= como en el listado
+    """
+    try:
+        if request.args.get('q'):
+            return jsonify({
+                'success': True,
+                'data': PatientSearchService.typeahead(request.args['q'], get_page_size(request.args))
+            }), 200
+        
+        criteria = {
+            field: request.args[param]
+            for param, field in SEARCH_PARAMS.items()
+            if request.args.get(param)
+        }
+        if not criteria:
+            return jsonify({
+                'success': False,
+                'error': f'Indique q o al menos un criterio: {", ".join(SEARCH_PARAMS)}'
+            }), 400
+        
+        after_id = request.args.get('after_id', type=int)
+        limit = get_page_size(request.args)
+        plain_fields, encrypted_fields = parse_projection(
+            request.args, PLAIN_FIELDS, ENCRYPTED_FIELDS, SUMMARY_FIELDS
+        )
+        
+        query = PatientSearchService.filter_encrypted(
+            Paciente.query.options(PatientService.load_options(plain_fields, encrypted_fields)),
+            criteria
+        )
+        page = paginate_keyset(query, Paciente.id, after_id, limit)
+        
+        # Solo se descifran los pacientes de la página
+        result = PatientService.decrypt_patients(page['items'], encrypted_fields, plain_fields)
+        
+        return jsonify({
+            'success': True,
+            'data': result,
+            'pagination': page['pagination']
+        }), 200
+        
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
+    except Exception as e:
+        print(f"❌ Error buscando pacientes: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
 @patient_bp.route('/', methods=['POST'])
 @jwt_required()
 def create_patient():
@@ -111,6 +228,11 @@ def create_patient():
         if data.get('antecedentes'):
             encrypted_antecedentes, antecedentes_iv = get_crypto_service().encrypt_aes(data['antecedentes'])
         
+        # Un doctor que registra un paciente queda como su doctor asignado
+        doctor_id = data.get('doctor_id')
+        if doctor_id is None and get_jwt().get('rol') == 'doctor':
+            doctor_id = int(get_jwt_identity())
+        
         # Crear paciente
         paciente = Paciente(
             cedula=data['cedula'],
@@ -122,6 +244,7 @@ def create_patient():
             telefono=data.get('telefono'),
             email=data.get('email'),
             direccion=data.get('direccion'),
+            doctor_id=doctor_id,
             alergias_encrypted=encrypted_alergias,
             alergias_iv=alergias_iv,
             antecedentes_encrypted=encrypted_antecedentes,
@@ -129,6 +252,9 @@ def create_patient():
         )
         
         db.session.add(paciente)
+        PatientSearchService.index_patient(paciente, {
+            field: data.get(field) for field in ENCRYPTED_FIELDS
+        })
         db.session.commit()
         
         return jsonify({
@@ -156,57 +282,119 @@ def create_patient():
         }), 500
 
 
+@patient_bp.route('/import', methods=['POST'])
+@jwt_required()
+def import_patients():
+    """
+    Importar pacientes desde CSV (con encabezado) o JSONL - Solo admin
+    El archivo va como multipart (campo file) o como cuerpo de la petición
+    (text/csv o application/x-ndjson) y se procesa en streaming por bloques.
+    Admite ?format=csv|jsonl, ?doctor_id= y ?chunk_size=
+    Las filas rechazadas se guardan en IMPORT_REJECTS_DIR y se descargan con
+    GET /patients/import/rejects/<archivo>
+    """
+    if get_jwt().get('rol') != 'admin':
+        return jsonify({
+            'success': False,
+            'error': 'Acceso denegado. Se requiere rol de administrador.'
+        }), 403
+    
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            stream, fmt = upload.stream, detect_format(upload.filename)
+        else:
+            stream = request.stream
+            fmt = 'jsonl' if request.mimetype in (NDJSON_MIMETYPE, 'application/jsonl') else 'csv'
+        fmt = request.args.get('format', fmt)
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f'format debe ser uno de: {", ".join(IMPORT_FORMATS)}')
+        
+        rejects_dir = current_app.config['IMPORT_REJECTS_DIR']
+        os.makedirs(rejects_dir, exist_ok=True)
+        rejects_name = f'{uuid.uuid4().hex}.jsonl'
+        rejects_path = os.path.join(rejects_dir, rejects_name)
+        
+        with open(rejects_path, 'w+', encoding='utf-8') as rejects:
+            stats = PatientImportService.import_file(
+                stream, fmt, rejects,
+                doctor_id=request.args.get('doctor_id', type=int),
+                chunk_size=request.args.get('chunk_size', type=int)
+            )
+            rejects.seek(0)
+            rechazos = [json.loads(line) for line, _ in zip(rejects, range(IMPORT_INLINE_REJECTS))]
+        
+        if not stats['rechazadas']:
+            os.remove(rejects_path)
+            rejects_name = None
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                **stats,
+                'rechazos': rechazos,
+                'archivo_rechazos': rejects_name
+            },
+            'message': f"{stats['importadas']} pacientes importados"
+        }), 200
+        
+    except ValueError as ve:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(ve)}), 400
+    except Exception as e:
+        db.session.rollback()
+        print(f"❌ Error importando pacientes: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': 'Error en el servidor',
+            'details': str(e)
+        }), 500
+
+
+@patient_bp.route('/import/rejects/<name>', methods=['GET'])
+@jwt_required()
+def get_import_rejects(name):
+    """Descargar el archivo de filas rechazadas de una importación - Solo admin"""
+    if get_jwt().get('rol') != 'admin':
+        return jsonify({
+            'success': False,
+            'error': 'Acceso denegado. Se requiere rol de administrador.'
+        }), 403
+    if not REJECTS_NAME_RE.match(name):
+        return jsonify({'success': False, 'error': 'Archivo no encontrado'}), 404
+    
+    return send_from_directory(
+        current_app.config['IMPORT_REJECTS_DIR'], name, mimetype=NDJSON_MIMETYPE, as_attachment=True
+    )
+
+
 @patient_bp.route('/<int:id>', methods=['GET'])
 @jwt_required()
 def get_patient(id):
-    """Obtener un paciente por ID"""
+    """
+    Obtener un paciente por ID
+    Responde con ETag; con If-None-Match vigente devuelve 304 sin cargar
+    ni descifrar los campos cifrados
+    """
     try:
+        etag = PatientService.current_etag(id)
+        if etag is None:
+            return jsonify({'error': 'Paciente no encontrado'}), 404
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        
         paciente = Paciente.query.get(id)
         
         if not paciente:
             return jsonify({'error': 'Paciente no encontrado'}), 404
         
-        patient_data = {
-            'id': paciente.id,
-            'cedula': paciente.cedula,
-            'nombre': paciente.nombre,
-            'apellido': paciente.apellido,
-            'fecha_nacimiento': paciente.fecha_nacimiento.isoformat() if paciente.fecha_nacimiento else None,
-            'genero': paciente.genero,
-            'grupo_sanguineo': paciente.grupo_sanguineo,
-            'telefono': paciente.telefono,
-            'email': paciente.email,
-            'direccion': paciente.direccion,
-            'created_at': paciente.created_at.isoformat() if paciente.created_at else None,
-            'updated_at': paciente.updated_at.isoformat() if paciente.updated_at else None
-        }
-        
         # Descifrar campos sensibles
-        if paciente.alergias_encrypted and paciente.alergias_iv:
-            try:
-                patient_data['alergias'] = get_crypto_service().decrypt_aes(
-                    paciente.alergias_encrypted,
-                    paciente.alergias_iv
-                )
-            except Exception as e:
-                print(f"⚠️  Error descifrando alergias: {e}")
-                patient_data['alergias'] = None
-        else:
-            patient_data['alergias'] = None
-            
-        if paciente.antecedentes_encrypted and paciente.antecedentes_iv:
-            try:
-                patient_data['antecedentes'] = get_crypto_service().decrypt_aes(
-                    paciente.antecedentes_encrypted,
-                    paciente.antecedentes_iv
-                )
-            except Exception as e:
-                print(f"⚠️  Error descifrando antecedentes: {e}")
-                patient_data['antecedentes'] = None
-        else:
-            patient_data['antecedentes'] = None
+        patient_data = PatientService.decrypt_patients([paciente])[0]
         
-        return jsonify(patient_data), 200
+        return with_etag(jsonify(patient_data), PatientService.etag(paciente))
         
     except Exception as e:
         print(f"❌ Error obteniendo paciente {id}: {str(e)}")
@@ -215,6 +403,41 @@ def get_patient(id):
         return jsonify({'error': str(e)}), 500
 
 
+@patient_bp.route('/<int:id>/timeline', methods=['GET'])
+@jwt_required()
+def get_patient_timeline(id):
+    """
+    Ficha completa de un paciente: datos, historias y recetas en tres consultas
+    Parámetros: ?desde=&hasta= (fecha_consulta, ISO 8601) y ?fields=&decrypt=
+    aplicados a las historias
+    """
+    try:
+        desde, hasta = parse_date_range(request.args)
+        record_plain_fields, record_fields = parse_projection(
+            request.args,
+            medical_record_service.PLAIN_FIELDS,
+            medical_record_service.ENCRYPTED_FIELDS,
+            medical_record_service.SUMMARY_FIELDS
+        )
+        
+        timeline = PatientService.timeline(id, desde, hasta, record_fields, record_plain_fields)
+        if timeline is None:
+            return jsonify({'error': 'Paciente no encontrado'}), 404
+        
+        return jsonify({
+            'success': True,
+            'data': timeline
+        }), 200
+        
+    except ValueError as ve:
+        return jsonify({'success': False, 'error': str(ve)}), 400
+    except Exception as e:
+        print(f"❌ Error obteniendo ficha del paciente {id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
 @patient_bp.route('/<int:id>', methods=['PUT'])
 @jwt_required()
 def update_patient(id):
@@ -244,6 +467,8 @@ def update_patient(id):
             paciente.email = data['email']
         if 'direccion' in data:
             paciente.direccion = data['direccion']
+        if 'doctor_id' in data:
+            paciente.doctor_id = data['doctor_id']
         
         # Actualizar campos cifrados
         if 'alergias' in data:
@@ -264,6 +489,11 @@ def update_patient(id):
                 paciente.antecedentes_encrypted = None
                 paciente.antecedentes_iv = None
         
+        # Mantener el índice ciego de los campos cifrados modificados
+        PatientSearchService.index_patient(paciente, {
+            field: data[field] for field in ENCRYPTED_FIELDS if field in data
+        })
+        
         paciente.updated_at = datetime.utcnow()
         db.session.commit()
         
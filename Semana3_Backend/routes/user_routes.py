@@ -2,7 +2,7 @@
 Rutas de Usuarios (Admin)
 """
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from models.base import db
 from models.user import Usuario
 from services.auth_service import AuthService
@@ -185,17 +185,22 @@ def update_user(user_id):
 @user_bp.route('/<int:user_id>', methods=['DELETE'])
 @jwt_required()
 def delete_user(user_id):
-    """Eliminar usuario - Solo admin"""
+    """
+    Dar de baja a un usuario - Solo admin
+    Baja lógica: el usuario queda inactivo (activo=False) y se conserva por
+    la cadena de auditoría; se puede reactivar con PUT {"activo": true}
+    """
     error_response = require_admin()
     if error_response:
         return error_response
     
     try:
-        AuthService.delete_user(user_id)
+        usuario = AuthService.deactivate_user(user_id, admin_id=int(get_jwt_identity()))
         
         return jsonify({
             'success': True,
-            'message': 'Usuario eliminado exitosamente'
+            'data': usuario.to_dict(),
+            'message': 'Usuario desactivado exitosamente'
         }), 200
         
     except ValueError as e:
@@ -209,14 +214,3 @@ def delete_user(user_id):
             'error': 'Error en el servidor',
             'details': str(e)
         }), 500
-        
-    except ValueError as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 404
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': 'Error en el servidor'
-        }), 500
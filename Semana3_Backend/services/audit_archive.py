@@ -0,0 +1,461 @@
+"""
+Archivo de auditoría en segmentos comprimidos
+Los meses cerrados de audit_logs se mueven a archivos de segmento locales
+(uno o más por mes) para que la tabla y sus índices solo contengan los meses
+recientes. Los listados de auditoría consultan ambos orígenes sin que el
+cliente lo note.
+
+Formato de segmento:
+    MAGIC | uint32 longitud de cabecera | cabecera JSON | bloques de columnas
+
+Cada columna se guarda como un bloque zlib independiente con una lista JSON
+(ids y timestamps en microsegundos, codificados por diferencias), así que
+para filtrar solo se descomprimen las columnas necesarias. Desde la versión
+2 cada bloque va cifrado con AES-GCM (subclave derivada de AES_MASTER_KEY,
+datos asociados mes|columna). index.json lista los segmentos con su rango de
+timestamps e ids para descartarlos sin abrirlos, y el SHA-256 del archivo,
+que se comprueba al abrir cada segmento.
+"""
+import os
+import json
+import zlib
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from models.base import db
+from models.audit_log import AuditLog
+from services.crypto_service import get_crypto_service
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+
+SEGMENT_MAGIC = b'MSAS\x01'
+SEGMENT_VERSION = 2  # 1 = bloques en claro, 2 = bloques cifrados con AES-GCM
+NONCE_SIZE = 12
+EPOCH = datetime(1970, 1, 1)
+
+# Columnas codificadas por diferencias (crecientes dentro de un segmento)
+DELTA_COLUMNS = ('id', 'timestamp')
+
+# Filas borradas de audit_logs por sentencia DELETE
+DELETE_CHUNK_SIZE = 1000
+
+
+class SegmentIntegrityError(ValueError):
+    """Segmento ausente del índice, modificado o cifrado con otra clave"""
+
+
+def to_micros(value):
+    """datetime -> microsegundos desde 1970 (sin zona horaria)"""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(value):
+    """microsegundos desde 1970 -> datetime"""
+    return EPOCH + timedelta(microseconds=value)
+
+
+def month_start(value):
+    """Primer instante del mes de value"""
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(value, months):
+    """Sumar (o restar) meses a un inicio de mes"""
+    index = value.year * 12 + value.month - 1 + months
+    return value.replace(year=index // 12, month=index % 12 + 1)
+
+
+def log_columns():
+    """Columnas de AuditLog que se archivan (todas)"""
+    return [column.name for column in AuditLog.__table__.columns]
+
+
+class AuditArchive:
+    """Archivador y lector de segmentos de auditoría"""
+
+    def __init__(self):
+        self.archive_dir = None
+        self.hot_months = 3
+        self.cache_size = 4
+
+        self._index = []
+        self._index_mtime = None
+        self._cache = OrderedDict()  # archivo -> {'header', 'data', 'columns'}
+        self._lock = threading.Lock()
+        self._aesgcm = None
+
+    def init_app(self, app):
+        """
+        Configurar directorio y meses que permanecen en la tabla
+
+        Args:
+            app: Aplicación Flask
+        """
+        self.archive_dir = app.config.get('AUDIT_ARCHIVE_DIR')
+        self.hot_months = app.config.get('AUDIT_HOT_MONTHS', 3)
+        self.cache_size = app.config.get('AUDIT_ARCHIVE_CACHE_SEGMENTS', 4)
+
+    # ==========================================
+    # Archivado
+    # ==========================================
+
+    def archive(self, keep_months=None):
+        """
+        Mover a segmentos los meses anteriores a los últimos keep_months
+
+        Cada mes se escribe en un archivo temporal y se valida leyéndolo; sus
+        filas se borran de audit_logs en una transacción que solo se
+        confirma después de publicar el segmento en index.json. Si el
+        proceso se interrumpe antes, las filas siguen en la tabla y el mes se
+        vuelve a archivar (el segmento huérfano no figura en el índice).
+
+        Args:
+            keep_months: Meses recientes que no se archivan (default: AUDIT_HOT_MONTHS)
+
+        Returns:
+            Lista de entradas de índice creadas
+        """
+        keep_months = self.hot_months if keep_months is None else keep_months
+        cutoff = add_months(month_start(datetime.now()), -keep_months)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        created = []
+        with self.lock():
+            while True:
+                oldest = db.session.query(db.func.min(AuditLog.timestamp)).filter(
+                    AuditLog.timestamp < cutoff
+                ).scalar()
+                if oldest is None:
+                    break
+
+                start = month_start(oldest)
+                entry = self._archive_month(start, min(add_months(start, 1), cutoff))
+                if entry:
+                    created.append(entry)
+        return created
+
+    @contextmanager
+    def lock(self, shared=False):
+        """
+        Bloqueo entre procesos del directorio del archivo (archivado exclusivo;
+        compartido para leer una foto coherente, p. ej. en las copias)
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        with open(os.path.join(self.archive_dir, '.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def _archive_month(self, start, end):
+        """Archivar las filas con start <= timestamp < end"""
+        names = log_columns()
+        columns = {name: [] for name in names}
+        rows = db.session.execute(
+            db.select(*(getattr(AuditLog, name) for name in names))
+            .where(AuditLog.timestamp >= start, AuditLog.timestamp < end)
+            .order_by(AuditLog.timestamp, AuditLog.id)
+            .execution_options(yield_per=DELETE_CHUNK_SIZE)
+        )
+        for row in rows:
+            for name, value in zip(names, row):
+                columns[name].append(to_micros(value) if isinstance(value, datetime) else value)
+
+        if not columns['id']:
+            return None
+
+        month = start.strftime('%Y-%m')
+        sequence = 1 + sum(1 for entry in self.segments() if entry['month'] == month)
+        filename = f'audit-{month}-{sequence:03d}.seg'
+        path = os.path.join(self.archive_dir, filename)
+
+        data = self._encode_segment(month, columns)
+        digest = hashlib.sha256(data).hexdigest()
+        with open(path + '.tmp', 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(path + '.tmp', path)
+
+        with open(path, 'rb') as fh:
+            written = fh.read()
+        header = self._parse_header(written, filename)
+        if hashlib.sha256(written).hexdigest() != digest or header['rows'] != len(columns['id']):
+            raise ValueError(f'Segmento {filename} inválido tras escribirlo')
+
+        entry = {
+            'file': filename,
+            'month': month,
+            'rows': header['rows'],
+            'min_ts': header['min_ts'],
+            'max_ts': header['max_ts'],
+            'min_id': header['min_id'],
+            'max_id': header['max_id'],
+            'bytes': len(data),
+            'sha256': digest,
+            # Último eslabón de la cadena de hashes dentro del segmento
+            'max_id_hash': columns['hash_actual'][columns['id'].index(header['max_id'])],
+            'por_usuario': {
+                str(user_id): count
+                for user_id, count in Counter(columns['usuario_id']).items() if user_id is not None
+            },
+        }
+        ids = columns['id']
+        for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+            db.session.execute(db.delete(AuditLog).where(AuditLog.id.in_(ids[i:i + DELETE_CHUNK_SIZE])))
+        try:
+            self._write_index(self.segments() + [entry])
+        except Exception:
+            db.session.rollback()
+            raise
+        db.session.commit()
+
+        print(f"📦 {entry['rows']} logs de {month} archivados en {filename} ({entry['bytes']} bytes)")
+        return entry
+
+    def _cipher(self):
+        """AES-GCM con la subclave del archivo (se crea al primer uso)"""
+        if self._aesgcm is None:
+            self._aesgcm = AESGCM(get_crypto_service().derive_key(b'medsafe-audit-archive-v1'))
+        return self._aesgcm
+
+    @staticmethod
+    def _block_associated_data(month, name):
+        """Datos asociados de un bloque: no se puede mover a otro mes o columna"""
+        return f'{month}|{name}'.encode('utf-8')
+
+    def _encode_segment(self, month, columns):
+        """Serializar columnas en el formato de segmento (bloques cifrados)"""
+        blocks = []
+        layout = {}
+        offset = 0
+        for name, values in columns.items():
+            if name in DELTA_COLUMNS:
+                values = [b - a for a, b in zip([0] + values[:-1], values)]
+            block = zlib.compress(json.dumps(values, separators=(',', ':')).encode('utf-8'), 9)
+            nonce = os.urandom(NONCE_SIZE)
+            block = nonce + self._cipher().encrypt(nonce, block, self._block_associated_data(month, name))
+            layout[name] = {'offset': offset, 'length': len(block), 'delta': name in DELTA_COLUMNS}
+            blocks.append(block)
+            offset += len(block)
+
+        header = json.dumps({
+            'version': SEGMENT_VERSION,
+            'month': month,
+            'rows': len(columns['id']),
+            'min_ts': min(columns['timestamp']),
+            'max_ts': max(columns['timestamp']),
+            'min_id': min(columns['id']),
+            'max_id': max(columns['id']),
+            'columns': layout,
+        }).encode('utf-8')
+        return SEGMENT_MAGIC + struct.pack('>I', len(header)) + header + b''.join(blocks)
+
+    # ==========================================
+    # Índice y lectura
+    # ==========================================
+
+    def segments(self):
+        """Entradas de index.json (se recarga si otro proceso lo cambió)"""
+        if not self.archive_dir:
+            return []
+        path = os.path.join(self.archive_dir, 'index.json')
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        with self._lock:
+            if mtime != self._index_mtime:
+                with open(path, 'r', encoding='utf-8') as fh:
+                    self._index = json.load(fh)['segments']
+                self._index_mtime = mtime
+            return list(self._index)
+
+    def _write_index(self, entries):
+        """Reemplazar index.json de forma atómica"""
+        path = os.path.join(self.archive_dir, 'index.json')
+        entries = sorted(entries, key=lambda entry: (entry['min_ts'], entry['min_id']))
+        with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+            json.dump({'segments': entries}, fh, indent=1)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(path + '.tmp', path)
+
+    @staticmethod
+    def _parse_header(data, filename):
+        """Cabecera de un segmento a partir de su contenido"""
+        if not data.startswith(SEGMENT_MAGIC) or len(data) < len(SEGMENT_MAGIC) + 4:
+            raise ValueError(f'{filename} no es un segmento de auditoría')
+        (length,) = struct.unpack_from('>I', data, len(SEGMENT_MAGIC))
+        header = json.loads(data[len(SEGMENT_MAGIC) + 4:len(SEGMENT_MAGIC) + 4 + length])
+        header['data_offset'] = len(SEGMENT_MAGIC) + 4 + length
+        return header
+
+    def _open(self, filename):
+        """
+        Leer un segmento completo y comprobar su SHA-256 contra index.json
+
+        Raises:
+            SegmentIntegrityError: si el segmento no está en el índice o fue modificado
+        """
+        entry = next((entry for entry in self.segments() if entry['file'] == filename), None)
+        if entry is None:
+            raise SegmentIntegrityError(f'Segmento {filename} no figura en index.json')
+        with open(os.path.join(self.archive_dir, filename), 'rb') as fh:
+            data = fh.read()
+        if hashlib.sha256(data).hexdigest() != entry['sha256']:
+            raise SegmentIntegrityError(f'Segmento {filename} modificado: SHA-256 distinto al de index.json')
+        return {'header': self._parse_header(data, filename), 'data': data, 'columns': {}}
+
+    def column(self, filename, name):
+        """Valores de una columna de un segmento (con caché LRU por segmento)"""
+        with self._lock:
+            segment = self._cache.get(filename)
+            if segment is not None:
+                self._cache.move_to_end(filename)
+                if name in segment['columns']:
+                    return segment['columns'][name]
+
+        if segment is None:
+            segment = self._open(filename)
+        header = segment['header']
+        layout = header['columns'].get(name)
+        if layout is None:
+            values = [None] * header['rows']  # Columna agregada después de archivar
+        else:
+            start = header['data_offset'] + layout['offset']
+            block = segment['data'][start:start + layout['length']]
+            if header.get('version', 1) >= 2:
+                try:
+                    block = self._cipher().decrypt(
+                        block[:NONCE_SIZE], block[NONCE_SIZE:],
+                        self._block_associated_data(header['month'], name)
+                    )
+                except InvalidTag:
+                    raise SegmentIntegrityError(
+                        f'Segmento {filename}: columna {name} alterada o cifrada con otra clave maestra'
+                    )
+            values = json.loads(zlib.decompress(block))
+            if layout['delta']:
+                total = 0
+                for i, delta in enumerate(values):
+                    total += delta
+                    values[i] = total
+
+        with self._lock:
+            segment = self._cache.setdefault(filename, segment)
+            segment['columns'][name] = values
+            self._cache.move_to_end(filename)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return values
+
+    def _overlapping(self, filters, before=None):
+        """Segmentos que pueden contener filas del rango pedido"""
+        desde = filters.get('desde')
+        hasta = filters.get('hasta')
+        result = []
+        for entry in self.segments():
+            if desde and entry['max_ts'] < to_micros(desde):
+                continue
+            if hasta and entry['min_ts'] > to_micros(hasta):
+                continue
+            if before and (entry['min_ts'], entry['min_id']) >= (to_micros(before[0]), before[1]):
+                continue
+            result.append(entry)
+        return result
+
+    def _matches(self, entry, filters, before=None):
+        """Índices de las filas de un segmento que cumplen los filtros"""
+        filename = entry['file']
+        ids = self.column(filename, 'id')
+        timestamps = self.column(filename, 'timestamp')
+        checks = []
+        if filters.get('accion'):
+            checks.append((self.column(filename, 'accion'), filters['accion']))
+        if filters.get('usuario_id'):
+            checks.append((self.column(filename, 'usuario_id'), filters['usuario_id']))
+        if filters.get('tabla_afectada'):
+            checks.append((self.column(filename, 'tabla_afectada'), filters['tabla_afectada']))
+
+        desde = to_micros(filters['desde']) if filters.get('desde') else None
+        hasta = to_micros(filters['hasta']) if filters.get('hasta') else None
+        before_key = (to_micros(before[0]), before[1]) if before else None
+
+        matches = []
+        for i, timestamp in enumerate(timestamps):
+            if desde is not None and timestamp < desde:
+                continue
+            if hasta is not None and timestamp > hasta:
+                continue
+            if before_key is not None and (timestamp, ids[i]) >= before_key:
+                continue
+            if all(values[i] == expected for values, expected in checks):
+                matches.append(i)
+        return matches
+
+    def query(self, filters, before=None, limit=20):
+        """
+        Logs archivados más recientes que cumplen los filtros
+
+        Args:
+            filters: dict con accion, usuario_id, tabla_afectada, desde, hasta
+            before: (timestamp, id) del cursor; solo filas anteriores
+            limit: Máximo de filas
+
+        Returns:
+            Lista de AuditLog transitorios (sin sesión) de más reciente a más antiguo
+        """
+        candidates = []
+        entries = sorted(self._overlapping(filters, before), key=lambda e: (e['max_ts'], e['max_id']),
+                         reverse=True)
+        for entry in entries:
+            if len(candidates) >= limit and entry['max_ts'] < candidates[limit - 1][0]:
+                break
+            ids = self.column(entry['file'], 'id')
+            timestamps = self.column(entry['file'], 'timestamp')
+            candidates.extend(
+                (timestamps[i], ids[i], entry['file'], i) for i in self._matches(entry, filters, before)
+            )
+            candidates.sort(reverse=True)
+            del candidates[limit:]
+
+        names = log_columns()
+        logs = []
+        for _, _, filename, i in candidates:
+            row = {name: self.column(filename, name)[i] for name in names}
+            row['timestamp'] = from_micros(row['timestamp'])
+            logs.append(AuditLog(**row))
+        return logs
+
+    def count(self, filters):
+        """Número exacto de logs archivados que cumplen los filtros"""
+        only_dates = not any(filters.get(key) for key in ('accion', 'usuario_id', 'tabla_afectada'))
+        desde = to_micros(filters['desde']) if filters.get('desde') else None
+        hasta = to_micros(filters['hasta']) if filters.get('hasta') else None
+
+        total = 0
+        for entry in self._overlapping(filters):
+            inside = (desde is None or entry['min_ts'] >= desde) and (hasta is None or entry['max_ts'] <= hasta)
+            if only_dates and inside:
+                total += entry['rows']
+            else:
+                total += len(self._matches(entry, filters))
+        return total
+
+    def count_user(self, usuario_id):
+        """Logs archivados de un usuario (desde el índice, sin abrir segmentos)"""
+        return sum(entry.get('por_usuario', {}).get(str(usuario_id), 0) for entry in self.segments())
+
+
+# Instancia global del archivo
+audit_archive = AuditArchive()
@@ -0,0 +1,321 @@
+"""
+Cadena de hashes de auditoría con puntos de control firmados
+Cada fila de audit_logs guarda el SHA-256 de su contenido encadenado con el
+hash de la fila anterior (por id). Cada AUDIT_CHECKPOINT_INTERVAL filas se
+firma el hash de la cadena con la ClaveRSA del usuario de servicio, así que
+verificar solo requiere recorrer las filas posteriores al último punto de
+control.
+"""
+import json
+import base64
+import heapq
+from datetime import datetime
+from flask import current_app
+from models.base import db
+from models.user import Usuario
+from models.audit_log import AuditLog, AuditCheckpoint
+from models.rsa_key import ClaveRSA
+from services.audit_archive import audit_archive, from_micros, SegmentIntegrityError
+from services.crypto_service import get_crypto_service
+from services.key_service import KeyService
+
+
+# Hash anterior de la primera fila encadenada
+GENESIS_HASH = '0' * 64
+
+# Columnas cubiertas por el hash (en este orden). usuario_id es estable:
+# la FK es RESTRICT y no se eliminan usuarios con auditoría
+HASHED_COLUMNS = (
+    'usuario_id', 'accion', 'tabla_afectada', 'registro_id',
+    'datos_anteriores', 'datos_nuevos', 'ip_address', 'timestamp'
+)
+
+# Columnas JSON (JSONB en PostgreSQL: se leen como dict)
+JSON_COLUMNS = ('datos_anteriores', 'datos_nuevos')
+
+# Clave del bloqueo consultivo de PostgreSQL que serializa los volcados
+CHAIN_LOCK_KEY = 29777
+
+
+def canonical_json(value):
+    """
+    Forma canónica de un valor JSON (texto o ya decodificado)
+
+    Un JSONB de PostgreSQL vuelve como dict con otro orden de claves y otros
+    espacios que el texto insertado; ambos dan la misma forma canónica.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value  # Texto que no es JSON: se usa tal cual
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+
+class AuditChain:
+    """Servicio de encadenado, puntos de control y verificación de auditoría"""
+
+    @staticmethod
+    def row_hash(previous_hash, row, canonical=True):
+        """
+        Hash de una fila encadenado con el de la anterior
+
+        Args:
+            previous_hash: hash_actual de la fila anterior (o GENESIS_HASH)
+            row: dict (o AuditLog) con las columnas de HASHED_COLUMNS
+            canonical: False para el cálculo anterior (JSON tal como se guardó),
+                       solo para verificar filas antiguas
+
+        Returns:
+            SHA-256 hexadecimal
+        """
+        get = row.get if isinstance(row, dict) else lambda name: getattr(row, name)
+        values = [previous_hash]
+        for name in HASHED_COLUMNS:
+            value = get(name)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            elif canonical and name in JSON_COLUMNS:
+                value = canonical_json(value)
+            values.append(value)
+        return get_crypto_service().calculate_sha256(
+            json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+        )
+
+    @staticmethod
+    def lock():
+        """
+        Serializar el encadenado entre procesos hasta el fin de la transacción
+        (PostgreSQL; en SQLite las escrituras ya son exclusivas)
+        """
+        if db.session.get_bind().dialect.name == 'postgresql':
+            db.session.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHAIN_LOCK_KEY})
+
+    @staticmethod
+    def head():
+        """
+        Último eslabón de la cadena: (log_id, hash_actual)
+
+        Se busca en la tabla activa y en el archivo; sin filas encadenadas
+        devuelve (None, GENESIS_HASH).
+        """
+        row = db.session.query(AuditLog.id, AuditLog.hash_actual).filter(
+            AuditLog.hash_actual.isnot(None)
+        ).order_by(AuditLog.id.desc()).first()
+
+        head = (row.id, row.hash_actual) if row else (None, GENESIS_HASH)
+        for entry in audit_archive.segments():
+            if entry.get('max_id_hash') and (head[0] is None or entry['max_id'] > head[0]):
+                head = (entry['max_id'], entry['max_id_hash'])
+        return head
+
+    @staticmethod
+    def link(events):
+        """
+        Asignar hash_anterior/hash_actual a un lote antes de insertarlo
+
+        Debe llamarse dentro de la transacción del INSERT, después de lock().
+        Los eventos se insertan en el orden de la lista, que es el de sus ids.
+        """
+        _, previous = AuditChain.head()
+        for event in events:
+            event['hash_anterior'] = previous
+            event['hash_actual'] = previous = AuditChain.row_hash(previous, event)
+
+    # ==========================================
+    # Puntos de control
+    # ==========================================
+
+    @staticmethod
+    def signing_user():
+        """Usuario cuya ClaveRSA firma los puntos de control (AUDIT_SIGNING_USER)"""
+        return Usuario.query.filter_by(username=current_app.config.get('AUDIT_SIGNING_USER', 'admin')).first()
+
+    @staticmethod
+    def checkpoint(min_rows=1):
+        """
+        Firmar el hash actual de la cadena si hay al menos min_rows filas nuevas
+
+        Returns:
+            AuditCheckpoint creado, o None si no hacía falta o no hay firmante
+        """
+        last = AuditCheckpoint.query.order_by(AuditCheckpoint.id.desc()).first()
+        head_id, head_hash = AuditChain.head()
+        if head_id is None or (last and head_id <= last.ultimo_log_id):
+            return None
+
+        rows = AuditLog.query.filter(
+            AuditLog.id > (last.ultimo_log_id if last else 0),
+            AuditLog.id <= head_id,
+            AuditLog.hash_actual.isnot(None)
+        ).count()
+        if rows < min_rows:
+            return None
+
+        usuario = AuditChain.signing_user()
+        if not usuario:
+            print("⚠️  Sin usuario firmante (AUDIT_SIGNING_USER); no se crea punto de control")
+            return None
+
+        clave = KeyService.get_or_create_user_keys(usuario.id)
+        checkpoint = AuditCheckpoint(
+            ultimo_log_id=head_id,
+            hash_cadena=head_hash,
+            filas=rows,
+            usuario_id=usuario.id,
+            firma=''
+        )
+        signature = get_crypto_service().sign_rsa(checkpoint.payload(), KeyService.load_private_key(clave))
+        checkpoint.firma = base64.b64encode(signature).decode('utf-8')
+
+        db.session.add(checkpoint)
+        db.session.commit()
+        return checkpoint
+
+    @staticmethod
+    def maybe_checkpoint():
+        """Crear un punto de control cada AUDIT_CHECKPOINT_INTERVAL filas (0 = nunca)"""
+        interval = current_app.config.get('AUDIT_CHECKPOINT_INTERVAL', 1000)
+        if interval:
+            AuditChain.checkpoint(min_rows=interval)
+
+    @staticmethod
+    def verify_signature(checkpoint):
+        """True si la firma del punto de control es válida"""
+        clave = ClaveRSA.query.filter_by(usuario_id=checkpoint.usuario_id).first()
+        if not clave:
+            return False
+        try:
+            signature = base64.b64decode(checkpoint.firma)
+        except ValueError:
+            return False
+        return get_crypto_service().verify_signature_rsa(checkpoint.payload(), signature, clave.public_key)
+
+    # ==========================================
+    # Verificación
+    # ==========================================
+
+    @staticmethod
+    def iter_rows(after_id=0, batch_size=1000):
+        """
+        Filas con id > after_id en orden de id, de la tabla activa y del archivo
+
+        Yields:
+            (id, hash_anterior, hash_actual, dict de HASHED_COLUMNS)
+        """
+        sources = [AuditChain._iter_table(after_id, batch_size)]
+        for entry in audit_archive.segments():
+            if entry['max_id'] > after_id:
+                sources.append(AuditChain._iter_segment(entry, after_id))
+        return heapq.merge(*sources, key=lambda row: row[0])
+
+    @staticmethod
+    def _iter_table(after_id, batch_size):
+        """Filas de audit_logs por lotes de ids"""
+        columns = [getattr(AuditLog, name) for name in HASHED_COLUMNS]
+        while True:
+            rows = db.session.query(
+                AuditLog.id, AuditLog.hash_anterior, AuditLog.hash_actual, *columns
+            ).filter(AuditLog.id > after_id).order_by(AuditLog.id).limit(batch_size).all()
+            for row in rows:
+                yield row[0], row[1], row[2], dict(zip(HASHED_COLUMNS, row[3:]))
+            if len(rows) < batch_size:
+                return
+            after_id = rows[-1][0]
+
+    @staticmethod
+    def _iter_segment(entry, after_id):
+        """Filas de un segmento archivado, ordenadas por id"""
+        column = lambda name: audit_archive.column(entry['file'], name)
+        ids = column('id')
+        previous = column('hash_anterior')
+        current = column('hash_actual')
+        values = {name: column(name) for name in HASHED_COLUMNS}
+        for i in sorted(range(len(ids)), key=ids.__getitem__):
+            if ids[i] <= after_id:
+                continue
+            row = {name: values[name][i] for name in HASHED_COLUMNS}
+            row['timestamp'] = from_micros(row['timestamp'])
+            yield ids[i], previous[i], current[i], row
+
+    @staticmethod
+    def verify(checkpoint_id=None, full=False):
+        """
+        Verificar la cadena desde un punto de control
+
+        Se comprueba la firma del punto de partida y se recalcula cada fila
+        posterior; al pasar por otros puntos de control se valida también
+        su firma y que su hash coincida con el de la cadena.
+
+        Args:
+            checkpoint_id: Punto de control de partida (default: el último)
+            full: True para recorrer desde la primera fila encadenada
+
+        Returns:
+            dict con valid, filas verificadas, rango y el primer error
+        """
+        checkpoints = AuditCheckpoint.query.order_by(AuditCheckpoint.ultimo_log_id).all()
+        start = None
+        if not full:
+            if checkpoint_id is not None:
+                start = next((c for c in checkpoints if c.id == checkpoint_id), None)
+                if start is None:
+                    raise ValueError('Punto de control no encontrado')
+            elif checkpoints:
+                start = checkpoints[-1]
+
+        result = {
+            'valid': True,
+            'checkpoint_id': start.id if start else None,
+            'desde_log_id': start.ultimo_log_id if start else None,
+            'hasta_log_id': start.ultimo_log_id if start else None,
+            'filas_verificadas': 0,
+            'checkpoints_verificados': 0,
+            'error': None
+        }
+
+        def fail(log_id, message):
+            result['valid'] = False
+            result['error'] = {'log_id': log_id, 'motivo': message}
+            return result
+
+        if start:
+            if not AuditChain.verify_signature(start):
+                return fail(start.ultimo_log_id, f'Firma inválida en el punto de control #{start.id}')
+            result['checkpoints_verificados'] = 1
+
+        pending = [c for c in checkpoints if not start or c.ultimo_log_id > start.ultimo_log_id]
+        previous = start.hash_cadena if start else None
+        try:
+            rows = AuditChain.iter_rows(start.ultimo_log_id if start else 0)
+            for log_id, hash_anterior, hash_actual, row in rows:
+                if previous is None:
+                    if hash_actual is None:
+                        continue  # Filas anteriores al encadenado
+                    previous = GENESIS_HASH
+                if hash_anterior != previous:
+                    return fail(log_id, 'hash_anterior no coincide con la fila previa (fila eliminada o reordenada)')
+                # Las filas anteriores al JSON canónico se hashearon con el texto guardado
+                if hash_actual not in (AuditChain.row_hash(previous, row),
+                                       AuditChain.row_hash(previous, row, canonical=False)):
+                    return fail(log_id, 'Contenido modificado')
+                previous = hash_actual
+                result['filas_verificadas'] += 1
+                result['hasta_log_id'] = log_id
+
+                while pending and pending[0].ultimo_log_id <= log_id:
+                    checkpoint = pending.pop(0)
+                    if checkpoint.ultimo_log_id != log_id or checkpoint.hash_cadena != hash_actual:
+                        return fail(log_id, f'La cadena no coincide con el punto de control #{checkpoint.id}')
+                    if not AuditChain.verify_signature(checkpoint):
+                        return fail(log_id, f'Firma inválida en el punto de control #{checkpoint.id}')
+                    result['checkpoints_verificados'] += 1
+        except SegmentIntegrityError as e:
+            return fail(result['hasta_log_id'], str(e))
+
+        if pending:
+            return fail(pending[0].ultimo_log_id,
+                        f'Faltan filas cubiertas por el punto de control #{pending[0].id}')
+        return result
@@ -0,0 +1,313 @@
+"""
+Cola de auditoría con escritura diferida (write-behind)
+Acumula eventos AuditLog en memoria y los inserta en lote cuando se alcanza
+un tamaño o un intervalo de tiempo. Cada evento se escribe antes en un
+archivo spool local (append-only) para que sobreviva a una caída del proceso.
+"""
+import os
+import glob
+import json
+import atexit
+import threading
+from datetime import datetime
+from models.base import db
+from models.audit_log import AuditLog
+from services.audit_chain import AuditChain
+from services.audit_stats import AuditStatsService
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+
+# Columnas de AuditLog que viajan en cada evento
+AUDIT_COLUMNS = (
+    'usuario_id', 'accion', 'tabla_afectada', 'registro_id',
+    'datos_anteriores', 'datos_nuevos', 'ip_address', 'timestamp'
+)
+
+
+class PartialFlushError(Exception):
+    """Volcado interrumpido después de confirmar los primeros done eventos"""
+
+    def __init__(self, error, done):
+        super().__init__(str(error))
+        self.error = error
+        self.done = done
+
+
+class AuditQueue:
+    """Buffer de eventos de auditoría con volcado por lotes"""
+
+    def __init__(self):
+        self.app = None
+        self.batch_size = 100
+        self.flush_interval = 2.0
+        self.fsync = False
+        self.spool_path = None
+
+        self._buffer = []
+        self._spool = None
+        self._lock = threading.Lock()        # Protege buffer y spool
+        self._flush_lock = threading.Lock()  # Un volcado a la vez
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """
+        Configurar la cola
+
+        El spool y el hilo de volcado se crean con el primer evento (start),
+        así los procesos que solo importan la aplicación (comandos de
+        medsafe.py) no arrancan el hilo ni adoptan spools de otros procesos,
+        y con gunicorn cada worker arranca el suyo después del fork.
+
+        Args:
+            app: Aplicación Flask
+        """
+        self.app = app
+        self.batch_size = app.config.get('AUDIT_BATCH_SIZE', 100)
+        self.flush_interval = app.config.get('AUDIT_FLUSH_INTERVAL', 2.0)
+        self.fsync = app.config.get('AUDIT_SPOOL_FSYNC', False)
+
+    def start(self):
+        """
+        Abrir el spool de este proceso y arrancar el hilo de volcado
+
+        Recupera los eventos que quedaron en spools de procesos anteriores
+        (caída o reinicio) para insertarlos en el próximo volcado.
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+
+            spool_dir = self.app.config.get('AUDIT_SPOOL_DIR')
+            os.makedirs(spool_dir, exist_ok=True)
+            self.spool_path = os.path.join(spool_dir, f'audit-{os.getpid()}.spool')
+
+            self._spool = open(self.spool_path, 'a+', encoding='utf-8')
+            self._lock_file(self._spool)
+            self._recover(spool_dir)
+
+            self._thread = threading.Thread(target=self._run, name='audit-queue', daemon=True)
+            self._thread.start()
+        atexit.register(self.shutdown)
+
+    def enqueue(self, **event):
+        """
+        Encolar un evento de auditoría
+
+        Args:
+            **event: Valores de columnas de AuditLog (ver AUDIT_COLUMNS)
+        """
+        if self._thread is None and self.app is not None:
+            self.start()
+        event.setdefault('timestamp', datetime.now())
+        line = json.dumps(self._encode(event))
+
+        with self._lock:
+            if self._spool is not None:
+                self._spool.write(line + '\n')
+                self._spool.flush()
+                if self.fsync:
+                    os.fsync(self._spool.fileno())
+            self._buffer.append(event)
+            full = len(self._buffer) >= self.batch_size
+
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Insertar en la base de datos todos los eventos pendientes
+
+        Si la inserción en lote falla se reintenta fila por fila, descartando
+        solo las filas inválidas. Si la base de datos no está disponible los
+        eventos no insertados vuelven al buffer y permanecen en el spool.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch = self._buffer
+                self._buffer = []
+                spool_offset = 0
+                if self._spool is not None:
+                    self._spool.seek(0, os.SEEK_END)
+                    spool_offset = self._spool.tell()
+
+            if not batch:
+                return 0
+
+            try:
+                with self.app.app_context():
+                    self._write_batch(batch)
+            except PartialFlushError as e:
+                # Las filas ya confirmadas salen del buffer y del spool
+                print(f"⚠️  Error volcando auditoría, se reintentará: {str(e.error)}")
+                with self._lock:
+                    self._buffer = batch[e.done:] + self._buffer
+                    self._drop_spool_lines(e.done)
+                return e.done
+            except Exception as e:
+                print(f"⚠️  Error volcando auditoría, se reintentará: {str(e)}")
+                with self._lock:
+                    self._buffer = batch + self._buffer
+                return 0
+
+            with self._lock:
+                self._compact_spool(spool_offset)
+
+            try:
+                with self.app.app_context():
+                    AuditChain.maybe_checkpoint()
+            except Exception as e:
+                print(f"⚠️  Error creando punto de control de auditoría: {str(e)}")
+
+            return len(batch)
+
+    def shutdown(self):
+        """Detener el hilo de volcado y vaciar la cola"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def pending(self):
+        """Número de eventos aún no insertados"""
+        with self._lock:
+            return len(self._buffer)
+
+    # ==========================================
+    # Internos
+    # ==========================================
+
+    def _run(self):
+        """Bucle del hilo: volcar por tamaño (wakeup) o por tiempo"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  Error en hilo de auditoría: {str(e)}")
+
+    def _write_batch(self, batch):
+        """
+        Insertar un lote de eventos, encadenado a la fila anterior, y sus
+        conteos en una transacción propia
+        """
+        try:
+            AuditChain.lock()
+            AuditChain.link(batch)
+            db.session.execute(db.insert(AuditLog), batch)
+            AuditStatsService.apply(AuditStatsService.count_events(batch))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️  Error en inserción por lote de auditoría: {str(e)}")
+            self._write_rows(batch)
+
+    def _write_rows(self, batch):
+        """
+        Insertar eventos uno a uno, descartando los que la base rechaza
+
+        Raises:
+            PartialFlushError: si falla la conexión; indica cuántos eventos
+                               del inicio del lote ya se procesaron
+        """
+        for done, event in enumerate(batch):
+            try:
+                AuditChain.lock()
+                AuditChain.link([event])
+                db.session.execute(db.insert(AuditLog), [event])
+                AuditStatsService.apply(AuditStatsService.count_events([event]))
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                if not self._is_row_error(e):
+                    raise PartialFlushError(e, done)
+                print(f"⚠️  Evento de auditoría descartado ({event.get('accion')}): {str(e)}")
+
+    @staticmethod
+    def _is_row_error(error):
+        """True si el error se debe a la fila y no a la conexión"""
+        from sqlalchemy.exc import IntegrityError, DataError
+        return isinstance(error, (IntegrityError, DataError))
+
+    def _compact_spool(self, offset):
+        """Eliminar del spool los eventos ya insertados (hasta offset)"""
+        if self._spool is None:
+            return
+        self._spool.seek(offset)
+        remaining = self._spool.read()
+        self._spool.seek(0)
+        self._spool.truncate()
+        self._spool.write(remaining)
+        self._spool.flush()
+
+    def _drop_spool_lines(self, count):
+        """Eliminar del spool los primeros count eventos (ya procesados)"""
+        if self._spool is None or not count:
+            return
+        self._spool.seek(0)
+        for _ in range(count):
+            self._spool.readline()
+        self._compact_spool(self._spool.tell())
+
+    def _recover(self, spool_dir):
+        """Cargar eventos de spools huérfanos (incluido el propio)"""
+        for path in sorted(glob.glob(os.path.join(spool_dir, 'audit-*.spool'))):
+            if path == self.spool_path:
+                self._spool.seek(0)
+                lines = self._spool.read().splitlines()
+            else:
+                with open(path, 'r+', encoding='utf-8') as orphan:
+                    if not self._lock_file(orphan, blocking=False):
+                        continue  # Spool de un proceso vivo
+                    lines = orphan.read().splitlines()
+                    self._spool.write(''.join(line + '\n' for line in lines))
+                    self._spool.flush()
+                os.remove(path)
+
+            for line in lines:
+                try:
+                    self._buffer.append(self._decode(json.loads(line)))
+                except ValueError:
+                    print("⚠️  Línea de spool de auditoría inválida, se ignora")
+
+        if self._buffer:
+            print(f"ℹ️  Recuperados {len(self._buffer)} eventos de auditoría del spool")
+
+    @staticmethod
+    def _lock_file(fh, blocking=True):
+        """Bloqueo exclusivo del archivo (no-op en plataformas sin fcntl)"""
+        if fcntl is None:
+            return True
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(fh.fileno(), flags)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _encode(event):
+        """Evento -> dict serializable a JSON"""
+        data = dict(event)
+        if isinstance(data.get('timestamp'), datetime):
+            data['timestamp'] = data['timestamp'].isoformat()
+        return data
+
+    @staticmethod
+    def _decode(data):
+        """dict del spool -> evento"""
+        event = {key: data.get(key) for key in AUDIT_COLUMNS if key in data}
+        if event.get('timestamp'):
+            event['timestamp'] = datetime.fromisoformat(event['timestamp'])
+        return event
+
+
+# Instancia global de la cola
+audit_queue = AuditQueue()
@@ -0,0 +1,281 @@
+"""
+Estadísticas de auditoría por intervalos (rollup)
+Los conteos por hora y por día, acción y tabla se suman en audit_stats en la
+misma transacción que inserta cada lote de AuditLog, de modo que el panel de
+administración consulta O(intervalos) filas en lugar de O(logs).
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy.dialects import postgresql, sqlite
+from models.base import db
+from models.audit_log import AuditLog, AuditStat
+from services.audit_archive import audit_archive, from_micros
+
+
+# Granularidades soportadas y su tamaño de intervalo
+GRANULARITIES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+# Ventana por defecto de /stats/series por granularidad
+DEFAULT_SERIES_WINDOW = {
+    'hour': timedelta(hours=24),
+    'day': timedelta(days=30),
+}
+
+# Máximo de intervalos por serie
+MAX_SERIES_BUCKETS = 2000
+
+# Clave única de una fila de audit_stats
+STAT_KEY = ('granularidad', 'bucket', 'accion', 'tabla_afectada')
+
+# Filas por sentencia INSERT ... ON CONFLICT
+UPSERT_CHUNK_SIZE = 500
+
+
+class AuditStatsService:
+    """Servicio de conteos incrementales de auditoría"""
+
+    @staticmethod
+    def bucket_start(timestamp, granularity):
+        """Inicio del intervalo que contiene timestamp"""
+        if granularity == 'day':
+            return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+
+    @staticmethod
+    def count_events(events):
+        """
+        Conteos por (granularidad, intervalo, acción, tabla) de un lote
+
+        Args:
+            events: dicts con accion, tabla_afectada y timestamp
+
+        Returns:
+            Counter con las claves de STAT_KEY
+        """
+        counts = Counter()
+        for event in events:
+            timestamp = event.get('timestamp') or datetime.now()
+            for granularity in GRANULARITIES:
+                counts[(
+                    granularity,
+                    AuditStatsService.bucket_start(timestamp, granularity),
+                    event.get('accion'),
+                    event.get('tabla_afectada') or ''
+                )] += 1
+        return counts
+
+    @staticmethod
+    def apply(counts):
+        """
+        Sumar conteos a audit_stats (sin commit: se usa dentro de la
+        transacción que inserta los logs)
+
+        En PostgreSQL y SQLite se usa INSERT ... ON CONFLICT DO UPDATE, que
+        es seguro con varios procesos volcando a la vez. Las filas se envían
+        ordenadas para que dos volcados no se bloqueen mutuamente.
+        """
+        if not counts:
+            return
+
+        rows = [
+            dict(zip(STAT_KEY, key), total=total)
+            for key, total in sorted(counts.items(), key=lambda item: item[0])
+        ]
+
+        dialect = db.session.get_bind().dialect.name
+        if dialect in ('postgresql', 'sqlite'):
+            insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+            for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+                stmt = insert(AuditStat).values(rows[start:start + UPSERT_CHUNK_SIZE])
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=list(STAT_KEY),
+                    set_={'total': AuditStat.total + stmt.excluded.total}
+                )
+                db.session.execute(stmt)
+            return
+
+        for row in rows:
+            updated = db.session.execute(
+                db.update(AuditStat)
+                .where(*(getattr(AuditStat, column) == row[column] for column in STAT_KEY))
+                .values(total=AuditStat.total + row['total'])
+            )
+            if not updated.rowcount:
+                db.session.execute(db.insert(AuditStat), [row])
+
+    @staticmethod
+    def summary():
+        """
+        Totales generales, del día y por acción/tabla (desde los intervalos diarios)
+
+        Returns:
+            dict con total_logs, logs_hoy, por_accion y por_tabla
+            (los logs sin tabla se cuentan bajo 'sin_tabla')
+        """
+        day = AuditStat.granularidad == 'day'
+
+        acciones = db.session.query(
+            AuditStat.accion, db.func.sum(AuditStat.total)
+        ).filter(day).group_by(AuditStat.accion).all()
+
+        tablas = db.session.query(
+            AuditStat.tabla_afectada, db.func.sum(AuditStat.total)
+        ).filter(day).group_by(AuditStat.tabla_afectada).all()
+
+        today = AuditStatsService.bucket_start(datetime.now(), 'day')
+        logs_hoy = db.session.query(db.func.sum(AuditStat.total)).filter(
+            day, AuditStat.bucket == today
+        ).scalar()
+
+        return {
+            'total_logs': sum(int(count) for _, count in acciones),
+            'logs_hoy': int(logs_hoy or 0),
+            'por_accion': {accion: int(count) for accion, count in acciones},
+            # Las claves None no se pueden ordenar al serializar a JSON
+            'por_tabla': {(tabla or 'sin_tabla'): int(count) for tabla, count in tablas}
+        }
+
+    @staticmethod
+    def estimate(accion=None, tabla=None, desde=None, hasta=None):
+        """
+        Total aproximado de logs que cumplen los filtros, desde los intervalos
+
+        Con límites a medianoche se usan intervalos diarios; si no, horarios
+        (los logs de la hora del límite se cuentan completos).
+
+        Args:
+            accion: Filtrar por acción
+            tabla: Filtrar por tabla afectada
+            desde: datetime inicial (inclusive)
+            hasta: datetime final
+
+        Returns:
+            Número estimado de logs
+        """
+        midnight = all(
+            bound is None or bound == AuditStatsService.bucket_start(bound, 'day')
+            for bound in (desde, hasta)
+        )
+        granularity = 'day' if midnight else 'hour'
+
+        query = db.session.query(db.func.sum(AuditStat.total)).filter(
+            AuditStat.granularidad == granularity
+        )
+        if accion:
+            query = query.filter(AuditStat.accion == accion)
+        if tabla:
+            query = query.filter(AuditStat.tabla_afectada == tabla)
+        if desde:
+            query = query.filter(AuditStat.bucket >= AuditStatsService.bucket_start(desde, granularity))
+        if hasta:
+            query = query.filter(AuditStat.bucket < hasta)
+        return int(query.scalar() or 0)
+
+    @staticmethod
+    def series(granularity='hour', desde=None, hasta=None, accion=None, tabla=None):
+        """
+        Serie temporal de eventos
+
+        Args:
+            granularity: 'hour' o 'day'
+            desde: datetime inicial (default: ventana de DEFAULT_SERIES_WINDOW)
+            hasta: datetime final, inclusive (default: ahora)
+            accion: Filtrar por acción
+            tabla: Filtrar por tabla afectada
+
+        Returns:
+            Lista de {'bucket', 'total', 'por_accion'} por intervalo, incluidos
+            los intervalos vacíos
+
+        Raises:
+            ValueError: si la granularidad no es válida, desde > hasta o el
+                        rango supera MAX_SERIES_BUCKETS intervalos
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"granularity debe ser una de: {', '.join(GRANULARITIES)}")
+
+        hasta = AuditStatsService.bucket_start(hasta or datetime.now(), granularity)
+        desde = AuditStatsService.bucket_start(
+            desde or hasta - DEFAULT_SERIES_WINDOW[granularity] + GRANULARITIES[granularity],
+            granularity
+        )
+        if desde > hasta:
+            raise ValueError('desde debe ser anterior a hasta')
+        if (hasta - desde) / GRANULARITIES[granularity] >= MAX_SERIES_BUCKETS:
+            raise ValueError(f'El rango supera {MAX_SERIES_BUCKETS} intervalos; use granularity=day')
+
+        query = db.session.query(
+            AuditStat.bucket, AuditStat.accion, db.func.sum(AuditStat.total)
+        ).filter(
+            AuditStat.granularidad == granularity,
+            AuditStat.bucket >= desde,
+            AuditStat.bucket <= hasta
+        )
+        if accion:
+            query = query.filter(AuditStat.accion == accion)
+        if tabla:
+            query = query.filter(AuditStat.tabla_afectada == tabla)
+
+        buckets = {}
+        for bucket, accion_bucket, total in query.group_by(AuditStat.bucket, AuditStat.accion):
+            buckets.setdefault(bucket, {})[accion_bucket] = int(total)
+
+        series = []
+        step = GRANULARITIES[granularity]
+        bucket = desde
+        while bucket <= hasta:
+            por_accion = buckets.get(bucket, {})
+            series.append({
+                'bucket': bucket.isoformat(),
+                'total': sum(por_accion.values()),
+                'por_accion': por_accion
+            })
+            bucket += step
+        return series
+
+    @staticmethod
+    def rebuild(batch_size=5000):
+        """
+        Recalcular audit_stats desde audit_logs y los segmentos archivados
+        (p. ej. tras desplegar la tabla o restaurar una copia)
+
+        Los logs se leen por lotes y se acumulan en memoria por intervalo,
+        así que el costo en memoria es O(intervalos). De cada segmento solo
+        se descomprimen las columnas accion, tabla_afectada y timestamp.
+        Ejecutar sin tráfico: los lotes volcados durante el recálculo no se
+        contarían.
+
+        Returns:
+            Número de logs contados
+        """
+        columns = (AuditLog.accion, AuditLog.tabla_afectada, AuditLog.timestamp)
+        counts = Counter()
+        total = 0
+        for accion, tabla, timestamp in db.session.execute(
+            db.select(*columns).execution_options(yield_per=batch_size)
+        ):
+            counts.update(AuditStatsService.count_events(
+                [{'accion': accion, 'tabla_afectada': tabla, 'timestamp': timestamp}]
+            ))
+            total += 1
+
+        # Meses archivados: ya no están en audit_logs
+        for entry in audit_archive.segments():
+            filename = entry['file']
+            for accion, tabla, timestamp in zip(
+                audit_archive.column(filename, 'accion'),
+                audit_archive.column(filename, 'tabla_afectada'),
+                audit_archive.column(filename, 'timestamp')
+            ):
+                counts.update(AuditStatsService.count_events(
+                    [{'accion': accion, 'tabla_afectada': tabla, 'timestamp': from_micros(timestamp)}]
+                ))
+                total += 1
+
+        db.session.execute(db.delete(AuditStat))
+        AuditStatsService.apply(counts)
+        db.session.commit()
+        return total
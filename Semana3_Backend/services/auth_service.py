@@ -2,14 +2,18 @@
 Servicio de autenticación y autorización
 Gestiona registro, login, actualización de usuarios y auditoría
 """
-import json
+import threading
 from datetime import datetime
-from flask import request
+from flask import request, has_request_context, current_app
 from flask_jwt_extended import create_access_token
 from models.base import db
 from models.user import Usuario
 from models.audit_log import AuditLog
+from services.audit_chain import canonical_json
+from services.audit_queue import audit_queue
+from services.bcrypt_executor import bcrypt_executor, login_admission, LoginRejected
 from services.crypto_service import get_crypto_service
+from services.user_cache import user_summary_cache
 from utils.validators import validate_cedula_ecuador, validate_email
 
 
@@ -94,33 +98,56 @@ class AuthService:
             raise ValueError(f'Error al registrar usuario: {str(e)}')
     
     @staticmethod
-    def login(username, password):
+    def login(username, password, ip_address=None):
         """
         Autenticar usuario y generar token JWT
         
         Args:
             username: Nombre de usuario
             password: Contraseña en texto plano
+            ip_address: IP del cliente (para límite de intentos)
             
         Returns:
-            dict con token y datos del usuario, o None si falla
+            (token, usuario), o (None, None) si falla
+            
+        Raises:
+            LoginRejected: si se superó el límite de intentos o el pool
+                           de bcrypt está saturado (antes de hashear)
         """
         try:
+            # Control de admisión antes de cualquier trabajo costoso
+            login_admission.check(username, ip_address)
+            
             # Buscar usuario
             usuario = Usuario.query.filter_by(username=username).first()
             
             if not usuario:
-                return None
+                return None, None
             
-            # Verificar contraseña usando crypto_service
-            if not get_crypto_service().verify_password(password, usuario.password_hash):
+            # Verificar contraseña en el pool dedicado de bcrypt
+            if not bcrypt_executor.verify(password, usuario.password_hash):
                 # Registrar intento fallido
                 AuthService.log_audit(
                     user_id=usuario.id,
                     action='LOGIN_FAILED',
                     description=f'Intento de login fallido para usuario {username}'
                 )
-                return None
+                return None, None
+            
+            if not usuario.activo:
+                AuthService.log_audit(
+                    user_id=usuario.id,
+                    action='LOGIN_FAILED',
+                    description=f'Intento de login de usuario inactivo {username}'
+                )
+                return None, None
+            
+            login_admission.reset(username)
+            
+            # Actualizar hashes con un costo distinto al configurado
+            if current_app.config.get('BCRYPT_REHASH_ON_LOGIN', True) and \
+                    get_crypto_service().needs_rehash(usuario.password_hash):
+                AuthService.schedule_rehash(usuario.id, password, usuario.password_hash)
             
             # Crear token JWT con claims adicionales
             access_token = create_access_token(
@@ -141,10 +168,44 @@ class AuthService:
             # Retornar token y usuario
             return access_token, usuario
             
+        except LoginRejected:
+            raise
         except Exception as e:
             print(f"Error en login: {str(e)}")
             return None, None
     
+    @staticmethod
+    def schedule_rehash(user_id, password, old_hash):
+        """
+        Recalcular en segundo plano el hash de un usuario con el costo actual
+        
+        Solo se guarda si el hash no cambió mientras tanto (p. ej. por un
+        cambio de contraseña concurrente).
+        
+        Args:
+            user_id: ID del usuario
+            password: Contraseña ya verificada
+            old_hash: Hash almacenado que se reemplaza
+        """
+        app = current_app._get_current_object()
+        rounds = get_crypto_service().bcrypt_rounds
+        
+        def rehash():
+            try:
+                new_hash = bcrypt_executor.hash(password, rounds)
+                with app.app_context():
+                    Usuario.query.filter_by(id=user_id, password_hash=old_hash).update(
+                        {'password_hash': new_hash},
+                        synchronize_session=False
+                    )
+                    db.session.commit()
+            except LoginRejected:
+                pass  # Pool ocupado: se reintentará en el próximo login
+            except Exception as e:
+                print(f"Error al recalcular hash de usuario {user_id}: {str(e)}")
+        
+        threading.Thread(target=rehash, name='bcrypt-rehash', daemon=True).start()
+    
     @staticmethod
     def get_user_by_id(user_id):
         """
@@ -206,6 +267,7 @@ class AuthService:
                 usuario.activo = kwargs['activo']
             
             db.session.commit()
+            user_summary_cache.invalidate(user_id)
             
             # Registrar auditoría
             AuthService.log_audit(
@@ -224,39 +286,47 @@ class AuthService:
             raise
     
     @staticmethod
-    def delete_user(user_id):
+    def deactivate_user(user_id, admin_id=None):
         """
-        Eliminar un usuario de la base de datos
+        Dar de baja a un usuario (baja lógica: activo=False)
+        
+        Los usuarios no se eliminan: su id forma parte de la cadena de hashes
+        de auditoría (FK RESTRICT), y cada usuario tiene al menos el registro
+        de su alta. Un usuario inactivo no puede iniciar sesión.
         
         Args:
-            user_id: ID del usuario a eliminar
+            user_id: ID del usuario a desactivar
+            admin_id: ID del administrador que lo desactiva (para la auditoría)
             
         Returns:
-            True si se eliminó correctamente
+            Usuario desactivado
+            
+        Raises:
+            ValueError: si no existe
         """
         try:
             usuario = Usuario.query.get(user_id)
             if not usuario:
                 raise ValueError("Usuario no encontrado")
             
-            username = usuario.username
-            
-            # Eliminar usuario
-            db.session.delete(usuario)
-            db.session.commit()
-            
-            # Registrar auditoría
-            AuthService.log_audit(
-                user_id=user_id,
-                action='DELETE_USER',
-                description=f'Usuario {username} eliminado'
-            )
+            if usuario.activo:
+                usuario.activo = False
+                db.session.commit()
+                user_summary_cache.invalidate(user_id)
+                
+                # Registrar auditoría
+                AuthService.log_audit(
+                    user_id=admin_id,
+                    action='DEACTIVATE_USER',
+                    description=f'Usuario {usuario.username} desactivado',
+                    additional_data={'usuario_id': user_id, 'username': usuario.username}
+                )
             
-            return True
+            return usuario
             
         except Exception as e:
             db.session.rollback()
-            print(f"Error al eliminar usuario: {str(e)}")
+            print(f"Error al desactivar usuario: {str(e)}")
             import traceback
             traceback.print_exc()
             raise
@@ -266,6 +336,9 @@ class AuthService:
         """
         Registrar acción en el log de auditoría
         
+        El evento se encola y se inserta en lote en segundo plano, por lo que
+        no toca la sesión de base de datos del llamador.
+        
         Args:
             user_id: ID del usuario que realiza la acción
             action: Tipo de acción (LOGIN, REGISTER, etc.)
@@ -275,16 +348,16 @@ class AuthService:
         try:
             # Obtener IP del request si está disponible
             ip_address = None
-            if request:
+            if has_request_context():
                 ip_address = request.remote_addr
             
             # Convertir additional_data a JSON si se proporciona
             datos_json = None
             if additional_data:
-                datos_json = json.dumps(additional_data)
+                datos_json = canonical_json(additional_data)
             
-            # Crear registro de auditoría
-            audit_log = AuditLog(
+            # Encolar registro de auditoría
+            audit_queue.enqueue(
                 usuario_id=user_id,
                 accion=action,
                 tabla_afectada=description,
@@ -292,9 +365,5 @@ class AuthService:
                 datos_nuevos=datos_json
             )
             
-            db.session.add(audit_log)
-            db.session.commit()
-            
         except Exception as e:
-            db.session.rollback()
             print(f"Error al registrar auditoría: {str(e)}")
@@ -0,0 +1,393 @@
+"""
+Copia de seguridad completa cifrada
+Las tablas se leen con cursores en streaming y se escriben por bloques de
+BACKUP_CHUNK_SIZE filas. Los valores se copian tal como están en la base de
+datos: las columnas cifradas (AES/RSA) no se descifran en ningún momento.
+Después de las tablas se copian los segmentos de AUDIT_ARCHIVE_DIR y su
+index.json, por bloques de ARCHIVE_CHUNK_SIZE bytes.
+
+Formato de archivo:
+    MAGIC | id de copia (16 bytes) | bloques
+
+Cada bloque es uint32 longitud | nonce | AES-GCM(zlib(JSON)) con una
+subclave derivada de AES_MASTER_KEY. Los datos asociados de GCM son el id
+de copia y el número de bloque, así que no se pueden reordenar, quitar ni
+mezclar bloques de otra copia. El último bloque lleva el conteo de filas
+por tabla y el tamaño de cada archivo: una copia truncada se detecta al
+restaurar.
+"""
+import os
+import json
+import contextlib
+import zlib
+import base64
+import struct
+from collections import deque
+from datetime import date, datetime
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
+from models.base import db
+from services.audit_archive import audit_archive
+from services.audit_chain import canonical_json
+from services.crypto_service import get_crypto_service
+
+
+BACKUP_MAGIC = b'MSBK\x01'
+BACKUP_ID_SIZE = 16
+NONCE_SIZE = 12
+FRAME_HEADER = struct.Struct('>I')
+
+# Tablas copiadas (se escriben y restauran en orden de dependencias).
+# audit_stats no se copia: se recalcula con rebuild-audit-stats
+BACKUP_TABLES = (
+    'usuarios', 'claves_rsa', 'pacientes', 'paciente_tokens',
+    'historias_clinicas', 'recetas', 'audit_logs', 'audit_checkpoints'
+)
+
+# Prioriza velocidad: los datos cifrados casi no se comprimen
+COMPRESS_LEVEL = 1
+
+# Bytes de un archivo de AUDIT_ARCHIVE_DIR por bloque
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+# Nombre con el que se informa el progreso del archivo de auditoría
+ARCHIVE_PROGRESS = 'AUDIT_ARCHIVE_DIR'
+
+
+def backup_tables():
+    """Tablas de BACKUP_TABLES en orden de dependencias (padres primero)"""
+    return [table for table in db.metadata.sorted_tables if table.name in BACKUP_TABLES]
+
+
+def encode_value(value):
+    """Valor de columna -> JSON (bytes en base64, fechas en ISO 8601)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'Tipo no serializable: {type(value).__name__}')
+
+
+def json_text(value):
+    """Valor de una columna de texto JSON (JSONB en PostgreSQL se copia como objeto)"""
+    return canonical_json(value) if isinstance(value, (dict, list)) else value
+
+
+def column_decoder(column):
+    """Función JSON -> valor de columna según el tipo de la columna"""
+    if isinstance(column.type, db.LargeBinary):
+        return base64.b64decode
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, db.Date):
+        return date.fromisoformat
+    if isinstance(column.type, db.Text):
+        return json_text
+    return None
+
+
+def archive_files():
+    """
+    Archivos de AUDIT_ARCHIVE_DIR que se copian: los segmentos publicados en
+    index.json y el propio índice (al final). Los huérfanos no se copian.
+    """
+    if not audit_archive.archive_dir:
+        return []
+    path = os.path.join(audit_archive.archive_dir, 'index.json')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as fh:
+        segments = json.load(fh)['segments']
+    return [entry['file'] for entry in segments] + ['index.json']
+
+
+class BackupCipher:
+    """Cifrado y compresión de los bloques de una copia"""
+
+    def __init__(self, backup_id):
+        self.backup_id = backup_id
+        self._aesgcm = AESGCM(get_crypto_service().derive_key(b'medsafe-backup-v1'))
+
+    def _associated_data(self, index):
+        return self.backup_id + struct.pack('>Q', index)
+
+    def seal(self, index, payload):
+        """dict -> bloque cifrado (se ejecuta en el pool de hilos)"""
+        data = zlib.compress(
+            json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=encode_value).encode('utf-8'),
+            COMPRESS_LEVEL
+        )
+        nonce = os.urandom(NONCE_SIZE)
+        return nonce + self._aesgcm.encrypt(nonce, data, self._associated_data(index))
+
+    def open(self, index, frame):
+        """
+        Bloque cifrado -> dict (se ejecuta en el pool de hilos)
+
+        Raises:
+            InvalidTag: si el bloque fue modificado, está fuera de orden o
+                        se cifró con otra clave maestra
+        """
+        data = self._aesgcm.decrypt(frame[:NONCE_SIZE], frame[NONCE_SIZE:], self._associated_data(index))
+        return json.loads(zlib.decompress(data))
+
+
+class BackupService:
+    """Servicio de copia y restauración completa de la base de datos"""
+
+    @staticmethod
+    def _pending_limit():
+        """Bloques en vuelo en el pool: acota la memoria usada"""
+        return get_crypto_service().max_workers * 2
+
+    @staticmethod
+    def backup(path, chunk_size=1000, progress=None):
+        """
+        Escribir una copia completa en path
+
+        Se escribe en path + '.tmp' y se renombra al terminar, así un archivo
+        con el nombre final siempre está completo. En PostgreSQL todas las
+        tablas se leen en una transacción REPEATABLE READ (una sola foto).
+
+        Args:
+            path: Archivo de destino
+            chunk_size: Filas por bloque
+            progress: Función llamada con (tabla, filas) al terminar cada tabla
+
+        Returns:
+            dict tabla -> filas copiadas
+        """
+        crypto = get_crypto_service()
+        backup_id = os.urandom(BACKUP_ID_SIZE)
+        cipher = BackupCipher(backup_id)
+        counts = {}
+        pending = deque()
+        index = 0
+        tmp_path = f'{path}.tmp'
+
+        def write_ready(out, limit):
+            # Escribir en orden los bloques ya cifrados hasta dejar limit en vuelo
+            while len(pending) > limit:
+                frame = pending.popleft().result()
+                out.write(FRAME_HEADER.pack(len(frame)) + frame)
+
+        connection = db.engine.connect()
+        if db.engine.dialect.name == 'postgresql':
+            connection = connection.execution_options(isolation_level='REPEATABLE READ')
+        archive_lock = audit_archive.lock(shared=True) if audit_archive.archive_dir else contextlib.nullcontext()
+        try:
+            # El bloqueo impide archivar meses mientras se leen tablas y segmentos
+            with archive_lock, connection.begin(), open(tmp_path, 'wb') as out:
+                out.write(BACKUP_MAGIC + backup_id)
+                for table in backup_tables():
+                    result = connection.execution_options(stream_results=True, yield_per=chunk_size).execute(
+                        db.select(table).order_by(*table.primary_key.columns)
+                    )
+                    columns = list(result.keys())
+                    counts[table.name] = 0
+                    for rows in result.partitions():
+                        payload = {'tabla': table.name, 'columnas': columns, 'filas': [list(row) for row in rows]}
+                        pending.append(crypto.submit(cipher.seal, index, payload))
+                        index += 1
+                        counts[table.name] += len(rows)
+                        write_ready(out, BackupService._pending_limit())
+                    if progress:
+                        progress(table.name, counts[table.name])
+
+                sizes = {}
+                for name in archive_files():
+                    sizes[name] = 0
+                    with open(os.path.join(audit_archive.archive_dir, name), 'rb') as fh:
+                        for data in iter(lambda: fh.read(ARCHIVE_CHUNK_SIZE), b''):
+                            pending.append(crypto.submit(cipher.seal, index, {'archivo': name, 'datos': data}))
+                            index += 1
+                            sizes[name] += len(data)
+                            write_ready(out, BackupService._pending_limit())
+                if sizes and progress:
+                    progress(ARCHIVE_PROGRESS, len(sizes))
+
+                pending.append(crypto.submit(cipher.seal, index, {'fin': True, 'conteos': counts, 'archivos': sizes}))
+                write_ready(out, 0)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            for future in pending:
+                future.cancel()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            connection.close()
+
+        return counts
+
+    @staticmethod
+    def read_frames(stream):
+        """
+        Leer los bloques cifrados de una copia
+
+        Yields:
+            bytes de cada bloque
+
+        Raises:
+            ValueError: si el archivo no es una copia o está truncado
+        """
+        while True:
+            header = stream.read(FRAME_HEADER.size)
+            if not header:
+                return
+            if len(header) < FRAME_HEADER.size:
+                raise ValueError('Copia truncada')
+            (length,) = FRAME_HEADER.unpack(header)
+            frame = stream.read(length)
+            if len(frame) < length:
+                raise ValueError('Copia truncada')
+            yield frame
+
+    @staticmethod
+    def restore(path, progress=None):
+        """
+        Restaurar una copia de backup() en una base de datos vacía
+
+        Todo se inserta en una única transacción (INSERT por bloques): si la
+        copia está dañada o incompleta no queda nada a medias. En PostgreSQL
+        se ajustan las secuencias de ids al terminar. Los archivos de
+        AUDIT_ARCHIVE_DIR se escriben con nombre temporal y se renombran
+        (index.json al final) solo después del commit.
+
+        Args:
+            path: Archivo de copia
+            progress: Función llamada con (tabla, filas) al terminar cada tabla
+
+        Returns:
+            dict tabla -> filas restauradas
+
+        Raises:
+            ValueError: si el archivo no es válido, está incompleto, las
+                        tablas de destino no están vacías o AUDIT_ARCHIVE_DIR
+                        ya tiene un archivo de auditoría
+        """
+        crypto = get_crypto_service()
+        tables = {table.name: table for table in backup_tables()}
+        counts = {}
+        pending = deque()
+        current = None
+        expected = None
+        files = {}  # nombre -> archivo temporal abierto en AUDIT_ARCHIVE_DIR
+        sizes = {}
+
+        def temp_path(name):
+            return os.path.join(audit_archive.archive_dir, f'{name}.restore')
+
+        def write_file(name, data):
+            if name not in files:
+                if name != os.path.basename(name) or name.startswith('.'):
+                    raise ValueError(f'Nombre de archivo inválido en la copia: {name}')
+                if not audit_archive.archive_dir:
+                    raise ValueError('La copia incluye archivo de auditoría y AUDIT_ARCHIVE_DIR no está configurado')
+                if not files and os.path.exists(os.path.join(audit_archive.archive_dir, 'index.json')):
+                    raise ValueError('AUDIT_ARCHIVE_DIR ya tiene un archivo de auditoría')
+                os.makedirs(audit_archive.archive_dir, exist_ok=True)
+                files[name] = open(temp_path(name), 'wb')
+                sizes[name] = 0
+            files[name].write(data)
+            sizes[name] += len(data)
+
+        try:
+            with open(path, 'rb') as stream, db.engine.begin() as connection:
+                header = stream.read(len(BACKUP_MAGIC) + BACKUP_ID_SIZE)
+                if not header.startswith(BACKUP_MAGIC) or len(header) < len(BACKUP_MAGIC) + BACKUP_ID_SIZE:
+                    raise ValueError('El archivo no es una copia de MedSafe')
+                cipher = BackupCipher(header[len(BACKUP_MAGIC):])
+
+                for name, table in tables.items():
+                    if connection.execute(db.select(db.literal(1)).select_from(table).limit(1)).first():
+                        raise ValueError(f'La tabla {name} no está vacía')
+
+                def insert(payload):
+                    nonlocal current, expected
+                    if expected is not None:
+                        raise ValueError('Datos después del final de la copia')
+                    if payload.get('fin'):
+                        expected = payload
+                        return
+                    if 'archivo' in payload:
+                        write_file(payload['archivo'], base64.b64decode(payload['datos']))
+                        return
+                    table = tables.get(payload['tabla'])
+                    if table is None:
+                        raise ValueError(f"Tabla desconocida en la copia: {payload['tabla']}")
+                    unknown = set(payload['columnas']) - set(table.columns.keys())
+                    if unknown:
+                        raise ValueError(f"Columnas desconocidas en {table.name}: {', '.join(sorted(unknown))}")
+
+                    if current != table.name:
+                        if current and progress:
+                            progress(current, counts[current])
+                        current = table.name
+                        counts.setdefault(table.name, 0)
+
+                    decoders = [column_decoder(table.columns[name]) for name in payload['columnas']]
+                    rows = [
+                        {
+                            name: decode(value) if decode and value is not None else value
+                            for name, decode, value in zip(payload['columnas'], decoders, row)
+                        }
+                        for row in payload['filas']
+                    ]
+                    connection.execute(table.insert(), rows)
+                    counts[table.name] += len(rows)
+
+                try:
+                    for index, frame in enumerate(BackupService.read_frames(stream)):
+                        pending.append(crypto.submit(cipher.open, index, frame))
+                        while len(pending) > BackupService._pending_limit():
+                            insert(pending.popleft().result())
+                    while pending:
+                        insert(pending.popleft().result())
+                except InvalidTag:
+                    for future in pending:
+                        future.cancel()
+                    raise ValueError('Copia dañada o cifrada con otra clave maestra')
+                except Exception:
+                    for future in pending:
+                        future.cancel()
+                    raise
+                if current and progress:
+                    progress(current, counts[current])
+
+                if expected is None:
+                    raise ValueError('Copia incompleta: falta el bloque final')
+                for name, total in expected['conteos'].items():
+                    if counts.get(name, 0) != total:
+                        raise ValueError(f'Copia incompleta: {name} tiene {counts.get(name, 0)} de {total} filas')
+                for name, size in expected.get('archivos', {}).items():
+                    if sizes.get(name, 0) != size:
+                        raise ValueError(f'Copia incompleta: {name} tiene {sizes.get(name, 0)} de {size} bytes')
+                for fh in files.values():
+                    fh.flush()
+                    os.fsync(fh.fileno())
+
+                if connection.dialect.name == 'postgresql':
+                    for name, table in tables.items():
+                        if 'id' in table.columns:
+                            connection.execute(db.text(
+                                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                                f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {name}"
+                            ))
+        except Exception:
+            for name, fh in files.items():
+                fh.close()
+                os.remove(temp_path(name))
+            raise
+
+        # Transacción confirmada: publicar el archivo (index.json al final)
+        for fh in files.values():
+            fh.close()
+        for name in sorted(files, key=lambda name: name == 'index.json'):
+            os.replace(temp_path(name), os.path.join(audit_archive.archive_dir, name))
+        if files and progress:
+            progress(ARCHIVE_PROGRESS, len(files))
+
+        return counts
@@ -0,0 +1,252 @@
+"""
+Ejecutor dedicado para bcrypt y control de admisión de login
+Los hashes bcrypt se calculan en un pool de procesos con cola acotada, de
+modo que una ráfaga de logins no pueda ocupar todos los hilos de la API.
+Los intentos se limitan por usuario y por IP antes de hashear nada.
+"""
+import os
+import time
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from services import bcrypt_worker
+
+
+class LoginRejected(Exception):
+    """Intento de login rechazado por admisión o por saturación del pool"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BcryptExecutor:
+    """Pool de procesos para bcrypt con cola acotada y métricas"""
+
+    def __init__(self):
+        self.max_workers = 2
+        self.max_pending = 8
+        self.timeout = 10.0
+
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+        # Métricas
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._timeouts = 0
+        self._latencies = deque(maxlen=256)
+
+    def init_app(self, app):
+        """
+        Configurar tamaño del pool y de la cola
+
+        Args:
+            app: Aplicación Flask
+        """
+        self.max_workers = app.config.get('BCRYPT_POOL_WORKERS') or max(1, (os.cpu_count() or 2) // 2)
+        self.max_pending = app.config.get('BCRYPT_POOL_MAX_PENDING') or self.max_workers * 4
+        self.timeout = app.config.get('BCRYPT_POOL_TIMEOUT', 10.0)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def verify(self, password: str, password_hash: str) -> bool:
+        """
+        Verificar contraseña en el pool
+
+        Raises:
+            LoginRejected: si la cola del pool está llena
+        """
+        return self._run(bcrypt_worker.checkpw, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def hash(self, password: str, rounds: int) -> str:
+        """
+        Hashear contraseña en el pool
+
+        Raises:
+            LoginRejected: si la cola del pool está llena
+        """
+        return self._run(bcrypt_worker.hashpw, password.encode('utf-8'), rounds).decode('utf-8')
+
+    def metrics(self):
+        """Profundidad de cola y latencia de hash (ms)"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            pending = self._pending
+            completed = self._completed
+            rejected = self._rejected
+            timeouts = self._timeouts
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 2)
+
+        return {
+            'workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'pending': pending,
+            'completed': completed,
+            'rejected': rejected,
+            'timeouts': timeouts,
+            'latency_ms': {
+                'p50': percentile(0.50),
+                'p95': percentile(0.95),
+                'max': round(latencies[-1], 2) if latencies else None
+            }
+        }
+
+    # ==========================================
+    # Internos
+    # ==========================================
+
+    def _run(self, fn, *args):
+        """
+        Ejecutar fn en el pool respetando el límite de cola
+        El cupo se libera cuando el trabajo termina de verdad: un trabajo
+        que agota el tiempo de espera sigue ocupando un proceso del pool
+        """
+        if self._slots is None:
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise LoginRejected('Servidor ocupado, intente nuevamente en unos segundos')
+
+        with self._lock:
+            self._pending += 1
+        start = time.perf_counter()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._timeouts += 1
+            raise LoginRejected('Tiempo de espera agotado verificando credenciales')
+        finally:
+            if future.done():
+                elapsed = (time.perf_counter() - start) * 1000
+                with self._lock:
+                    self._completed += 1
+                    self._latencies.append(elapsed)
+
+    def _release(self):
+        """Devolver el cupo de un trabajo terminado (o que no llegó al pool)"""
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _get_executor(self):
+        """
+        Crear el pool bajo demanda
+        Los procesos se crean con forkserver (o spawn): nunca se hace fork del
+        proceso de la API, que ya tiene hilos (auditoría, reserva RSA,
+        peticiones) cuyos bloqueos quedarían tomados en el hijo. El servidor
+        de forkserver solo precarga bcrypt_worker; app.py y medsafe.py crean
+        la aplicación bajo su guarda __main__, así que la re-importación del
+        módulo principal en cada trabajador no levanta otra aplicación.
+        En plataformas sin procesos utilizables se usa un pool de hilos:
+        bcrypt libera el GIL, así que el límite de concurrencia se mantiene.
+        """
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = self._create_executor()
+        return self._executor
+
+    def _create_executor(self):
+        """Pool de procesos forkserver/spawn, o de hilos si no es posible"""
+        methods = multiprocessing.get_all_start_methods()
+        try:
+            if 'forkserver' in methods:
+                context = multiprocessing.get_context('forkserver')
+                context.set_forkserver_preload([bcrypt_worker.__name__])
+            else:
+                context = multiprocessing.get_context('spawn')
+            return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Pool de procesos bcrypt no disponible, se usan hilos: {str(e)}")
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bcrypt')
+
+
+class LoginAdmission:
+    """Límite de intentos de login por usuario y por IP (ventana deslizante)"""
+
+    def __init__(self):
+        self.window = 60
+        self.max_per_user = 5
+        self.max_per_ip = 20
+
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configurar límites de intentos
+
+        Args:
+            app: Aplicación Flask
+        """
+        self.window = app.config.get('LOGIN_WINDOW_SECONDS', 60)
+        self.max_per_user = app.config.get('LOGIN_MAX_ATTEMPTS_PER_USER', 5)
+        self.max_per_ip = app.config.get('LOGIN_MAX_ATTEMPTS_PER_IP', 20)
+
+    def check(self, username, ip_address=None):
+        """
+        Registrar un intento y rechazarlo si supera algún límite
+
+        Raises:
+            LoginRejected: si el usuario o la IP superaron su límite
+        """
+        now = time.monotonic()
+        keys = [(f'user:{username.lower()}', self.max_per_user)]
+        if ip_address:
+            keys.append((f'ip:{ip_address}', self.max_per_ip))
+
+        with self._lock:
+            for key, limit in keys:
+                attempts = self._recent(key, now)
+                if len(attempts) >= limit:
+                    retry_after = max(1, int(self.window - (now - attempts[0])) + 1)
+                    raise LoginRejected(
+                        'Demasiados intentos de inicio de sesión. Intente más tarde.',
+                        retry_after=retry_after
+                    )
+            for key, _ in keys:
+                self._attempts[key].append(now)
+
+            if len(self._attempts) > 10000:
+                self._purge(now)
+
+    def reset(self, username):
+        """Olvidar los intentos de un usuario tras un login exitoso"""
+        with self._lock:
+            self._attempts.pop(f'user:{username.lower()}', None)
+
+    def _recent(self, key, now):
+        """Intentos de key dentro de la ventana actual"""
+        attempts = self._attempts.setdefault(key, deque())
+        while attempts and now - attempts[0] > self.window:
+            attempts.popleft()
+        return attempts
+
+    def _purge(self, now):
+        """Eliminar claves sin intentos recientes"""
+        for key in list(self._attempts):
+            if not self._recent(key, now):
+                del self._attempts[key]
+
+
+# Instancias globales
+bcrypt_executor = BcryptExecutor()
+login_admission = LoginAdmission()
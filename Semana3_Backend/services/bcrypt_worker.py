@@ -0,0 +1,19 @@
+"""
+Funciones que ejecutan los procesos del pool bcrypt
+Solo depende de bcrypt: es lo único que precarga el servidor forkserver,
+así los trabajadores no importan Flask ni los servicios de la API.
+"""
+import bcrypt
+
+
+def checkpw(password, password_hash):
+    """Verificar contraseña (se ejecuta en el proceso trabajador)"""
+    try:
+        return bcrypt.checkpw(password, password_hash)
+    except ValueError:
+        return False
+
+
+def hashpw(password, rounds):
+    """Hashear contraseña (se ejecuta en el proceso trabajador)"""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
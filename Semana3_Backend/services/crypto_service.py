@@ -2,32 +2,99 @@
 Servicio de Criptografía - ESPE MedSafe
 Implementa AES-256, RSA-2048, bcrypt, SHA-256
 """
+import io
 import os
+import re
+import time
 import base64
+import struct
+import hmac
 import hashlib
 import bcrypt
-from typing import Tuple, Optional
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import BinaryIO, Iterable, List, Tuple, Optional, Union
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives import padding, hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa, padding as asym_padding
+from cryptography.hazmat.primitives.asymmetric import padding as asym_padding
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.backends import default_backend
+from cryptography.exceptions import InvalidTag
+from services.rsa_key_pool import rsa_key_pool
+
+
+class KeyCache:
+    """Caché LRU acotada de objetos de clave deserializados"""
+    
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Obtener valor (None si no está) y marcarlo como reciente"""
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+    
+    def put(self, key, value):
+        """Guardar valor descartando el menos usado si se supera maxsize"""
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
 
 
 class CryptoService:
     """Servicio centralizado de operaciones criptográficas"""
     
-    def __init__(self, master_key: Optional[str] = None):
+    # Por debajo de este tamaño no compensa repartir el trabajo entre hilos
+    MIN_PARALLEL_BATCH = 64
+    
+    # Sobre híbrido RSA + AES-GCM: MAGIC | len(clave envuelta) | clave envuelta | nonce | datos | tag
+    ENVELOPE_MAGIC = b'MSE\x01'
+    ENVELOPE_CHUNK_SIZE = 64 * 1024
+    GCM_TAG_SIZE = 16
+    
+    def __init__(self, master_key: Optional[str] = None, max_workers: int = 4,
+                 bcrypt_rounds: int = 12, key_cache_size: int = 128):
         """
         Inicializar servicio criptográfico
         
         Args:
             master_key: Clave maestra AES en base64 (32 bytes)
+            max_workers: Hilos usados para descifrado por lotes
+            bcrypt_rounds: Factor de trabajo bcrypt para hashes nuevos
+            key_cache_size: Máximo de claves RSA deserializadas en caché
         """
         if master_key:
             self.master_key = base64.b64decode(master_key)
         else:
             # Generar clave temporal (solo para desarrollo)
             self.master_key = os.urandom(32)
+        
+        # Objetos reutilizables entre operaciones (la clave no cambia)
+        self._aes = algorithms.AES(self.master_key)
+        self._aesgcm = AESGCM(self.master_key)
+        self._backend = default_backend()
+        
+        # Pool de hilos para lotes grandes: OpenSSL libera el GIL al cifrar
+        self.max_workers = max(1, int(max_workers or 1))
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        
+        self.bcrypt_rounds = bcrypt_rounds
+        
+        # Claves RSA ya deserializadas (evita re-parsear PEM en cada operación)
+        self._key_cache = KeyCache(key_cache_size)
+        
+        # Subclave HMAC de los índices ciegos (derivada, nunca la maestra)
+        self._blind_index_key = self.derive_key(b'medsafe-blind-index-v1')
     
     # ==========================================
     # CIFRADO SIMÉTRICO - AES-256-CBC
@@ -49,11 +116,7 @@ class CryptoService:
             iv = os.urandom(16)
         
         # Crear cipher AES-256-CBC
-        cipher = Cipher(
-            algorithms.AES(self.master_key),
-            modes.CBC(iv),
-            backend=default_backend()
-        )
+        cipher = Cipher(self._aes, modes.CBC(iv), backend=self._backend)
         encryptor = cipher.encryptor()
         
         # Aplicar padding PKCS7
@@ -77,11 +140,7 @@ class CryptoService:
             Texto descifrado
         """
         # Crear cipher AES-256-CBC
-        cipher = Cipher(
-            algorithms.AES(self.master_key),
-            modes.CBC(iv),
-            backend=default_backend()
-        )
+        cipher = Cipher(self._aes, modes.CBC(iv), backend=self._backend)
         decryptor = cipher.decryptor()
         
         # Descifrar
@@ -93,40 +152,218 @@ class CryptoService:
         
         return plaintext.decode('utf-8')
     
+    # ==========================================
+    # CIFRADO AUTENTICADO - AES-256-GCM
+    # ==========================================
+    
+    def encrypt_gcm(self, plaintext: Union[str, bytes], associated_data: Optional[bytes] = None) -> bytes:
+        """
+        Cifrar texto (o bytes) con AES-256-GCM
+        
+        Args:
+            plaintext: Texto o bytes a cifrar
+            associated_data: Datos autenticados pero no cifrados (p. ej. ids
+                             del registro); deben repetirse al descifrar
+            
+        Returns:
+            nonce (12 bytes) + texto cifrado + tag (16 bytes)
+        """
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode('utf-8')
+        nonce = os.urandom(12)
+        return nonce + self._aesgcm.encrypt(nonce, plaintext, associated_data)
+    
+    def decrypt_gcm(self, blob: bytes, associated_data: Optional[bytes] = None,
+                    decode: bool = True) -> Union[str, bytes]:
+        """
+        Descifrar y autenticar un valor cifrado con encrypt_gcm
+        
+        Args:
+            blob: nonce + texto cifrado + tag
+            associated_data: Los mismos datos asociados usados al cifrar
+            decode: False para devolver los bytes sin decodificar
+            
+        Returns:
+            Texto descifrado (o bytes si decode=False)
+            
+        Raises:
+            InvalidTag: si el valor o sus datos asociados fueron modificados
+        """
+        plaintext = self._aesgcm.decrypt(blob[:12], blob[12:], associated_data)
+        return plaintext.decode('utf-8') if decode else plaintext
+    
+    def decrypt_many(self, items: Iterable[tuple]) -> List[Optional[str]]:
+        """
+        Descifrar un lote de valores AES
+        
+        Los lotes grandes se reparten en bloques entre un pool de hilos;
+        los pequeños se descifran en el hilo actual.
+        
+        Args:
+            items: Tuplas (ciphertext, iv) para AES-CBC o
+                   (ciphertext, None, associated_data[, decode]) para AES-GCM
+                   (decode=False devuelve bytes).
+                   Si falta el ciphertext (o el iv en CBC) el resultado es None.
+            
+        Returns:
+            Lista de textos descifrados en el mismo orden que items
+            (None para valores vacíos o que no se pudieron descifrar/autenticar)
+        """
+        return self.map_chunks(self._decrypt_chunk, items)
+    
+    def map_chunks(self, func, items) -> list:
+        """
+        Aplicar func a bloques de items en el pool de hilos
+        
+        Los lotes de menos de MIN_PARALLEL_BATCH items se procesan en el
+        hilo actual. func no debe depender del contexto de Flask.
+        
+        Args:
+            func: Función lista -> lista de resultados (mismo orden)
+            items: Items a procesar
+            
+        Returns:
+            Resultados concatenados en el orden de items
+        """
+        items = list(items)
+        if len(items) < self.MIN_PARALLEL_BATCH or self.max_workers == 1:
+            return func(items)
+        
+        chunk_size = -(-len(items) // self.max_workers)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        
+        results = []
+        for chunk_result in self._get_executor().map(func, chunks):
+            results.extend(chunk_result)
+        return results
+    
+    def submit(self, func, *args) -> Future:
+        """
+        Ejecutar func(*args) en el pool de hilos (trabajo en segundo plano
+        mientras el hilo actual lee o escribe); func no debe depender del
+        contexto de Flask
+        """
+        return self._get_executor().submit(func, *args)
+    
+    def _decrypt_chunk(self, items: List[tuple]) -> List[Optional[str]]:
+        """Descifrar secuencialmente un bloque de items de decrypt_many"""
+        results = []
+        for ciphertext, iv, *extra in items:
+            associated_data = extra[0] if extra else None
+            decode = extra[1] if len(extra) > 1 else True
+            if not ciphertext or (associated_data is None and not iv):
+                results.append(None)
+                continue
+            try:
+                if associated_data is not None:
+                    results.append(self.decrypt_gcm(ciphertext, associated_data, decode))
+                else:
+                    results.append(self.decrypt_aes(ciphertext, iv))
+            except InvalidTag:
+                print("⚠️  Valor AES-GCM no auténtico (modificado o fuera de contexto)")
+                results.append(None)
+            except Exception as e:
+                print(f"⚠️  Error descifrando valor AES: {e}")
+                results.append(None)
+        return results
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """
+        Crear el pool de hilos de descifrado bajo demanda
+        Doble comprobación con bloqueo: varias peticiones concurrentes no
+        deben crear (y filtrar) pools distintos
+        """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix='crypto'
+                    )
+        return self._executor
+    
     # ==========================================
     # CIFRADO ASIMÉTRICO - RSA-2048
     # ==========================================
     
-    def generate_rsa_keys(self) -> Tuple[bytes, bytes]:
+    def generate_rsa_keys(self, key_size: int = 2048) -> Tuple[bytes, bytes]:
         """
-        Generar par de claves RSA-2048
+        Obtener par de claves RSA (por defecto 2048 bits)
+        
+        Los pares salen de la reserva pre-generada en segundo plano; solo se
+        generan en el momento si la reserva de ese tamaño está vacía.
+        
+        Args:
+            key_size: Tamaño de la clave en bits
         
         Returns:
             (private_key_pem, public_key_pem): Claves en formato PEM
         """
-        # Generar clave privada RSA
-        private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048,
-            backend=default_backend()
-        )
+        return rsa_key_pool.get(key_size)
+    
+    def generate_rsa_key_pair(self, key_size: int = 2048) -> Tuple[str, str]:
+        """
+        Obtener par de claves RSA como texto PEM
         
-        # Obtener clave pública
-        public_key = private_key.public_key()
+        Args:
+            key_size: Tamaño de la clave en bits
         
-        # Serializar a formato PEM
-        private_pem = private_key.private_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PrivateFormat.PKCS8,
-            encryption_algorithm=serialization.NoEncryption()
-        )
+        Returns:
+            (public_key_pem, private_key_pem) como str
+        """
+        private_pem, public_pem = self.generate_rsa_keys(key_size)
+        return public_pem.decode('utf-8'), private_pem.decode('utf-8')
+    
+    def load_private_key(self, private_key_pem, cache_key=None):
+        """
+        Deserializar clave privada PEM usando la caché LRU
         
-        public_pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
+        Args:
+            private_key_pem: Clave privada PEM (bytes/str), o función que la
+                             devuelve (solo se llama si no está en caché)
+            cache_key: Clave de caché; por defecto el SHA-256 del PEM
+        
+        Returns:
+            Objeto de clave privada
+        """
+        return self._load_key(private_key_pem, cache_key, private=True)
+    
+    def load_public_key(self, public_key_pem, cache_key=None):
+        """
+        Deserializar clave pública PEM usando la caché LRU
+        
+        Args:
+            public_key_pem: Clave pública PEM (bytes/str) o función que la devuelve
+            cache_key: Clave de caché; por defecto el SHA-256 del PEM
+        
+        Returns:
+            Objeto de clave pública
+        """
+        return self._load_key(public_key_pem, cache_key, private=False)
+    
+    def _load_key(self, pem, cache_key, private):
+        """Buscar la clave en caché o deserializarla y guardarla"""
+        if cache_key is None:
+            pem = self._pem_bytes(pem)
+            cache_key = ('pem', hashlib.sha256(pem).hexdigest())
+        
+        key = self._key_cache.get(cache_key)
+        if key is not None:
+            return key
+        
+        pem = self._pem_bytes(pem() if callable(pem) else pem)
+        if private:
+            key = serialization.load_pem_private_key(pem, password=None, backend=self._backend)
+        else:
+            key = serialization.load_pem_public_key(pem, backend=self._backend)
         
-        return private_pem, public_pem
+        self._key_cache.put(cache_key, key)
+        return key
+    
+    @staticmethod
+    def _pem_bytes(pem) -> bytes:
+        """Normalizar PEM a bytes"""
+        return pem.encode('utf-8') if isinstance(pem, str) else pem
     
     def encrypt_rsa(self, plaintext: str, public_key_pem: bytes) -> bytes:
         """
@@ -140,10 +377,7 @@ class CryptoService:
             Texto cifrado
         """
         # Cargar clave pública
-        public_key = serialization.load_pem_public_key(
-            public_key_pem,
-            backend=default_backend()
-        )
+        public_key = self.load_public_key(public_key_pem)
         
         # Cifrar con OAEP padding
         ciphertext = public_key.encrypt(
@@ -169,11 +403,7 @@ class CryptoService:
             Texto descifrado
         """
         # Cargar clave privada
-        private_key = serialization.load_pem_private_key(
-            private_key_pem,
-            password=None,
-            backend=default_backend()
-        )
+        private_key = self.load_private_key(private_key_pem)
         
         # Descifrar con OAEP padding
         plaintext = private_key.decrypt(
@@ -193,17 +423,16 @@ class CryptoService:
         
         Args:
             data: Datos a firmar
-            private_key_pem: Clave privada en formato PEM
+            private_key_pem: Clave privada en formato PEM (u objeto de clave,
+                             p. ej. de KeyService.load_private_key)
             
         Returns:
             Firma digital
         """
         # Cargar clave privada
-        private_key = serialization.load_pem_private_key(
-            private_key_pem,
-            password=None,
-            backend=default_backend()
-        )
+        private_key = private_key_pem
+        if not hasattr(private_key, 'sign'):
+            private_key = self.load_private_key(private_key_pem)
         
         # Firmar con PSS padding
         signature = private_key.sign(
@@ -232,10 +461,7 @@ class CryptoService:
         """
         try:
             # Cargar clave pública
-            public_key = serialization.load_pem_public_key(
-                public_key_pem,
-                backend=default_backend()
-            )
+            public_key = self.load_public_key(public_key_pem)
             
             # Verificar firma
             public_key.verify(
@@ -251,28 +477,229 @@ class CryptoService:
         except Exception:
             return False
     
+    # ==========================================
+    # CIFRADO HÍBRIDO (SOBRE) - RSA-OAEP + AES-256-GCM
+    # ==========================================
+    
+    def encrypt_envelope(self, plaintext: Union[str, bytes], public_key) -> bytes:
+        """
+        Cifrar datos de cualquier tamaño para el dueño de una clave pública
+        
+        Args:
+            plaintext: Datos a cifrar
+            public_key: Clave pública (PEM u objeto de clave)
+            
+        Returns:
+            Sobre cifrado (bytes)
+        """
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode('utf-8')
+        
+        output = io.BytesIO()
+        self.encrypt_envelope_stream(io.BytesIO(plaintext), output, public_key)
+        return output.getvalue()
+    
+    def decrypt_envelope(self, envelope: bytes, private_key) -> bytes:
+        """
+        Abrir un sobre cifrado con encrypt_envelope
+        
+        Args:
+            envelope: Sobre cifrado
+            private_key: Clave privada (PEM u objeto de clave)
+            
+        Returns:
+            Datos descifrados (bytes)
+            
+        Raises:
+            ValueError: si el sobre no es válido o fue modificado
+        """
+        output = io.BytesIO()
+        self.decrypt_envelope_stream(io.BytesIO(envelope), output, private_key)
+        return output.getvalue()
+    
+    def encrypt_envelope_stream(self, reader: BinaryIO, writer: BinaryIO, public_key,
+                                chunk_size: int = ENVELOPE_CHUNK_SIZE) -> None:
+        """
+        Cifrar un flujo con una clave de datos AES aleatoria envuelta con RSA
+        
+        Solo la clave de datos (32 bytes) se cifra con RSA-OAEP; el cuerpo se
+        cifra por bloques con AES-256-GCM, así que el tamaño no está limitado
+        y el costo RSA es uno por sobre.
+        
+        Args:
+            reader: Flujo de entrada (read)
+            writer: Flujo de salida (write)
+            public_key: Clave pública del destinatario (PEM u objeto de clave)
+            chunk_size: Tamaño de bloque de lectura
+        """
+        if not hasattr(public_key, 'encrypt'):
+            public_key = self.load_public_key(public_key)
+        
+        data_key = os.urandom(32)
+        nonce = os.urandom(12)
+        wrapped_key = public_key.encrypt(
+            data_key,
+            asym_padding.OAEP(
+                mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
+                algorithm=hashes.SHA256(),
+                label=None
+            )
+        )
+        
+        header = self.ENVELOPE_MAGIC + struct.pack('>H', len(wrapped_key)) + wrapped_key + nonce
+        encryptor = Cipher(algorithms.AES(data_key), modes.GCM(nonce),
+                           backend=self._backend).encryptor()
+        # La cabecera queda autenticada junto con el cuerpo
+        encryptor.authenticate_additional_data(header)
+        
+        writer.write(header)
+        for chunk in iter(lambda: reader.read(chunk_size), b''):
+            writer.write(encryptor.update(chunk))
+        writer.write(encryptor.finalize())
+        writer.write(encryptor.tag)
+    
+    def decrypt_envelope_stream(self, reader: BinaryIO, writer: BinaryIO, private_key,
+                                chunk_size: int = ENVELOPE_CHUNK_SIZE) -> None:
+        """
+        Descifrar un flujo cifrado con encrypt_envelope_stream
+        
+        El tag GCM se comprueba al final: si se lanza ValueError, lo escrito
+        en writer debe descartarse.
+        
+        Args:
+            reader: Flujo cifrado (read)
+            writer: Flujo de salida (write)
+            private_key: Clave privada (PEM u objeto de clave)
+            chunk_size: Tamaño de bloque de lectura
+            
+        Raises:
+            ValueError: si el sobre no es válido o fue modificado
+        """
+        if not hasattr(private_key, 'decrypt'):
+            private_key = self.load_private_key(private_key)
+        
+        magic = reader.read(len(self.ENVELOPE_MAGIC))
+        if magic != self.ENVELOPE_MAGIC:
+            raise ValueError('Formato de sobre no reconocido')
+        
+        (key_length,) = struct.unpack('>H', reader.read(2))
+        wrapped_key = reader.read(key_length)
+        nonce = reader.read(12)
+        if len(wrapped_key) != key_length or len(nonce) != 12:
+            raise ValueError('Sobre truncado')
+        
+        try:
+            data_key = private_key.decrypt(
+                wrapped_key,
+                asym_padding.OAEP(
+                    mgf=asym_padding.MGF1(algorithm=hashes.SHA256()),
+                    algorithm=hashes.SHA256(),
+                    label=None
+                )
+            )
+        except Exception:
+            raise ValueError('El sobre no corresponde a esta clave')
+        
+        decryptor = Cipher(algorithms.AES(data_key), modes.GCM(nonce),
+                           backend=self._backend).decryptor()
+        decryptor.authenticate_additional_data(
+            magic + struct.pack('>H', key_length) + wrapped_key + nonce
+        )
+        
+        # Retener siempre los últimos 16 bytes: son el tag de autenticación
+        pending = b''
+        for chunk in iter(lambda: reader.read(chunk_size), b''):
+            pending += chunk
+            if len(pending) > self.GCM_TAG_SIZE:
+                writer.write(decryptor.update(pending[:-self.GCM_TAG_SIZE]))
+                pending = pending[-self.GCM_TAG_SIZE:]
+        
+        if len(pending) != self.GCM_TAG_SIZE:
+            raise ValueError('Sobre truncado')
+        try:
+            writer.write(decryptor.finalize_with_tag(pending))
+        except InvalidTag:
+            raise ValueError('El sobre fue modificado o está corrupto')
+    
     # ==========================================
     # HASH DE CONTRASEÑAS - bcrypt
     # ==========================================
     
-    @staticmethod
-    def hash_password(password: str, rounds: int = 12) -> str:
+    def hash_password(self, password: str, rounds: Optional[int] = None) -> str:
         """
         Hashear contraseña con bcrypt
         
         Args:
             password: Contraseña en texto plano
-            rounds: Factor de trabajo (default: 12 = 2^12 = 4096 iteraciones)
+            rounds: Factor de trabajo (default: el configurado en el servicio,
+                    12 = 2^12 = 4096 iteraciones)
             
         Returns:
             Hash de la contraseña (incluye el salt)
         """
         # Generar salt y hashear
-        salt = bcrypt.gensalt(rounds=rounds)
+        salt = bcrypt.gensalt(rounds=rounds or self.bcrypt_rounds)
         password_hash = bcrypt.hashpw(password.encode('utf-8'), salt)
         
         return password_hash.decode('utf-8')
     
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Indicar si un hash bcrypt usa un factor de trabajo menor al actual
+        
+        Nunca se baja el costo de un hash: así un proceso con una
+        configuración antigua no deshace la mejora hecha por otro.
+        
+        Args:
+            password_hash: Hash almacenado ($2b$<rounds>$...)
+            
+        Returns:
+            True si debe recalcularse con bcrypt_rounds
+        """
+        rounds = self.get_hash_rounds(password_hash)
+        return rounds is not None and rounds < self.bcrypt_rounds
+    
+    @staticmethod
+    def get_hash_rounds(password_hash: str) -> Optional[int]:
+        """Factor de trabajo de un hash bcrypt (None si no es bcrypt)"""
+        match = re.match(r'^\$2[abxy]?\$(\d{2})\$', password_hash or '')
+        return int(match.group(1)) if match else None
+    
+    @staticmethod
+    def calibrate_bcrypt_rounds(target_ms: float, min_rounds: int = 10,
+                                max_rounds: int = 16) -> int:
+        """
+        Elegir el factor de trabajo bcrypt según la CPU actual
+        
+        Mide un hash con un costo bajo y extrapola (cada ronda duplica el
+        tiempo) para encontrar el mayor costo cuya verificación no supere
+        target_ms.
+        
+        Args:
+            target_ms: Latencia objetivo de verificación en milisegundos
+            min_rounds: Costo mínimo aceptable (piso de seguridad)
+            max_rounds: Costo máximo
+            
+        Returns:
+            Factor de trabajo entre min_rounds y max_rounds
+        """
+        probe_rounds = 6
+        salt = bcrypt.gensalt(rounds=probe_rounds)
+        
+        # Mejor de 3 mediciones para reducir ruido
+        elapsed = []
+        for _ in range(3):
+            start = time.perf_counter()
+            bcrypt.hashpw(b'calibracion-bcrypt', salt)
+            elapsed.append((time.perf_counter() - start) * 1000)
+        probe_ms = max(min(elapsed), 0.001)
+        
+        rounds = min_rounds
+        while rounds < max_rounds and probe_ms * 2 ** (rounds + 1 - probe_rounds) <= target_ms:
+            rounds += 1
+        
+        return rounds
+    
     @staticmethod
     def verify_password(password: str, password_hash: str) -> bool:
         """
@@ -293,6 +720,43 @@ class CryptoService:
         except Exception:
             return False
     
+    # ==========================================
+    # ÍNDICES CIEGOS - HMAC-SHA256
+    # ==========================================
+    
+    def derive_key(self, purpose: bytes, length: int = 32) -> bytes:
+        """
+        Derivar una subclave de la clave maestra (HKDF-SHA256)
+        
+        Args:
+            purpose: Etiqueta del uso de la subclave (info de HKDF)
+            length: Longitud en bytes
+            
+        Returns:
+            Subclave
+        """
+        return HKDF(
+            algorithm=hashes.SHA256(), length=length, salt=None,
+            info=purpose, backend=self._backend
+        ).derive(self.master_key)
+    
+    def blind_index(self, context: str, value: str) -> str:
+        """
+        Token determinista de un valor para buscarlo sin descifrar
+        
+        El mismo valor produce el mismo token solo dentro del mismo contexto
+        (p. ej. el campo), y sin la clave maestra no se puede recalcular.
+        
+        Args:
+            context: Contexto del token (nombre del campo)
+            value: Valor ya normalizado
+            
+        Returns:
+            HMAC-SHA256 en hexadecimal
+        """
+        message = f'{context}\x00{value}'.encode('utf-8')
+        return hmac.new(self._blind_index_key, message, hashlib.sha256).hexdigest()
+    
     # ==========================================
     # HASH DE INTEGRIDAD - SHA-256
     # ==========================================
@@ -418,15 +882,21 @@ class CryptoService:
 crypto_service = None
 
 
-def init_crypto_service(master_key: str):
+def init_crypto_service(master_key: str, max_workers: int = 4, bcrypt_rounds: int = 12,
+                        key_cache_size: int = 128):
     """
     Inicializar servicio criptográfico global
     
     Args:
         master_key: Clave maestra AES en base64
+        max_workers: Hilos usados para descifrado por lotes
+        bcrypt_rounds: Factor de trabajo bcrypt para hashes nuevos
+        key_cache_size: Máximo de claves RSA deserializadas en caché
     """
     global crypto_service
-    crypto_service = CryptoService(master_key)
+    crypto_service = CryptoService(master_key, max_workers=max_workers,
+                                   bcrypt_rounds=bcrypt_rounds,
+                                   key_cache_size=key_cache_size)
     return crypto_service
 
 
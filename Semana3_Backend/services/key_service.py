@@ -0,0 +1,88 @@
+"""
+Servicio de claves RSA por usuario (ClaveRSA)
+Emite pares de claves desde la reserva pre-generada y guarda la clave
+privada cifrada con AES. Las claves deserializadas se reutilizan desde la
+caché LRU de CryptoService, indexada por usuario.
+"""
+import base64
+import hashlib
+from models.base import db
+from models.rsa_key import ClaveRSA
+from services.crypto_service import get_crypto_service
+
+
+class KeyService:
+    """Servicio para gestionar las claves RSA de los usuarios"""
+
+    @staticmethod
+    def get_or_create_user_keys(usuario_id, key_size=2048):
+        """
+        Obtener la ClaveRSA de un usuario, creándola si no existe
+
+        Args:
+            usuario_id: ID del usuario
+            key_size: Tamaño de clave para un par nuevo
+
+        Returns:
+            ClaveRSA del usuario
+        """
+        clave = ClaveRSA.query.filter_by(usuario_id=usuario_id).first()
+        if clave:
+            return clave
+
+        crypto = get_crypto_service()
+        private_pem, public_pem = crypto.generate_rsa_keys(key_size)
+        private_encrypted, private_iv = crypto.encrypt_aes(private_pem.decode('utf-8'))
+
+        clave = ClaveRSA(
+            usuario_id=usuario_id,
+            public_key=public_pem.decode('utf-8'),
+            private_key_encrypted=base64.b64encode(private_encrypted).decode('utf-8'),
+            private_key_iv=private_iv
+        )
+        db.session.add(clave)
+        db.session.commit()
+
+        return clave
+
+    @staticmethod
+    def load_private_key(clave):
+        """
+        Clave privada deserializada de una ClaveRSA
+
+        En caché se indexa por usuario_id y por el hash de la clave cifrada,
+        así que un acierto no requiere ni descifrar AES ni parsear PEM, y una
+        rotación de claves invalida la entrada anterior.
+
+        Args:
+            clave: ClaveRSA
+
+        Returns:
+            Objeto de clave privada
+        """
+        crypto = get_crypto_service()
+        cache_key = ('usuario', clave.usuario_id, 'private',
+                     hashlib.sha256(clave.private_key_encrypted.encode('utf-8')).hexdigest())
+
+        return crypto.load_private_key(
+            lambda: crypto.decrypt_aes(
+                base64.b64decode(clave.private_key_encrypted),
+                clave.private_key_iv
+            ),
+            cache_key=cache_key
+        )
+
+    @staticmethod
+    def load_public_key(clave):
+        """
+        Clave pública deserializada de una ClaveRSA
+
+        Args:
+            clave: ClaveRSA
+
+        Returns:
+            Objeto de clave pública
+        """
+        cache_key = ('usuario', clave.usuario_id, 'public',
+                     hashlib.sha256(clave.public_key.encode('utf-8')).hexdigest())
+        return get_crypto_service().load_public_key(clave.public_key, cache_key=cache_key)
@@ -0,0 +1,450 @@
+"""
+Servicio de historias clínicas
+Serialización y descifrado por lotes de registros médicos
+"""
+import json
+import zlib
+import struct
+import hashlib
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy.orm import load_only
+from models.base import db
+from models.medical_record import HistoriaClinica
+from services.crypto_service import get_crypto_service
+from utils.helpers import make_etag
+
+
+# Campos en claro expuestos por la API (en orden de respuesta)
+PLAIN_FIELDS = ('id', 'paciente_id', 'doctor_id', 'fecha_consulta', 'created_at', 'hash_integridad')
+
+# Campos clínicos cifrados con AES (columna <campo>_encrypted)
+ENCRYPTED_FIELDS = ('sintomas', 'diagnostico', 'tratamiento', 'notas')
+
+# Campos descifrados con ?decrypt=summary
+SUMMARY_FIELDS = ('diagnostico',)
+
+# Formatos de cifrado (HistoriaClinica.version_cifrado)
+CIFRADO_CBC = 1  # AES-256-CBC por campo con IV compartido + hash SHA-256 del contenido
+CIFRADO_GCM = 2  # AES-256-GCM por campo, autenticado con ids y fecha del registro
+CIFRADO_PAQUETE = 3  # AES-256-GCM de un solo paquete con todos los campos (datos_encrypted)
+CIFRADO_GCM_ID = 4  # Como 2, con el id del registro en los datos asociados
+CIFRADO_PAQUETE_ID = 5  # Como 3, con el id del registro en los datos asociados
+
+GCM_VERSIONS = (CIFRADO_GCM, CIFRADO_GCM_ID)
+PAQUETE_VERSIONS = (CIFRADO_PAQUETE, CIFRADO_PAQUETE_ID)
+ID_BOUND_VERSIONS = (CIFRADO_GCM_ID, CIFRADO_PAQUETE_ID)
+ENCRYPTION_VERSIONS = (CIFRADO_CBC,) + GCM_VERSIONS + PAQUETE_VERSIONS
+
+# Columnas necesarias para descifrar cualquier formato
+DECRYPT_COLUMNS = (
+    'iv_aes', 'datos_encrypted', 'version_cifrado', 'paciente_id', 'doctor_id', 'fecha_consulta'
+)
+
+# Columnas del ETag: updated_at cambia en cada edición; hash_integridad, el
+# IV y el formato cambian al re-cifrar (los tags GCM son nuevos)
+ETAG_COLUMNS = ('id', 'updated_at', 'hash_integridad', 'iv_aes', 'version_cifrado')
+
+# Campos obligatorios: siempre presentes en un paquete auténtico
+REQUIRED_FIELDS = ('sintomas', 'diagnostico')
+
+# Paquete de campos: flags(1) + [zlib] ( n(1) + n * (longitud(4) + utf-8) )
+PACK_FLAG_ZLIB = 0x01
+PACK_NULL = 0xFFFFFFFF
+
+
+class MedicalRecordService:
+    """Servicio para preparar historias clínicas para la API"""
+
+    @staticmethod
+    def load_options(plain_fields=PLAIN_FIELDS, encrypted_fields=ENCRYPTED_FIELDS):
+        """
+        Opciones de carga que solo traen las columnas necesarias
+
+        Las columnas LargeBinary de campos no solicitados quedan diferidas,
+        por lo que nunca se leen de la base de datos.
+
+        Args:
+            plain_fields: Campos en claro a devolver
+            encrypted_fields: Campos cifrados a descifrar
+
+        Returns:
+            Opción load_only para Query.options()
+        """
+        columns = [getattr(HistoriaClinica, field) for field in plain_fields]
+        columns += [getattr(HistoriaClinica, f'{field}_encrypted') for field in encrypted_fields]
+        if encrypted_fields:
+            columns += [getattr(HistoriaClinica, column) for column in DECRYPT_COLUMNS
+                        if column not in plain_fields]
+        return load_only(*columns)
+
+    @staticmethod
+    def etag(record):
+        """ETag de una historia clínica (o de una fila con ETAG_COLUMNS)"""
+        return make_etag(*(getattr(record, column) for column in ETAG_COLUMNS))
+
+    @staticmethod
+    def current_etag(record_id):
+        """
+        ETag actual de una historia leyendo solo ETAG_COLUMNS por clave primaria
+
+        Returns:
+            ETag o None si la historia no existe
+        """
+        row = (
+            db.session.query(*(getattr(HistoriaClinica, column) for column in ETAG_COLUMNS))
+            .filter(HistoriaClinica.id == record_id)
+            .first()
+        )
+        return MedicalRecordService.etag(row) if row else None
+
+    @staticmethod
+    def filter_query(query, desde=None, hasta=None, doctor_id=None):
+        """
+        Aplicar filtros de fecha de consulta (inclusive) y doctor
+
+        Con doctor_id o un paciente fijo, los filtros se resuelven con los
+        índices compuestos (doctor_id|paciente_id, fecha_consulta).
+        """
+        if doctor_id is not None:
+            query = query.filter(HistoriaClinica.doctor_id == doctor_id)
+        if desde:
+            query = query.filter(HistoriaClinica.fecha_consulta >= desde)
+        if hasta:
+            query = query.filter(HistoriaClinica.fecha_consulta <= hasta)
+        return query
+
+    @staticmethod
+    def associated_data(paciente_id, doctor_id, fecha_consulta, field, record_id=None):
+        """
+        Datos asociados AES-GCM de un campo: liga el texto cifrado a su
+        registro y a su columna (no se puede copiar a otro registro o campo)
+
+        Los formatos 2 y 3 no incluyen el id: dos historias del mismo
+        paciente, doctor y fecha podían intercambiar sus valores cifrados.
+        """
+        if isinstance(fecha_consulta, (date, datetime)):
+            fecha_consulta = fecha_consulta.isoformat()
+        prefix = f'{record_id}|' if record_id is not None else ''
+        return f'{prefix}{paciente_id}|{doctor_id}|{fecha_consulta}|{field}'.encode('utf-8')
+
+    @staticmethod
+    def record_associated_data(record, field):
+        """Datos asociados de un campo de una historia guardada (según su formato)"""
+        return MedicalRecordService.associated_data(
+            record.paciente_id, record.doctor_id, record.fecha_consulta, field,
+            record.id if record.version_cifrado in ID_BOUND_VERSIONS else None
+        )
+
+    @staticmethod
+    def tags_hash(blobs):
+        """Huella SHA-256 de los tags GCM de los valores presentes (en orden de campo)"""
+        return hashlib.sha256(b''.join(blob[-16:] for blob in blobs if blob)).hexdigest()
+
+    @staticmethod
+    def encrypt_fields(paciente_id, doctor_id, fecha_consulta, values, version=None,
+                       compress_min_bytes=None, record_id=None):
+        """
+        Cifrar los campos clínicos de una historia
+
+        Args:
+            paciente_id: ID del paciente
+            doctor_id: ID del doctor
+            fecha_consulta: date de la consulta
+            values: dict campo -> texto (los vacíos se guardan como NULL)
+            version: Formato de cifrado (default: RECORD_ENCRYPTION_VERSION)
+            compress_min_bytes: Umbral de compresión del paquete
+                                (default: RECORD_COMPRESS_MIN_BYTES)
+            record_id: ID de la historia (obligatorio en los formatos 4 y 5:
+                       hacer flush antes de cifrar una historia nueva)
+
+        Returns:
+            dict de columnas de HistoriaClinica listo para el constructor/update
+
+        Raises:
+            ValueError: si el formato no existe o requiere record_id
+        """
+        if version is None:
+            version = current_app.config.get('RECORD_ENCRYPTION_VERSION', CIFRADO_PAQUETE_ID)
+        if version not in ENCRYPTION_VERSIONS:
+            raise ValueError(f'Formato de cifrado desconocido: {version}')
+        if version in ID_BOUND_VERSIONS:
+            if record_id is None:
+                raise ValueError(f'El formato de cifrado {version} requiere el id de la historia')
+        else:
+            record_id = None
+        crypto = get_crypto_service()
+        columns = {'version_cifrado': version}
+
+        if version in PAQUETE_VERSIONS:
+            blob = crypto.encrypt_gcm(
+                MedicalRecordService.pack_fields(values, compress_min_bytes),
+                MedicalRecordService.associated_data(paciente_id, doctor_id, fecha_consulta, 'datos', record_id)
+            )
+            columns.update({f'{field}_encrypted': None for field in ENCRYPTED_FIELDS})
+            columns['datos_encrypted'] = blob
+            columns['iv_aes'] = None
+            columns['hash_integridad'] = MedicalRecordService.tags_hash([blob])
+            return columns
+
+        columns['datos_encrypted'] = None
+        if version in GCM_VERSIONS:
+            for field in ENCRYPTED_FIELDS:
+                value = values.get(field)
+                blob = None
+                if value:
+                    blob = crypto.encrypt_gcm(value, MedicalRecordService.associated_data(
+                        paciente_id, doctor_id, fecha_consulta, field, record_id
+                    ))
+                columns[f'{field}_encrypted'] = blob
+            columns['iv_aes'] = None
+            # La autenticidad la garantiza GCM; el hash resume los tags y
+            # permite detectar que se borró un campo cifrado
+            columns['hash_integridad'] = MedicalRecordService.tags_hash(
+                columns[f'{field}_encrypted'] for field in ENCRYPTED_FIELDS
+            )
+            return columns
+
+        # Formato heredado: un IV para todos los campos y hash del contenido
+        iv = None
+        for field in ENCRYPTED_FIELDS:
+            value = values.get(field)
+            blob = None
+            if value:
+                blob, iv = crypto.encrypt_aes(value, iv)
+            columns[f'{field}_encrypted'] = blob
+        columns['iv_aes'] = iv
+        columns['hash_integridad'] = MedicalRecordService.legacy_hash(
+            paciente_id, doctor_id, fecha_consulta, values
+        )
+        return columns
+
+    @staticmethod
+    def encrypt_many(rows, version=None):
+        """
+        Cifrar los campos clínicos de varias historias en el pool de hilos
+
+        La configuración se resuelve aquí (los hilos no tienen contexto de
+        Flask) y cada historia se cifra con encrypt_fields.
+
+        Args:
+            rows: Lista de (paciente_id, doctor_id, fecha_consulta, values, record_id)
+            version: Formato de cifrado (default: RECORD_ENCRYPTION_VERSION)
+
+        Returns:
+            Lista de dicts de columnas en el mismo orden que rows
+        """
+        if version is None:
+            version = current_app.config.get('RECORD_ENCRYPTION_VERSION', CIFRADO_PAQUETE_ID)
+        compress_min_bytes = current_app.config.get('RECORD_COMPRESS_MIN_BYTES', 256)
+
+        def encrypt_chunk(chunk):
+            return [
+                MedicalRecordService.encrypt_fields(
+                    paciente_id, doctor_id, fecha_consulta, values,
+                    version=version, compress_min_bytes=compress_min_bytes, record_id=record_id
+                )
+                for paciente_id, doctor_id, fecha_consulta, values, record_id in chunk
+            ]
+
+        return get_crypto_service().map_chunks(encrypt_chunk, rows)
+
+    @staticmethod
+    def pack_fields(values, compress_min_bytes=None):
+        """
+        Empaquetar los campos clínicos en un solo valor binario
+
+        Cada campo va como longitud (uint32, 0xFFFFFFFF = NULL) + UTF-8, en el
+        orden de ENCRYPTED_FIELDS. Si el paquete supera compress_min_bytes se
+        comprime con zlib (solo si el resultado es más pequeño).
+
+        Args:
+            values: dict campo -> texto
+            compress_min_bytes: Umbral de compresión (default: RECORD_COMPRESS_MIN_BYTES)
+
+        Returns:
+            bytes del paquete (sin cifrar)
+        """
+        if compress_min_bytes is None:
+            compress_min_bytes = current_app.config.get('RECORD_COMPRESS_MIN_BYTES', 256)
+
+        parts = [struct.pack('>B', len(ENCRYPTED_FIELDS))]
+        for field in ENCRYPTED_FIELDS:
+            value = values.get(field)
+            if value:
+                encoded = value.encode('utf-8')
+                parts.append(struct.pack('>I', len(encoded)) + encoded)
+            else:
+                parts.append(struct.pack('>I', PACK_NULL))
+        body = b''.join(parts)
+
+        if compress_min_bytes and len(body) >= compress_min_bytes:
+            compressed = zlib.compress(body, 6)
+            if len(compressed) < len(body):
+                return bytes([PACK_FLAG_ZLIB]) + compressed
+        return bytes([0]) + body
+
+    @staticmethod
+    def unpack_fields(payload):
+        """
+        Desempaquetar un valor generado por pack_fields
+
+        Returns:
+            dict campo -> texto (None si el campo estaba vacío)
+
+        Raises:
+            ValueError: si el paquete está truncado o mal formado
+        """
+        if not payload:
+            raise ValueError('Paquete de historia clínica vacío')
+        flags, body = payload[0], payload[1:]
+        if flags & PACK_FLAG_ZLIB:
+            body = zlib.decompress(body)
+
+        try:
+            (count,) = struct.unpack_from('>B', body)
+            offset = 1
+            values = {}
+            for index in range(count):
+                (length,) = struct.unpack_from('>I', body, offset)
+                offset += 4
+                value = None
+                if length != PACK_NULL:
+                    if offset + length > len(body):
+                        raise ValueError('Paquete de historia clínica truncado')
+                    value = body[offset:offset + length].decode('utf-8')
+                    offset += length
+                if index < len(ENCRYPTED_FIELDS):
+                    values[ENCRYPTED_FIELDS[index]] = value
+        except struct.error as e:
+            raise ValueError(f'Paquete de historia clínica inválido: {e}')
+        return values
+
+    @staticmethod
+    def legacy_hash(paciente_id, doctor_id, fecha_consulta, values):
+        """Hash SHA-256 del contenido serializado (formato CBC)"""
+        if isinstance(fecha_consulta, (date, datetime)):
+            fecha_consulta = fecha_consulta.isoformat()
+        record_content = {
+            'paciente_id': paciente_id,
+            'doctor_id': doctor_id,
+            'fecha_consulta': fecha_consulta or '',
+            'sintomas': values.get('sintomas', ''),
+            'diagnostico': values.get('diagnostico', ''),
+            'tratamiento': values.get('tratamiento', ''),
+            'notas': values.get('notas', '')
+        }
+        return get_crypto_service().calculate_sha256(json.dumps(record_content, sort_keys=True))
+
+    @staticmethod
+    def verify_integrity(record, record_data):
+        """
+        Comprobar la integridad de una historia ya descifrada
+
+        En AES-GCM cada valor presente se autenticó al descifrar; además se
+        recalcula la huella de los tags de los valores guardados y se compara
+        con hash_integridad, así se detecta un campo cifrado borrado (en el
+        formato de paquete también deben estar los campos obligatorios). En
+        CBC se recalcula el hash del contenido.
+
+        Args:
+            record: HistoriaClinica
+            record_data: dict devuelto por decrypt_records (todos los campos)
+
+        Returns:
+            True si la historia no fue modificada
+        """
+        if record.version_cifrado in PAQUETE_VERSIONS:
+            return (
+                MedicalRecordService.tags_hash([record.datos_encrypted]) == record.hash_integridad
+                and all(record_data.get(field) is not None for field in REQUIRED_FIELDS)
+            )
+
+        if record.version_cifrado in GCM_VERSIONS:
+            blobs = [getattr(record, f'{field}_encrypted') for field in ENCRYPTED_FIELDS]
+            return (
+                MedicalRecordService.tags_hash(blobs) == record.hash_integridad
+                and all(
+                    record_data.get(field) is not None
+                    for field, blob in zip(ENCRYPTED_FIELDS, blobs)
+                    if blob
+                )
+            )
+
+        calculated_hash = MedicalRecordService.legacy_hash(
+            record.paciente_id, record.doctor_id, record.fecha_consulta, record_data
+        )
+        return calculated_hash == record.hash_integridad
+
+    @staticmethod
+    def to_response(record, fields=PLAIN_FIELDS):
+        """
+        Datos en claro de una historia clínica (sin campos cifrados)
+
+        Args:
+            record: HistoriaClinica
+            fields: Campos en claro a incluir
+
+        Returns:
+            dict con los campos no sensibles
+        """
+        data = {}
+        for field in fields:
+            value = getattr(record, field)
+            data[field] = value.isoformat() if isinstance(value, (date, datetime)) else value
+        return data
+
+    @staticmethod
+    def decrypt_records(records, fields=ENCRYPTED_FIELDS, plain_fields=PLAIN_FIELDS):
+        """
+        Serializar un conjunto de historias clínicas descifrando sus campos
+
+        Todos los campos de todos los registros se descifran en una sola
+        llamada a CryptoService.decrypt_many; los registros en formato de
+        paquete aportan un único valor cada uno.
+
+        Args:
+            records: Lista de HistoriaClinica
+            fields: Campos cifrados a descifrar
+            plain_fields: Campos en claro a incluir
+
+        Returns:
+            Lista de dicts en el mismo orden que records
+        """
+        records = list(records)
+        items = []
+        for record in records:
+            if not fields:
+                continue
+            if record.version_cifrado in PAQUETE_VERSIONS:
+                items.append((record.datos_encrypted, None,
+                              MedicalRecordService.record_associated_data(record, 'datos'), False))
+                continue
+            for field in fields:
+                ciphertext = getattr(record, f'{field}_encrypted')
+                if record.version_cifrado in GCM_VERSIONS:
+                    items.append((ciphertext, None,
+                                  MedicalRecordService.record_associated_data(record, field)))
+                else:
+                    items.append((ciphertext, record.iv_aes))
+        values = iter(get_crypto_service().decrypt_many(items))
+
+        result = []
+        for record in records:
+            record_data = MedicalRecordService.to_response(record, plain_fields)
+            if fields and record.version_cifrado in PAQUETE_VERSIONS:
+                payload = next(values)
+                unpacked = {}
+                if payload is not None:
+                    try:
+                        unpacked = MedicalRecordService.unpack_fields(payload)
+                    except (ValueError, zlib.error) as e:
+                        print(f"⚠️  Error desempaquetando historia clínica {record.id}: {e}")
+                for field in fields:
+                    record_data[field] = unpacked.get(field)
+            else:
+                for field in fields:
+                    record_data[field] = next(values)
+            result.append(record_data)
+
+        return result
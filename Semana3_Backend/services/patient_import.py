@@ -0,0 +1,296 @@
+"""
+Importación masiva de pacientes desde CSV o JSONL
+El archivo se lee en streaming por bloques de IMPORT_CHUNK_SIZE filas. Por
+bloque: validación, deduplicación de cédulas y comprobación de doctores con
+una consulta IN cada una, cifrado e índice ciego en el pool de hilos de
+CryptoService, INSERT por lotes y commit. Las filas rechazadas se escriben
+en un archivo JSONL con su línea y motivo, sin los campos sensibles.
+"""
+import io
+import csv
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from models.base import db
+from models.patient import Paciente, PacienteToken
+from models.user import Usuario
+from services.crypto_service import get_crypto_service
+from services.patient_search import PatientSearchService
+from services.patient_service import ENCRYPTED_FIELDS
+from utils.validators import validate_cedula_ecuador
+
+
+# Formatos de archivo admitidos
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# Columnas obligatorias del archivo
+REQUIRED_COLUMNS = ('cedula', 'nombre', 'apellido', 'fecha_nacimiento')
+
+# Columnas en claro opcionales (tipo_sangre se acepta como en POST /patients)
+OPTIONAL_COLUMNS = ('genero', 'telefono', 'email', 'direccion', 'grupo_sanguineo')
+
+# Valor que reemplaza a los campos cifrados en las filas rechazadas
+REDACTED = '[oculto]'
+
+
+def redact_row(row):
+    """Copia de una fila sin los valores de ENCRYPTED_FIELDS (para los rechazos)"""
+    if row is None:
+        return None
+    return {
+        key: REDACTED if isinstance(key, str) and key.strip() in ENCRYPTED_FIELDS and value else value
+        for key, value in row.items()
+    }
+
+
+def detect_format(filename):
+    """Formato de importación según la extensión ('csv' salvo .jsonl/.ndjson)"""
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    return 'csv'
+
+
+class PatientImportService:
+    """Servicio de importación masiva de pacientes"""
+
+    @staticmethod
+    def read_rows(stream, fmt):
+        """
+        Leer filas de un archivo binario sin cargarlo completo
+
+        Yields:
+            (número de línea, dict de la fila o None si la línea no es válida)
+        """
+        text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            for row in reader:
+                yield reader.line_num, row
+            return
+
+        for line_num, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_num, row if isinstance(row, dict) else None
+
+    @staticmethod
+    def validate_row(row, doctor_id=None):
+        """
+        Convertir una fila del archivo en columnas de Paciente
+
+        Returns:
+            (columnas en claro, dict campo cifrado -> texto)
+
+        Raises:
+            ValueError: con el motivo del rechazo
+        """
+        if row is None:
+            raise ValueError('Línea no es un objeto JSON válido')
+        row = {key.strip(): value.strip() if isinstance(value, str) else value
+               for key, value in row.items() if key}
+
+        for column in REQUIRED_COLUMNS:
+            if not row.get(column):
+                raise ValueError(f'Campo requerido: {column}')
+        cedula = str(row['cedula'])
+        if not validate_cedula_ecuador(cedula):
+            raise ValueError('Cédula ecuatoriana inválida')
+        try:
+            fecha_nacimiento = datetime.fromisoformat(str(row['fecha_nacimiento'])[:10]).date()
+        except ValueError:
+            raise ValueError('fecha_nacimiento debe ser una fecha ISO 8601')
+
+        columns = {
+            'cedula': cedula,
+            'nombre': row['nombre'],
+            'apellido': row['apellido'],
+            'fecha_nacimiento': fecha_nacimiento,
+            'doctor_id': row.get('doctor_id') or doctor_id
+        }
+        for column in OPTIONAL_COLUMNS:
+            columns[column] = row.get(column) or None
+        columns['grupo_sanguineo'] = columns['grupo_sanguineo'] or row.get('tipo_sangre') or None
+        for column in ('nombre', 'apellido') + OPTIONAL_COLUMNS:
+            # Un valor demasiado largo haría fallar el INSERT de todo el bloque
+            length = Paciente.__table__.c[column].type.length
+            if length and columns[column] and len(str(columns[column])) > length:
+                raise ValueError(f'{column} supera {length} caracteres')
+        if columns['doctor_id'] is not None:
+            try:
+                columns['doctor_id'] = int(columns['doctor_id'])
+            except (TypeError, ValueError):
+                raise ValueError('doctor_id debe ser un número')
+
+        return columns, {field: row.get(field) or None for field in ENCRYPTED_FIELDS}
+
+    @staticmethod
+    def encrypt_chunk(items):
+        """
+        Cifrar campos sensibles y calcular tokens del índice ciego de un bloque
+        (se ejecuta en el pool de hilos: sin contexto de Flask)
+
+        Args:
+            items: Lista de (columnas, valores cifrables)
+
+        Returns:
+            Lista de (columnas completas, lista de (campo, token))
+        """
+        crypto = get_crypto_service()
+        result = []
+        for columns, values in items:
+            columns = dict(columns)
+            tokens = []
+            for field in ENCRYPTED_FIELDS:
+                encrypted = iv = None
+                if values[field]:
+                    encrypted, iv = crypto.encrypt_aes(values[field])
+                    tokens += [(field, token) for token in PatientSearchService.tokens(field, values[field])]
+                columns[f'{field}_encrypted'] = encrypted
+                columns[f'{field}_iv'] = iv
+            result.append((columns, tokens))
+        return result
+
+    @staticmethod
+    def insert_chunk(rows):
+        """
+        Insertar un bloque de pacientes y sus tokens en una transacción
+
+        Args:
+            rows: Lista de (columnas, tokens)
+
+        Returns:
+            Número de pacientes insertados
+
+        Raises:
+            IntegrityError: si otra carga insertó una de las cédulas entretanto
+        """
+        now = datetime.utcnow()
+        patients = [dict(columns, created_at=now, updated_at=now) for columns, _ in rows]
+        inserted = db.session.execute(
+            db.insert(Paciente).returning(Paciente.id, Paciente.cedula),
+            patients
+        ).all()
+
+        ids = {cedula: patient_id for patient_id, cedula in inserted}
+        tokens = [
+            {'paciente_id': ids[columns['cedula']], 'campo': field, 'token': token}
+            for columns, row_tokens in rows
+            for field, token in row_tokens
+        ]
+        if tokens:
+            db.session.execute(db.insert(PacienteToken), tokens)
+        db.session.commit()
+        return len(inserted)
+
+    @staticmethod
+    def integrity_reason(columns, error):
+        """Motivo legible de un IntegrityError al insertar una fila (tras el rollback)"""
+        if db.session.query(Paciente.query.filter_by(cedula=columns['cedula']).exists()).scalar():
+            return 'La cédula ya está registrada'
+        if columns.get('doctor_id') is not None and db.session.get(Usuario, columns['doctor_id']) is None:
+            return 'doctor_id no corresponde a un usuario'
+        return f"Error de integridad: {str(getattr(error, 'orig', error)).splitlines()[0]}"
+
+    @staticmethod
+    def import_file(stream, fmt='csv', rejects=None, doctor_id=None, chunk_size=None, progress=None):
+        """
+        Importar pacientes desde un archivo CSV (con encabezado) o JSONL
+
+        Args:
+            stream: Archivo binario abierto
+            fmt: 'csv' o 'jsonl'
+            rejects: Archivo de texto donde escribir los rechazos en JSONL
+                     ({"linea", "error", "fila"}, con los campos cifrados
+                     ocultos); None para no escribirlos
+            doctor_id: Doctor asignado a las filas sin columna doctor_id
+            chunk_size: Filas por bloque (default: IMPORT_CHUNK_SIZE)
+            progress: Función llamada con las estadísticas tras cada bloque
+
+        Returns:
+            dict con leidas, importadas y rechazadas
+
+        Raises:
+            ValueError: si el formato no es válido
+        """
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f'Formato debe ser uno de: {", ".join(IMPORT_FORMATS)}')
+        chunk_size = max(1, chunk_size or current_app.config.get('IMPORT_CHUNK_SIZE', 1000))
+
+        stats = {'leidas': 0, 'importadas': 0, 'rechazadas': 0}
+        seen = set()  # Cédulas ya vistas en el archivo
+
+        def reject(line_num, row, message):
+            stats['rechazadas'] += 1
+            if rejects is not None:
+                rejects.write(json.dumps(
+                    {'linea': line_num, 'error': message, 'fila': redact_row(row)},
+                    ensure_ascii=False, default=str
+                ) + '\n')
+
+        def flush(chunk):
+            # Cédulas ya registradas y doctores existentes: una consulta IN cada una
+            existing = {
+                cedula for (cedula,) in db.session.query(Paciente.cedula).filter(
+                    Paciente.cedula.in_([columns['cedula'] for _, _, (columns, _) in chunk])
+                )
+            }
+            requested = {columns['doctor_id'] for _, _, (columns, _) in chunk} - {None}
+            doctors = {
+                user_id for (user_id,) in db.session.query(Usuario.id).filter(Usuario.id.in_(requested))
+            } if requested else set()
+            pending = []
+            for line_num, row, item in chunk:
+                if item[0]['cedula'] in existing:
+                    reject(line_num, row, 'La cédula ya está registrada')
+                elif item[0]['doctor_id'] is not None and item[0]['doctor_id'] not in doctors:
+                    reject(line_num, row, 'doctor_id no corresponde a un usuario')
+                else:
+                    pending.append((line_num, row, item))
+            if not pending:
+                return
+
+            encrypted = get_crypto_service().map_chunks(
+                PatientImportService.encrypt_chunk, [item for _, _, item in pending]
+            )
+            try:
+                stats['importadas'] += PatientImportService.insert_chunk(encrypted)
+            except IntegrityError:
+                # Otra carga insertó alguna cédula o borró un doctor: reintentar fila por fila
+                db.session.rollback()
+                for (line_num, row, _), encrypted_row in zip(pending, encrypted):
+                    try:
+                        stats['importadas'] += PatientImportService.insert_chunk([encrypted_row])
+                    except IntegrityError as e:
+                        db.session.rollback()
+                        reject(line_num, row, PatientImportService.integrity_reason(encrypted_row[0], e))
+
+        chunk = []
+        for line_num, row in PatientImportService.read_rows(stream, fmt):
+            stats['leidas'] += 1
+            try:
+                item = PatientImportService.validate_row(row, doctor_id)
+            except ValueError as e:
+                reject(line_num, row, str(e))
+                continue
+            if item[0]['cedula'] in seen:
+                reject(line_num, row, 'Cédula repetida en el archivo')
+                continue
+            seen.add(item[0]['cedula'])
+
+            chunk.append((line_num, row, item))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+                if progress:
+                    progress(dict(stats))
+
+        if chunk:
+            flush(chunk)
+        if progress:
+            progress(dict(stats))
+        return stats
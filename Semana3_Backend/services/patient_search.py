@@ -0,0 +1,277 @@
+"""
+Búsqueda de pacientes
+- Campos cifrados (índice ciego): cada palabra normalizada de
+  alergias/antecedentes se guarda en paciente_tokens como HMAC con una
+  subclave de la clave maestra. Buscar es una consulta indexada por
+  (campo, token) y solo se descifran los pacientes que coinciden.
+- Autocompletado (?q=): prefijo de cédula, nombre o apellido, sin descifrar.
+  En PostgreSQL usa los índices *_pattern_ops; en otros motores (SQLite) un
+  índice ordenado en memoria que se recarga cuando cambia la tabla.
+"""
+import re
+import heapq
+import bisect
+import threading
+import unicodedata
+from models.base import db
+from models.patient import Paciente, PacienteToken
+from services.crypto_service import get_crypto_service
+from services.patient_service import PatientService, ENCRYPTED_FIELDS
+
+
+# Parámetro de /patients/search -> campo cifrado indexado
+SEARCH_PARAMS = {
+    'alergia': 'alergias',
+    'antecedente': 'antecedentes',
+}
+
+# Palabras más cortas no se indexan (artículos, preposiciones)
+MIN_WORD_LENGTH = 3
+
+# Campos del autocompletado: los de búsqueda por prefijo y la proyección devuelta
+PREFIX_FIELDS = ('cedula', 'nombre', 'apellido')
+TYPEAHEAD_FIELDS = ('id', 'cedula', 'nombre', 'apellido', 'fecha_nacimiento')
+
+# Longitud mínima de ?q=
+MIN_PREFIX_LENGTH = 2
+
+WORD_RE = re.compile(r'\w+')
+
+
+class PatientPrefixIndex:
+    """
+    Índice ordenado en memoria de cédula/nombre/apellido (motores sin
+    índices de patrón). Cada búsqueda compara una firma barata de la tabla
+    (conteo, id máximo, updated_at máximo) y recarga si otro proceso la cambió.
+    """
+
+    def __init__(self):
+        self._signature = None
+        self._keys = {}  # campo -> lista ordenada de (valor en minúsculas, id)
+        self._rows = {}  # id -> proyección TYPEAHEAD_FIELDS
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature():
+        """Firma de la tabla pacientes que cambia con cada alta, baja o edición"""
+        return tuple(db.session.query(
+            db.func.count(Paciente.id), db.func.max(Paciente.id), db.func.max(Paciente.updated_at)
+        ).one())
+
+    def _load(self, signature):
+        """Reconstruir el índice desde la tabla"""
+        keys = {field: [] for field in PREFIX_FIELDS}
+        rows = {}
+        columns = [getattr(Paciente, field) for field in TYPEAHEAD_FIELDS]
+        for paciente in db.session.execute(db.select(*columns).execution_options(yield_per=1000)):
+            rows[paciente.id] = PatientService.to_response(paciente, TYPEAHEAD_FIELDS)
+            for field in PREFIX_FIELDS:
+                keys[field].append(((getattr(paciente, field) or '').lower(), paciente.id))
+        for entries in keys.values():
+            entries.sort()
+        self._keys, self._rows, self._signature = keys, rows, signature
+
+    def search(self, words, limit):
+        """
+        Pacientes con algún campo de PREFIX_FIELDS que empiece por cada palabra
+
+        Args:
+            words: Prefijos en minúsculas (se combinan con AND)
+            limit: Máximo de resultados
+
+        Returns:
+            Lista de proyecciones ordenadas por apellido, nombre e id
+        """
+        signature = self.signature()
+        with self._lock:
+            if signature != self._signature:
+                self._load(signature)
+
+            matches = None
+            for word in words:
+                ids = set()
+                for entries in self._keys.values():
+                    start = bisect.bisect_left(entries, (word,))
+                    for key, patient_id in entries[start:]:
+                        if not key.startswith(word):
+                            break
+                        ids.add(patient_id)
+                matches = ids if matches is None else matches & ids
+                if not matches:
+                    return []
+
+            rows = [self._rows[patient_id] for patient_id in matches]
+
+        return heapq.nsmallest(
+            limit, rows, key=lambda row: (row['apellido'].lower(), row['nombre'].lower(), row['id'])
+        )
+
+
+# Índice en memoria compartido por el proceso
+patient_prefix_index = PatientPrefixIndex()
+
+
+class PatientSearchService:
+    """Servicio de índices ciegos y búsqueda de pacientes"""
+
+    @staticmethod
+    def normalize_words(text):
+        """
+        Palabras indexables de un texto: minúsculas, sin tildes y sin repetir
+
+        'Penicilina, AINEs; polen' -> {'penicilina', 'aines', 'polen'}
+        """
+        if not text:
+            return set()
+        text = unicodedata.normalize('NFKD', text.lower())
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+        return {word for word in WORD_RE.findall(text) if len(word) >= MIN_WORD_LENGTH}
+
+    @staticmethod
+    def tokens(field, text):
+        """Tokens HMAC de las palabras de text para el campo field"""
+        crypto = get_crypto_service()
+        return {crypto.blind_index(field, word) for word in PatientSearchService.normalize_words(text)}
+
+    @staticmethod
+    def index_patient(paciente, values):
+        """
+        Reemplazar los tokens de los campos dados de un paciente (sin commit)
+
+        Args:
+            paciente: Paciente (se hace flush si aún no tiene id)
+            values: dict campo -> texto en claro (None borra sus tokens)
+        """
+        if paciente.id is None:
+            db.session.flush()
+
+        fields = [field for field in values if field in ENCRYPTED_FIELDS]
+        if not fields:
+            return
+
+        db.session.execute(db.delete(PacienteToken).where(
+            PacienteToken.paciente_id == paciente.id,
+            PacienteToken.campo.in_(fields)
+        ))
+        rows = [
+            {'paciente_id': paciente.id, 'campo': field, 'token': token}
+            for field in fields
+            for token in PatientSearchService.tokens(field, values[field])
+        ]
+        if rows:
+            db.session.execute(db.insert(PacienteToken), rows)
+
+    @staticmethod
+    def matching_ids(field, text):
+        """
+        Subconsulta de ids de pacientes cuyo campo contiene todas las palabras de text
+
+        Raises:
+            ValueError: si text no tiene palabras indexables
+        """
+        tokens = PatientSearchService.tokens(field, text)
+        if not tokens:
+            raise ValueError(f'El término de búsqueda debe tener palabras de al menos {MIN_WORD_LENGTH} letras')
+
+        return (
+            db.session.query(PacienteToken.paciente_id)
+            .filter(PacienteToken.campo == field, PacienteToken.token.in_(tokens))
+            .group_by(PacienteToken.paciente_id)
+            .having(db.func.count(PacienteToken.token) == len(tokens))
+        )
+
+    @staticmethod
+    def filter_encrypted(query, criteria):
+        """
+        Filtrar una query de Paciente por los criterios de campos cifrados
+
+        Args:
+            query: Query de Paciente
+            criteria: dict campo -> texto buscado (se combinan con AND)
+        """
+        for field, text in criteria.items():
+            query = query.filter(Paciente.id.in_(PatientSearchService.matching_ids(field, text)))
+        return query
+
+    @staticmethod
+    def prefix_words(q):
+        """
+        Prefijos en minúsculas de ?q= (uno por palabra)
+
+        Raises:
+            ValueError: si q es más corto que MIN_PREFIX_LENGTH
+        """
+        words = q.lower().split()
+        if not words or len(''.join(words)) < MIN_PREFIX_LENGTH:
+            raise ValueError(f'q debe tener al menos {MIN_PREFIX_LENGTH} caracteres')
+        return words
+
+    @staticmethod
+    def typeahead(q, limit=10):
+        """
+        Autocompletado por prefijo de cédula, nombre o apellido
+
+        Cada palabra de q debe ser prefijo de alguno de los tres campos
+        ('gar 17' -> apellido García y cédula 17...). No se descifra nada.
+
+        Args:
+            q: Texto escrito por el usuario
+            limit: Máximo de resultados
+
+        Returns:
+            Lista de dicts con TYPEAHEAD_FIELDS ordenada por apellido y nombre
+        """
+        words = PatientSearchService.prefix_words(q)
+
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return patient_prefix_index.search(words, limit)
+
+        query = Paciente.query.options(PatientService.load_options(TYPEAHEAD_FIELDS, ()))
+        for word in words:
+            # Patrón constante 'abc%' y mismas expresiones que PREFIX_INDEXES
+            # para que el planificador use los índices
+            pattern = re.sub(r'([/%_])', r'/\1', word) + '%'
+            query = query.filter(db.or_(
+                Paciente.cedula.like(pattern, escape='/'),
+                db.func.lower(Paciente.nombre).like(pattern, escape='/'),
+                db.func.lower(Paciente.apellido).like(pattern, escape='/')
+            ))
+        pacientes = query.order_by(
+            db.func.lower(Paciente.apellido), db.func.lower(Paciente.nombre), Paciente.id
+        ).limit(limit).all()
+        return [PatientService.to_response(paciente, TYPEAHEAD_FIELDS) for paciente in pacientes]
+
+    @staticmethod
+    def rebuild(batch_size=500):
+        """
+        Recalcular el índice ciego de todos los pacientes (p. ej. tras
+        desplegar la tabla o rotar la clave maestra)
+
+        Returns:
+            Número de pacientes recorridos
+        """
+        total = 0
+        last_id = 0
+        while True:
+            pacientes = (
+                Paciente.query
+                .options(PatientService.load_options(('id',)))
+                .filter(Paciente.id > last_id)
+                .order_by(Paciente.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not pacientes:
+                return total
+
+            for paciente, data in zip(pacientes, PatientService.decrypt_patients(pacientes, plain_fields=('id',))):
+                # Un campo que no se pudo descifrar conserva sus tokens actuales
+                values = {
+                    field: data[field] for field in ENCRYPTED_FIELDS
+                    if data[field] is not None or not getattr(paciente, f'{field}_encrypted')
+                }
+                PatientSearchService.index_patient(paciente, values)
+            db.session.commit()
+
+            total += len(pacientes)
+            last_id = pacientes[-1].id
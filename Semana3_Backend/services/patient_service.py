@@ -0,0 +1,196 @@
+"""
+Servicio de pacientes
+Serialización y descifrado por lotes de pacientes
+"""
+from datetime import date, datetime
+from sqlalchemy.orm import load_only, selectinload
+from models.base import db
+from models.patient import Paciente
+from models.medical_record import HistoriaClinica
+from services.crypto_service import get_crypto_service
+from utils.helpers import make_etag
+from services.medical_record_service import MedicalRecordService
+from services.medical_record_service import (
+    PLAIN_FIELDS as RECORD_PLAIN_FIELDS, ENCRYPTED_FIELDS as RECORD_ENCRYPTED_FIELDS
+)
+
+
+# Campos en claro expuestos por la API (en orden de respuesta)
+PLAIN_FIELDS = (
+    'id', 'cedula', 'nombre', 'apellido', 'fecha_nacimiento', 'genero',
+    'grupo_sanguineo', 'telefono', 'email', 'direccion', 'created_at', 'updated_at'
+)
+
+# Campos cifrados con AES (columnas <campo>_encrypted y <campo>_iv)
+ENCRYPTED_FIELDS = ('alergias', 'antecedentes')
+
+# Campos descifrados con ?decrypt=summary
+SUMMARY_FIELDS = ('alergias',)
+
+# Columnas del ETag: updated_at cambia en cada edición y los IV al re-cifrar
+ETAG_COLUMNS = ('id', 'updated_at', 'alergias_iv', 'antecedentes_iv')
+
+
+class PatientService:
+    """Servicio para preparar pacientes para la API"""
+
+    @staticmethod
+    def load_options(plain_fields=PLAIN_FIELDS, encrypted_fields=ENCRYPTED_FIELDS):
+        """
+        Opciones de carga que solo traen las columnas necesarias
+
+        Args:
+            plain_fields: Campos en claro a devolver
+            encrypted_fields: Campos cifrados a descifrar
+
+        Returns:
+            Opción load_only para Query.options()
+        """
+        columns = [getattr(Paciente, field) for field in plain_fields]
+        for field in encrypted_fields:
+            columns.append(getattr(Paciente, f'{field}_encrypted'))
+            columns.append(getattr(Paciente, f'{field}_iv'))
+        return load_only(*columns)
+
+    @staticmethod
+    def etag(paciente):
+        """ETag de un paciente (o de una fila con ETAG_COLUMNS)"""
+        return make_etag(*(getattr(paciente, column) for column in ETAG_COLUMNS))
+
+    @staticmethod
+    def current_etag(patient_id):
+        """
+        ETag actual de un paciente leyendo solo ETAG_COLUMNS por clave primaria
+
+        Returns:
+            ETag o None si el paciente no existe
+        """
+        row = (
+            db.session.query(*(getattr(Paciente, column) for column in ETAG_COLUMNS))
+            .filter(Paciente.id == patient_id)
+            .first()
+        )
+        return PatientService.etag(row) if row else None
+
+    @staticmethod
+    def to_response(paciente, fields=PLAIN_FIELDS):
+        """
+        Datos en claro de un paciente (sin campos cifrados)
+
+        Args:
+            paciente: Paciente
+            fields: Campos en claro a incluir
+
+        Returns:
+            dict con los campos no sensibles
+        """
+        data = {}
+        for field in fields:
+            value = getattr(paciente, field)
+            data[field] = value.isoformat() if isinstance(value, (date, datetime)) else value
+        return data
+
+    @staticmethod
+    def decrypt_patients(patients, fields=ENCRYPTED_FIELDS, plain_fields=PLAIN_FIELDS):
+        """
+        Serializar un conjunto de pacientes descifrando sus campos sensibles
+
+        Args:
+            patients: Lista de Paciente
+            fields: Campos cifrados a descifrar
+            plain_fields: Campos en claro a incluir
+
+        Returns:
+            Lista de dicts en el mismo orden que patients
+        """
+        patients = list(patients)
+        items = [
+            (getattr(paciente, f'{field}_encrypted'), getattr(paciente, f'{field}_iv'))
+            for paciente in patients
+            for field in fields
+        ]
+        values = iter(get_crypto_service().decrypt_many(items))
+
+        result = []
+        for paciente in patients:
+            patient_data = PatientService.to_response(paciente, plain_fields)
+            for field in fields:
+                patient_data[field] = next(values)
+            result.append(patient_data)
+
+        return result
+
+    @staticmethod
+    def owned_by(query, doctor_id):
+        """
+        Filtrar pacientes del panel de un doctor: los asignados a él
+        (pacientes.doctor_id) y los que ha atendido (historias_clinicas.doctor_id)
+
+        Ambas condiciones se resuelven con los índices idx_pacientes_doctor_id
+        e idx_historias_doctor_fecha.
+        """
+        atendidos = db.session.query(HistoriaClinica.paciente_id).filter(
+            HistoriaClinica.doctor_id == doctor_id
+        )
+        return query.filter(db.or_(
+            Paciente.doctor_id == doctor_id,
+            Paciente.id.in_(atendidos)
+        ))
+
+    @staticmethod
+    def timeline(patient_id, desde=None, hasta=None, record_fields=RECORD_ENCRYPTED_FIELDS,
+                 record_plain_fields=RECORD_PLAIN_FIELDS):
+        """
+        Ficha de un paciente con sus historias y recetas
+
+        Se hacen tres consultas fijas (paciente, historias de la ventana y sus
+        recetas, con selectinload) sin importar cuántas historias haya, y
+        cada nivel se descifra en un solo lote.
+
+        Args:
+            patient_id: ID del paciente
+            desde: date inicial de fecha_consulta (inclusive)
+            hasta: date final de fecha_consulta (inclusive)
+            record_fields: Campos cifrados de las historias a descifrar
+            record_plain_fields: Campos en claro de las historias
+
+        Returns:
+            dict con 'paciente' e 'historias' (más recientes primero, cada una
+            con sus 'recetas'), o None si el paciente no existe
+        """
+        window = []
+        if desde:
+            window.append(HistoriaClinica.fecha_consulta >= desde)
+        if hasta:
+            window.append(HistoriaClinica.fecha_consulta <= hasta)
+
+        historias = Paciente.historias_clinicas.and_(*window) if window else Paciente.historias_clinicas
+        # El orden y la colección necesitan fecha_consulta y paciente_id aunque
+        # no se pidan en ?fields= (si no, una consulta diferida por historia)
+        load_fields = tuple(dict.fromkeys(record_plain_fields + ('id', 'paciente_id', 'fecha_consulta')))
+        paciente = Paciente.query.options(
+            PatientService.load_options(),
+            selectinload(historias).options(
+                MedicalRecordService.load_options(load_fields, record_fields),
+                selectinload(HistoriaClinica.recetas)
+            )
+        ).filter(Paciente.id == patient_id).execution_options(
+            populate_existing=True  # La ventana de fechas no debe reutilizar colecciones ya cargadas
+        ).first()
+
+        if not paciente:
+            return None
+
+        records = sorted(
+            paciente.historias_clinicas,
+            key=lambda record: (record.fecha_consulta, record.id),
+            reverse=True
+        )
+        record_data = MedicalRecordService.decrypt_records(records, record_fields, record_plain_fields)
+        for record, data in zip(records, record_data):
+            data['recetas'] = [receta.to_dict() for receta in sorted(record.recetas, key=lambda r: r.id)]
+
+        return {
+            'paciente': PatientService.decrypt_patients([paciente])[0],
+            'historias': record_data
+        }
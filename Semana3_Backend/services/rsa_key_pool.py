@@ -0,0 +1,113 @@
+"""
+Pool de pares de claves RSA pre-generados
+Un hilo en segundo plano mantiene algunos pares listos por tamaño de clave,
+de modo que emitir una clave no tenga que esperar la generación (segundos
+para RSA-4096).
+"""
+import queue
+import threading
+from typing import Tuple
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.backends import default_backend
+
+
+def generate_key_pair_pem(key_size: int = 2048) -> Tuple[bytes, bytes]:
+    """
+    Generar un par de claves RSA serializado en PEM
+
+    Args:
+        key_size: Tamaño de la clave en bits
+
+    Returns:
+        (private_key_pem, public_key_pem)
+    """
+    private_key = rsa.generate_private_key(
+        public_exponent=65537,
+        key_size=key_size,
+        backend=default_backend()
+    )
+
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    return private_pem, public_pem
+
+
+class RSAKeyPool:
+    """Reserva de pares RSA por tamaño, rellenada en segundo plano"""
+
+    def __init__(self):
+        self.sizes = {}
+        self._queues = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def init_app(self, app):
+        """
+        Configurar tamaños de la reserva y arrancar el hilo de relleno
+
+        Args:
+            app: Aplicación Flask (usa RSA_POOL_SIZES, p. ej. {2048: 4})
+        """
+        self.sizes = dict(app.config.get('RSA_POOL_SIZES', {2048: 4}))
+        for key_size, capacity in self.sizes.items():
+            if key_size not in self._queues:
+                self._queues[key_size] = queue.Queue(maxsize=max(1, capacity))
+
+        if self._thread is None and any(self.sizes.values()):
+            self._thread = threading.Thread(target=self._run, name='rsa-key-pool', daemon=True)
+            self._thread.start()
+
+    def get(self, key_size: int = 2048) -> Tuple[bytes, bytes]:
+        """
+        Tomar un par de claves de la reserva
+
+        Si no hay pares disponibles para ese tamaño se genera uno en el acto.
+
+        Args:
+            key_size: Tamaño de la clave en bits
+
+        Returns:
+            (private_key_pem, public_key_pem)
+        """
+        pool = self._queues.get(key_size)
+        if pool is not None:
+            try:
+                pair = pool.get_nowait()
+                self._wakeup.set()
+                return pair
+            except queue.Empty:
+                self._wakeup.set()
+
+        return generate_key_pair_pem(key_size)
+
+    def available(self):
+        """Pares disponibles por tamaño de clave"""
+        return {key_size: pool.qsize() for key_size, pool in self._queues.items()}
+
+    def _run(self):
+        """Rellenar las reservas incompletas; dormir hasta que se consuma alguna"""
+        while True:
+            for key_size, pool in list(self._queues.items()):
+                while not pool.full():
+                    try:
+                        pool.put_nowait(generate_key_pair_pem(key_size))
+                    except queue.Full:
+                        break
+                    except Exception as e:
+                        print(f"⚠️  Error generando claves RSA-{key_size}: {str(e)}")
+                        break
+            self._wakeup.wait()
+            self._wakeup.clear()
+
+
+# Instancia global de la reserva
+rsa_key_pool = RSAKeyPool()
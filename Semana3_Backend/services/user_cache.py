@@ -0,0 +1,99 @@
+"""
+Caché de resúmenes de usuario (id, username, nombre completo)
+Los listados de auditoría muestran el autor de cada evento; en lugar de
+cargar la relación AuditLog.usuario fila por fila, los resúmenes se leen en
+una sola consulta IN por página y se reutilizan durante unos segundos.
+"""
+import time
+import threading
+from collections import OrderedDict
+from sqlalchemy.orm import load_only
+from models.user import Usuario
+
+
+class UserSummaryCache:
+    """Caché LRU con expiración de resúmenes de usuario, compartida por el proceso"""
+
+    def __init__(self):
+        self.ttl = 60
+        self.maxsize = 1024
+        self._entries = OrderedDict()  # usuario_id -> (expira, resumen)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configurar expiración y tamaño de la caché
+
+        Args:
+            app: Aplicación Flask
+        """
+        self.ttl = app.config.get('USER_SUMMARY_TTL', 60)
+        self.maxsize = app.config.get('USER_SUMMARY_CACHE_SIZE', 1024)
+
+    def get_many(self, user_ids):
+        """
+        Resúmenes de varios usuarios
+
+        Los que no están en caché (o expiraron) se cargan con una sola
+        consulta, leyendo solo las columnas del resumen.
+
+        Args:
+            user_ids: Iterable de IDs (se ignoran los None)
+
+        Returns:
+            dict usuario_id -> {'id', 'username', 'nombre_completo'}
+            (los usuarios inexistentes no aparecen)
+        """
+        now = time.monotonic()
+        summaries = {}
+        missing = set()
+
+        with self._lock:
+            for user_id in set(user_ids):
+                if user_id is None:
+                    continue
+                entry = self._entries.get(user_id)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    summaries[user_id] = entry[1]
+                else:
+                    missing.add(user_id)
+
+        if missing:
+            usuarios = (
+                Usuario.query
+                .options(load_only(Usuario.id, Usuario.username, Usuario.nombre, Usuario.apellido))
+                .filter(Usuario.id.in_(missing))
+                .all()
+            )
+            with self._lock:
+                for usuario in usuarios:
+                    summary = self.summarize(usuario)
+                    summaries[usuario.id] = summary
+                    self._entries[usuario.id] = (now + self.ttl, summary)
+                    self._entries.move_to_end(usuario.id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        return summaries
+
+    def invalidate(self, user_id=None):
+        """Olvidar un usuario (o todos si user_id es None)"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    @staticmethod
+    def summarize(usuario):
+        """Resumen público de un Usuario"""
+        return {
+            'id': usuario.id,
+            'username': usuario.username,
+            'nombre_completo': f"{usuario.nombre} {usuario.apellido}"
+        }
+
+
+# Instancia global de la caché
+user_summary_cache = UserSummaryCache()
@@ -0,0 +1,99 @@
+"""
+Fixtures comunes de las pruebas - ESPE MedSafe Backend
+
+Ejecutar desde Semana3_Backend:
+    python -m pytest tests
+"""
+import os
+import sys
+import base64
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import TestingConfig
+from models.base import db as _db
+from models.user import Usuario
+from services.audit_queue import audit_queue
+from services.crypto_service import get_crypto_service
+from utils.validators import validate_cedula_ecuador
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """Aplicación de pruebas con SQLite en archivo y directorios temporales"""
+    base = tmp_path_factory.mktemp('medsafe')
+
+    class Config(TestingConfig):
+        # En archivo: el hilo de auditoría usa otra conexión
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{base / 'test.db'}"
+        SQLALCHEMY_ECHO = False
+        JWT_SECRET_KEY = 'clave-jwt-de-pruebas-' + 'x' * 32
+        AES_MASTER_KEY = base64.b64encode(b'k' * 32).decode()
+        BCRYPT_LOG_ROUNDS = 4
+        BCRYPT_MIN_ROUNDS = 4
+        AUDIT_SPOOL_DIR = str(base / 'audit_spool')
+        AUDIT_ARCHIVE_DIR = str(base / 'audit_archive')
+        IMPORT_REJECTS_DIR = str(base / 'imports')
+        BACKUP_DIR = str(base / 'backups')
+
+    app = create_app(Config)
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def db(app):
+    """Tablas vacías para cada prueba"""
+    _db.create_all()
+    yield _db
+    audit_queue.flush()
+    _db.session.remove()
+    _db.drop_all()
+
+
+@pytest.fixture
+def client(app, db):
+    return app.test_client()
+
+
+@pytest.fixture
+def cedulas():
+    """Cédulas ecuatorianas válidas y distintas"""
+    return (
+        cedula for cedula in (f'17{n:08d}' for n in range(1000000, 2000000))
+        if validate_cedula_ecuador(cedula)
+    )
+
+
+@pytest.fixture
+def make_user(db, cedulas):
+    """Crear usuarios con cédulas válidas distintas"""
+    def make(username, rol='doctor'):
+        usuario = Usuario(
+            username=username,
+            password_hash=get_crypto_service().hash_password('Secret123!'),
+            rol=rol, nombre='Nombre', apellido='Apellido',
+            email=f'{username}@espe.edu.ec', cedula=next(cedulas), activo=True
+        )
+        db.session.add(usuario)
+        db.session.commit()
+        return usuario
+
+    return make
+
+
+@pytest.fixture
+def auth_headers(app):
+    """Cabecera Authorization para un usuario"""
+    from flask_jwt_extended import create_access_token
+
+    def headers(usuario):
+        token = create_access_token(
+            identity=str(usuario.id),
+            additional_claims={'username': usuario.username, 'rol': usuario.rol}
+        )
+        return {'Authorization': f'Bearer {token}'}
+
+    return headers
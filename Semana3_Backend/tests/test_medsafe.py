@@ -0,0 +1,64 @@
+"""
+Pruebas de los comandos de mantenimiento (medsafe.py)
+"""
+from datetime import date
+from medsafe import migrate_records
+from models.patient import Paciente
+from models.medical_record import HistoriaClinica
+from services.medical_record_service import (
+    MedicalRecordService, CIFRADO_CBC, CIFRADO_PAQUETE_ID
+)
+
+
+def legacy_record(db, paciente, doctor, diagnostico):
+    """Historia en el formato heredado AES-CBC + SHA-256"""
+    fecha = date(2024, 1, 15)
+    columns = MedicalRecordService.encrypt_fields(
+        paciente.id, doctor.id, fecha,
+        {'sintomas': 'Fiebre', 'diagnostico': diagnostico, 'tratamiento': 'Reposo', 'notas': 'Control en 7 días'},
+        version=CIFRADO_CBC
+    )
+    record = HistoriaClinica(paciente_id=paciente.id, doctor_id=doctor.id, fecha_consulta=fecha, **columns)
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+
+def setup_records(db, make_user, cedulas):
+    doctor = make_user('doctor1')
+    paciente = Paciente(cedula=next(cedulas), nombre='Ana', apellido='Paz',
+                        fecha_nacimiento=date(1990, 1, 1))
+    db.session.add(paciente)
+    db.session.commit()
+
+    valid = legacy_record(db, paciente, doctor, 'Gripe')
+    tampered = legacy_record(db, paciente, doctor, 'Faringitis')
+    tampered.hash_integridad = '0' * 64
+    db.session.commit()
+    return valid.id, tampered.id
+
+
+def test_migrate_keeps_mismatched_records_in_legacy_format(db, make_user, cedulas):
+    valid_id, tampered_id = setup_records(db, make_user, cedulas)
+
+    migrated, mismatches, failed = migrate_records(target_version=CIFRADO_PAQUETE_ID)
+
+    assert (migrated, mismatches, failed) == (1, [tampered_id], [])
+    db.session.expire_all()
+    assert db.session.get(HistoriaClinica, valid_id).version_cifrado == CIFRADO_PAQUETE_ID
+    tampered = db.session.get(HistoriaClinica, tampered_id)
+    assert tampered.version_cifrado == CIFRADO_CBC
+    assert tampered.hash_integridad == '0' * 64
+
+    # Una segunda pasada la sigue reportando sin tocarla
+    assert migrate_records(target_version=CIFRADO_PAQUETE_ID) == (0, [tampered_id], [])
+
+
+def test_migrate_force_mismatched_reencrypts(db, make_user, cedulas):
+    _, tampered_id = setup_records(db, make_user, cedulas)
+
+    migrated, mismatches, _ = migrate_records(target_version=CIFRADO_PAQUETE_ID, force_mismatched=True)
+
+    assert (migrated, mismatches) == (2, [tampered_id])
+    db.session.expire_all()
+    assert db.session.get(HistoriaClinica, tampered_id).version_cifrado == CIFRADO_PAQUETE_ID
@@ -0,0 +1,56 @@
+"""
+Pruebas de pacientes (/patients)
+"""
+from datetime import date
+from sqlalchemy import event
+from models.patient import Paciente
+from models.medical_record import HistoriaClinica
+from services.medical_record_service import MedicalRecordService
+
+
+def count_queries(db):
+    """Lista que acumula las sentencias SQL ejecutadas"""
+    statements = []
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    return statements, lambda: event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_timeline_query_count_does_not_grow_with_records(client, db, make_user, auth_headers, cedulas):
+    doctor = make_user('doctor1')
+    paciente = Paciente(cedula=next(cedulas), nombre='Ana', apellido='Paz',
+                        fecha_nacimiento=date(1990, 1, 1))
+    db.session.add(paciente)
+    db.session.commit()
+
+    for day in range(1, 6):
+        record = HistoriaClinica(paciente_id=paciente.id, doctor_id=doctor.id,
+                                 fecha_consulta=date(2024, 1, day), hash_integridad='')
+        db.session.add(record)
+        db.session.flush()
+        columns = MedicalRecordService.encrypt_fields(
+            paciente.id, doctor.id, record.fecha_consulta,
+            {'sintomas': 'Fiebre', 'diagnostico': f'Consulta {day}', 'tratamiento': 'Reposo'},
+            record_id=record.id
+        )
+        for column, value in columns.items():
+            setattr(record, column, value)
+    db.session.commit()
+    headers = auth_headers(doctor)
+    patient_id = paciente.id
+    db.session.expunge_all()
+
+    for query_string in ('fields=id&decrypt=none', 'decrypt=summary', ''):
+        statements, stop = count_queries(db)
+        response = client.get(f'/api/v1/patients/{patient_id}/timeline?{query_string}', headers=headers)
+        stop()
+
+        assert response.status_code == 200
+        historias = response.json['data']['historias']
+        assert len(historias) == 5
+        # Paciente, historias y recetas (más el usuario del token, si se consulta)
+        assert len(statements) <= 4, statements
+        assert [h['id'] for h in historias] == sorted((h['id'] for h in historias), reverse=True)
@@ -0,0 +1,57 @@
+"""
+Pruebas de la gestión de usuarios (/users)
+"""
+from models.audit_log import AuditLog
+from models.user import Usuario
+from services.audit_queue import audit_queue
+
+
+def create_doctor(client, headers, cedula):
+    response = client.post('/api/v1/users', json={
+        'username': 'doctor1', 'password': 'Secret123!', 'rol': 'doctor',
+        'nombre': 'Ana', 'apellido': 'Paz', 'email': 'doctor1@espe.edu.ec', 'cedula': cedula
+    }, headers=headers)
+    assert response.status_code == 201
+    return response.json['data']['id']
+
+
+def test_delete_user_deactivates_and_keeps_audit(client, db, make_user, auth_headers, cedulas):
+    admin = make_user('admin', rol='admin')
+    headers = auth_headers(admin)
+    doctor_id = create_doctor(client, headers, next(cedulas))
+    audit_queue.flush()
+    assert AuditLog.query.filter_by(usuario_id=doctor_id).count() > 0
+
+    response = client.delete(f'/api/v1/users/{doctor_id}', headers=headers)
+
+    assert response.status_code == 200
+    assert response.json['data']['activo'] is False
+    assert db.session.get(Usuario, doctor_id).activo is False
+
+    audit_queue.flush()
+    assert AuditLog.query.filter_by(usuario_id=doctor_id).count() > 0
+    assert AuditLog.query.filter_by(usuario_id=admin.id, accion='DEACTIVATE_USER').count() == 1
+
+    # Repetir la baja no falla ni vuelve a auditarse
+    assert client.delete(f'/api/v1/users/{doctor_id}', headers=headers).status_code == 200
+    audit_queue.flush()
+    assert AuditLog.query.filter_by(accion='DEACTIVATE_USER').count() == 1
+
+
+def test_deactivated_user_cannot_login(client, db, make_user, auth_headers, cedulas):
+    admin = make_user('admin', rol='admin')
+    doctor_id = create_doctor(client, auth_headers(admin), next(cedulas))
+    credentials = {'username': 'doctor1', 'password': 'Secret123!'}
+    assert client.post('/api/v1/auth/login', json=credentials).status_code == 200
+
+    client.delete(f'/api/v1/users/{doctor_id}', headers=auth_headers(admin))
+
+    assert client.post('/api/v1/auth/login', json=credentials).status_code == 401
+
+
+def test_delete_user_not_found_and_requires_admin(client, db, make_user, auth_headers):
+    admin = make_user('admin', rol='admin')
+    doctor = make_user('doctor2')
+
+    assert client.delete('/api/v1/users/9999', headers=auth_headers(admin)).status_code == 404
+    assert client.delete(f'/api/v1/users/{admin.id}', headers=auth_headers(doctor)).status_code == 403
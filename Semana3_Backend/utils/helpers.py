@@ -2,7 +2,10 @@
 Funciones de Ayuda
 """
 from datetime import datetime, date
+from flask import current_app, Response, stream_with_context
 import base64
+import hashlib
+import json
 
 
 def calculate_age(birth_date):
@@ -100,6 +103,294 @@ def paginate_query(query, page=1, per_page=10):
     }
 
 
+def get_page_size(args, default=None):
+    """
+    Obtener tamaño de página (limit) de los parámetros de la petición
+    Acotado entre 1 y Config.MAX_PAGE_SIZE
+    """
+    max_size = current_app.config.get('MAX_PAGE_SIZE', 100)
+    if default is None:
+        default = current_app.config.get('DEFAULT_PAGE_SIZE', 10)
+    
+    try:
+        limit = int(args.get('limit', default))
+    except (TypeError, ValueError):
+        limit = default
+    
+    return max(1, min(limit, max_size))
+
+
+def paginate_keyset(query, column, after=None, limit=10):
+    """
+    Paginar query de SQLAlchemy por cursor (keyset)
+    Filtra por column > after en lugar de usar OFFSET, así el costo de cada
+    página no depende de su posición. column debe ser única y ordenable (id).
+    Retorna diccionario con items y metadata de paginación
+    """
+    if after is not None:
+        query = query.filter(column > after)
+    
+    # Pedir un elemento extra para saber si hay página siguiente
+    items = query.order_by(column.asc()).limit(limit + 1).all()
+    has_next = len(items) > limit
+    items = items[:limit]
+    
+    return {
+        'items': items,
+        'pagination': {
+            'limit': limit,
+            'after_id': after,
+            'next_cursor': getattr(items[-1], column.key) if has_next else None,
+            'has_next': has_next
+        }
+    }
+
+
+def encode_cursor(*values):
+    """
+    Codificar un cursor opaco (base64 URL-safe) a partir de valores
+    Las fechas se guardan en ISO 8601
+    """
+    raw = '|'.join(v.isoformat() if isinstance(v, (datetime, date)) else str(v) for v in values)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, parts):
+    """
+    Decodificar un cursor de encode_cursor
+    Retorna la lista de valores como strings
+    Lanza ValueError si el cursor no es válido
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8').split('|')
+    except (ValueError, UnicodeError):
+        raise ValueError('Cursor inválido')
+    if len(values) != parts:
+        raise ValueError('Cursor inválido')
+    return values
+
+
+def paginate_keyset_desc(query, columns, before=None, limit=10):
+    """
+    Paginar query de SQLAlchemy por cursor compuesto, de más reciente a más antiguo
+    Filtra por (col1, col2, ...) < before como comparación de tuplas, que usa
+    el índice compuesto sin OFFSET. La última columna debe ser única (id).
+    Retorna diccionario con items y metadata de paginación
+    """
+    from models.base import db
+    
+    if before is not None:
+        query = query.filter(db.tuple_(*columns) < db.tuple_(*before))
+    
+    items = query.order_by(*(column.desc() for column in columns)).limit(limit + 1).all()
+    has_next = len(items) > limit
+    items = items[:limit]
+    
+    next_cursor = None
+    if has_next:
+        next_cursor = encode_cursor(*(getattr(items[-1], column.key) for column in columns))
+    
+    return {
+        'items': items,
+        'pagination': {
+            'limit': limit,
+            'next_cursor': next_cursor,
+            'has_next': has_next
+        }
+    }
+
+
+def estimate_count(query):
+    """
+    Estimación del número de filas de una query según el planificador
+    Solo PostgreSQL (EXPLAIN); retorna None si no hay estimación disponible
+    """
+    from sqlalchemy import text
+    from models.base import db
+    
+    bind = db.session.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return None
+    
+    try:
+        sql = query.statement.compile(bind, compile_kwargs={'literal_binds': True})
+        plan = db.session.execute(text(f'EXPLAIN (FORMAT JSON) {sql}')).scalar()
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        print(f"⚠️  No se pudo estimar el total: {str(e)}")
+        return None
+
+
+TOTAL_MODES = ('estimate', 'exact', 'none')
+
+
+DECRYPT_MODES = ('none', 'summary', 'all')
+
+
+def parse_projection(args, plain_fields, encrypted_fields, summary_fields=()):
+    """
+    Interpretar ?fields= y ?decrypt=none|summary|all de una petición
+    Sin fields se devuelven todos los campos en claro (id siempre); decrypt decide qué
+    campos cifrados se incluyen (all por defecto, summary solo summary_fields).
+    Retorna (campos_en_claro, campos_cifrados) en el orden declarado
+    Lanza ValueError si algún campo o modo no es válido
+    """
+    decrypt = args.get('decrypt', 'all')
+    if decrypt not in DECRYPT_MODES:
+        raise ValueError(f'decrypt debe ser uno de: {", ".join(DECRYPT_MODES)}')
+    
+    if decrypt == 'all':
+        allowed = tuple(encrypted_fields)
+    elif decrypt == 'summary':
+        allowed = tuple(summary_fields)
+    else:
+        allowed = ()
+    
+    fields = args.get('fields')
+    if not fields:
+        return tuple(plain_fields), allowed
+    
+    requested = {f.strip() for f in fields.split(',') if f.strip()}
+    requested.add('id')  # Necesario para el cursor de paginación
+    unknown = requested - set(plain_fields) - set(encrypted_fields)
+    if unknown:
+        raise ValueError(f'Campos desconocidos: {", ".join(sorted(unknown))}')
+    
+    return (
+        tuple(f for f in plain_fields if f in requested),
+        tuple(f for f in allowed if f in requested)
+    )
+
+
+def parse_date_range(args):
+    """
+    Interpretar ?desde=&hasta= (fechas ISO 8601, ambas inclusive)
+    Retorna (desde, hasta) como date o None
+    Lanza ValueError si alguna fecha no es válida o desde > hasta
+    """
+    bounds = []
+    for name in ('desde', 'hasta'):
+        value = args.get(name)
+        try:
+            bounds.append(date.fromisoformat(value[:10]) if value else None)
+        except ValueError:
+            raise ValueError(f'{name} debe ser una fecha ISO 8601 (AAAA-MM-DD)')
+    
+    desde, hasta = bounds
+    if desde and hasta and desde > hasta:
+        raise ValueError('desde debe ser anterior a hasta')
+    return desde, hasta
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_stream(request):
+    """
+    Indicar si la petición pide exportación en streaming
+    (?stream=1 o Accept: application/x-ndjson)
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def get_stream_batch_size():
+    """Filas por lote al exportar en streaming (Config.STREAM_BATCH_SIZE)"""
+    return max(1, current_app.config.get('STREAM_BATCH_SIZE', 200))
+
+
+def iter_batches(query, batch_size):
+    """
+    Recorrer una query por lotes con yield_per
+    En PostgreSQL usa un cursor del servidor: nunca hay más de batch_size
+    filas en memoria
+    """
+    batch = []
+    for item in query.yield_per(batch_size):
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ndjson_response(batches):
+    """
+    Respuesta NDJSON (un objeto JSON por línea) que se envía a medida que
+    se produce cada lote de dicts
+    Si falla a mitad de la exportación, la última línea es un objeto con
+    success=false para que el cliente detecte que está incompleta
+    """
+    def generate():
+        try:
+            for batch in batches:
+                yield ''.join(json.dumps(item, ensure_ascii=False, default=str) + '\n' for item in batch)
+        except Exception as e:
+            print(f"❌ Error exportando en streaming: {str(e)}")
+            yield json.dumps({'success': False, 'error': 'Exportación interrumpida'}) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+def make_etag(*parts):
+    """
+    Valor de ETag fuerte (sin comillas) a partir de las partes que
+    identifican una versión de un recurso (bytes en hex, fechas en ISO 8601)
+    """
+    raw = '|'.join(
+        part.hex() if isinstance(part, bytes)
+        else part.isoformat() if isinstance(part, (datetime, date))
+        else str(part)
+        for part in parts
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:32]
+
+
+def with_etag(response, etag, weak=False):
+    """
+    Agregar ETag a una respuesta; Cache-Control obliga al cliente a
+    revalidar (If-None-Match) y prohíbe cachés compartidas
+    """
+    response.set_etag(etag, weak)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified(request, etag, weak=False):
+    """
+    Respuesta 304 si If-None-Match de la petición incluye etag
+    Retorna None si el cliente no tiene la versión actual
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(Response(status=304), etag, weak)
+
+
+def collection_etag(request, items, columns, *parts):
+    """
+    ETag de una página de un listado, calculado tras paginar y antes de
+    descifrar, sin consultas extra: query string normalizado (cursor,
+    limit, filtros, ?fields= y ?decrypt=), parts (p. ej. la paginación o
+    el usuario de /mine) y las columnas de versión de las filas devueltas
+    
+    Es débil si la respuesta es una proyección (?fields= o ?decrypt=):
+    solo cubre las columnas de versión, no los campos devueltos.
+    
+    Returns:
+        Tupla (etag, weak)
+    """
+    args = sorted(request.args.items(multi=True))
+    weak = any(request.args.get(name) for name in ('fields', 'decrypt'))
+    etag = make_etag(
+        *args, *parts,
+        *(getattr(item, column) for item in items for column in columns)
+    )
+    return etag, weak
+
+
 def get_client_ip(request):
     """Obtener IP del cliente desde request"""
     # Verificar headers de proxy
@@ -121,14 +121,15 @@ const Users = () => {
   }
 
   const handleDelete = async (id) => {
-    if (window.confirm('¿Está seguro de eliminar este usuario?')) {
+    // Baja lógica: el backend desactiva al usuario y conserva su historial de auditoría
+    if (window.confirm('¿Está seguro de dar de baja a este usuario? Quedará inactivo y no podrá iniciar sesión.')) {
       try {
         await userService.delete(id)
-        setSuccess('Usuario eliminado exitosamente')
+        setSuccess('Usuario dado de baja exitosamente')
         loadUsers()
         setTimeout(() => setSuccess(''), 3000)
       } catch (err) {
-        setError('Error al eliminar usuario: ' + err.message)
+        setError('Error al dar de baja al usuario: ' + err.message)
       }
     }
   }
@@ -214,13 +215,16 @@ const Users = () => {
                 >
                   <i className={`bi bi-${user.activo ? 'x-circle' : 'check-circle'}`}></i>
                 </Button>
-                <Button 
-                  variant="danger" 
-                  size="sm"
-                  onClick={() => handleDelete(user.id)}
-                >
-                  <i className="bi bi-trash"></i>
-                </Button>
+                {user.activo && (
+                  <Button 
+                    variant="danger" 
+                    size="sm"
+                    title="Dar de baja"
+                    onClick={() => handleDelete(user.id)}
+                  >
+                    <i className="bi bi-person-x"></i>
+                  </Button>
+                )}
               </td>
             </tr>
           ))}
@@ -1,5 +1,27 @@
 import api from './api'
 
+// Tamaño máximo de página aceptado por el backend (MAX_PAGE_SIZE)
+const PAGE_SIZE = 100
+
+// Recorrer todas las páginas de un listado paginado por cursor (after_id)
+async function getAllPages(url, params = {}) {
+  const items = []
+  let afterId = params.after_id
+  do {
+    const response = await api.get(url, {
+      params: { limit: PAGE_SIZE, ...params, after_id: afterId }
+    })
+    const page = response.data
+    if (!page.pagination) {
+      // Respuesta sin paginación: devolverla tal cual
+      return page.data || page || []
+    }
+    items.push(...(page.data || []))
+    afterId = page.pagination.has_next ? page.pagination.next_cursor : null
+  } while (afterId != null)
+  return items
+}
+
 export const authService = {
   async login(username, password) {
     const response = await api.post('/auth/login', { username, password })
@@ -78,8 +100,7 @@ export const userService = {
 
 export const patientService = {
   async getAll(params = {}) {
-    const response = await api.get('/patients', { params })
-    return response.data.data || response.data
+    return getAllPages('/patients', params)
   },
 
   async getById(id) {
@@ -111,9 +132,8 @@ export const patientService = {
 }
 
 export const medicalRecordService = {
-  async getAll() {
-    const response = await api.get('/medical-records')
-    return response.data || []
+  async getAll(params = {}) {
+    return getAllPages('/medical-records', params)
   },
 
   async getById(id) {